@@ -0,0 +1,155 @@
+import argparse
+import os
+import secrets
+import socket
+import struct
+from urllib.parse import quote
+
+from connection import read_response
+
+# Configuration
+MAX_PARTS = 32                  # Paths one batch may ask for
+MAX_BYTES = 8 * 1024 * 1024     # Body bytes one batch may return; later parts get a 413
+FORMATS = ('multipart', 'frames')
+
+# frames: per part, this header, the UTF-8 path, then the body
+FRAME = struct.Struct('>HHI')   # status code, path length, body length
+FRAMES_CONTENT_TYPE = 'application/x-batch-frames'
+
+REASONS = {200: 'OK', 404: 'Not Found', 413: 'Payload Too Large'}
+
+
+class BatchPart:
+    """One requested path and where its body comes from.
+
+    content holds bytes already in memory (a cached file or a bundle slice);
+    file and offset point at the same bytes on disk for sendfile(), or at a
+    file too large to cache.
+    """
+
+    __slots__ = ('path', 'status', 'size', 'content', 'file', 'offset', 'owned')
+
+    def __init__(self, path, status, size=0, content=None, file=None, offset=0, owned=False):
+        self.path = path
+        self.status = status
+        self.size = size
+        self.content = content
+        self.file = file
+        self.offset = offset
+        self.owned = owned  # The file was opened for this part and is closed with it
+
+    def close(self):
+        if self.owned and self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class BatchEncoder:
+    """Framing of a batch response.
+
+    multipart is multipart/mixed with one application/http part per path,
+    each holding its own status line, so a missing file is a 404 inside a
+    200 batch. frames is FRAME headers followed by path and body, for
+    clients that would rather not parse MIME.
+    """
+
+    def __init__(self, format):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown batch format {format!r}")
+        self.format = format
+        self.boundary = secrets.token_hex(16)
+
+    @property
+    def content_type(self):
+        if self.format == 'frames':
+            return FRAMES_CONTENT_TYPE
+        return f"multipart/mixed; boundary={self.boundary}"
+
+    def part_head(self, index, part):
+        if self.format == 'frames':
+            path = part.path.encode('utf-8')
+            return FRAME.pack(part.status, len(path), part.size) + path
+        return (f"--{self.boundary}\r\nContent-Type: application/http\r\nContent-ID: <{index}>\r\n"
+                f"Content-Location: {quote(part.path, safe='/?=&')}\r\n\r\n"
+                f"HTTP/1.1 {part.status} {REASONS.get(part.status, '')}\r\n"
+                f"Content-Length: {part.size}\r\n\r\n").encode('latin-1')
+
+    def part_tail(self):
+        return b'' if self.format == 'frames' else b'\r\n'
+
+    def closing(self):
+        return b'' if self.format == 'frames' else f"--{self.boundary}--\r\n".encode('latin-1')
+
+
+def read_frames(body):
+    """Split a frames body into (status, path, body) tuples."""
+    parts = []
+    position = 0
+    while position < len(body):
+        status, path_length, size = FRAME.unpack_from(body, position)
+        position += FRAME.size
+        path = body[position:position + path_length].decode('utf-8')
+        position += path_length
+        parts.append((status, path, body[position:position + size]))
+        position += size
+    return parts
+
+
+def read_multipart(body, boundary):
+    """Split a multipart batch body into (status, path, body) tuples."""
+    parts = []
+    delimiter = f"--{boundary}".encode('latin-1')
+    for section in body.split(delimiter)[1:]:
+        if section.startswith(b'--'):
+            break
+        headers, _, http = section[2:].partition(b'\r\n\r\n')
+        path = next((line.split(b':', 1)[1].strip().decode('latin-1') for line in headers.split(b'\r\n')
+                     if line.lower().startswith(b'content-location:')), None)
+        head, _, content = http.partition(b'\r\n\r\n')
+        status = int(head.split(b' ', 2)[1])
+        length = next(int(line.split(b':', 1)[1]) for line in head.split(b'\r\n')[1:]
+                      if line.lower().startswith(b'content-length:'))
+        parts.append((status, path, content[:length]))
+    return parts
+
+
+def fetch(host, port, paths, format='multipart', batch_path='/_batch'):
+    """Fetch paths in one batch request; return (status, [(status, path, body)])."""
+    query = '&'.join(f"path={quote(path, safe='/')}" for path in paths)
+    request = f"GET {batch_path}?{query}&format={format} HTTP/1.1\r\nHost: {host}\r\n\r\n"
+    with socket.create_connection((host, port)) as sock:
+        sock.sendall(request.encode('latin-1'))
+        headers, body = {}, bytearray()
+        status, _, _ = read_response(sock, headers, body)
+    if status != 200:
+        return status, []
+    content_type = headers.get('content-type', '')
+    if content_type == FRAMES_CONTENT_TYPE:
+        return status, read_frames(bytes(body))
+    return status, read_multipart(bytes(body), content_type.partition('boundary=')[2])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch several static files in one batch request.")
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--format', choices=FORMATS, default='multipart')
+    parser.add_argument('--out', help="directory to write the fetched files to")
+    args = parser.parse_args()
+
+    status, parts = fetch(args.host, args.port, args.paths, args.format)
+    if status != 200:
+        print(f"Batch failed with status {status}")
+        return
+    for part_status, path, body in parts:
+        print(f"{part_status}  {len(body):>10}  {path}")
+        if args.out and part_status == 200:
+            target = os.path.join(args.out, path.lstrip('/'))
+            os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+            with open(target, 'wb') as file:
+                file.write(body)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import socket
+import sys
+import threading
+import time
+
+from connection import read_response
+from harness import HOST, start_server
+from sockopts import DEFAULT_SOCKET_OPTIONS
+
+# Configuration
+BENCH_PATH = '/index.html'
+CONCURRENCY = 8          # Keep-alive client connections
+REQUESTS_PER_CLIENT = 200
+BURST_SIZE = 256         # Connections opened at once for the backlog test
+
+# Every option switched off, with the historical listen(5) backlog
+BASELINE_OPTIONS = {name: False for name in DEFAULT_SOCKET_OPTIONS}
+BASELINE_OPTIONS['backlog'] = 5
+
+# Each option is measured on its own on top of the baseline, then all defaults together
+SCENARIOS = [
+    ('baseline', {}),
+    ('reuse_addr', {'reuse_addr': True}),
+    ('backlog', {'backlog': DEFAULT_SOCKET_OPTIONS['backlog']}),
+    ('nodelay', {'nodelay': True}),
+    ('defer_accept', {'defer_accept': DEFAULT_SOCKET_OPTIONS['defer_accept']}),
+    ('fastopen', {'fastopen': DEFAULT_SOCKET_OPTIONS['fastopen']}),
+    ('buffers', {'sndbuf': 256 * 1024, 'rcvbuf': 256 * 1024}),
+    ('defaults', dict(DEFAULT_SOCKET_OPTIONS)),
+]
+
+
+def keepalive_client(port, count, latencies):
+    """Send count requests over one persistent connection, recording latencies."""
+    request = f"GET {BENCH_PATH} HTTP/1.1\r\nHost: {HOST}\r\n\r\n".encode()
+    with socket.create_connection((HOST, port)) as sock:
+        for _ in range(count):
+            start = time.perf_counter()
+            sock.sendall(request)
+            read_response(sock)
+            latencies.append(time.perf_counter() - start)
+
+
+def burst_client(port, errors):
+    """Open a connection, make one request and close it."""
+    request = f"GET {BENCH_PATH} HTTP/1.1\r\nHost: {HOST}\r\n\r\n".encode()
+    try:
+        with socket.create_connection((HOST, port), timeout=5) as sock:
+            sock.sendall(request)
+            read_response(sock)
+    except OSError:
+        errors.append(1)
+
+
+def run_threads(target, args_list):
+    threads = [threading.Thread(target=target, args=args) for args in args_list]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_scenario(overrides):
+    """Benchmark one option set; return (req/s, p50 ms, p99 ms, burst errors, burst ms)."""
+    options = dict(BASELINE_OPTIONS)
+    options.update(overrides)
+    server_socket = start_server(options)
+    port = server_socket.getsockname()[1]
+    try:
+        latencies = []
+        elapsed = run_threads(keepalive_client,
+                              [(port, REQUESTS_PER_CLIENT, latencies)] * CONCURRENCY)
+        errors = []
+        burst_time = run_threads(burst_client, [(port, errors)] * BURST_SIZE)
+    finally:
+        server_socket.close()
+    return (len(latencies) / elapsed, percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000, len(errors), burst_time * 1000)
+
+
+def main():
+    """Measure the impact of each socket option against the untuned baseline."""
+    only = sys.argv[1:]
+    print(f"{'scenario':<14}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'burst err':>11}{'burst ms':>10}")
+    for name, overrides in SCENARIOS:
+        if only and name not in only:
+            continue
+        rps, p50, p99, errors, burst_ms = run_scenario(overrides)
+        print(f"{name:<14}{rps:>10.0f}{p50:>10.2f}{p99:>10.2f}{errors:>11}{burst_ms:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
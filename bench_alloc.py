@@ -0,0 +1,159 @@
+import os
+import statistics
+import tracemalloc
+from datetime import datetime
+
+import server8
+
+# Configuration
+REQUESTS = 2000  # Measured keep-alive requests per run
+WARMUP = 50      # Requests first sent unmeasured, so caches are filled as in a running server
+PATHS = ('/index.html', '/missing.txt')  # A cached file and a 404
+
+# A browser-sized GET
+REQUEST = (
+    "GET {path} HTTP/1.1\r\n"
+    "Host: 127.0.0.1:8080\r\n"
+    "User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0\r\n"
+    "Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+    "Accept-Language: en-US,en;q=0.5\r\n"
+    "Accept-Encoding: gzip, deflate, br\r\n"
+    "Connection: keep-alive\r\n"
+    "Cache-Control: max-age=0\r\n"
+    "\r\n"
+)
+
+
+def legacy_parse_headers(header_lines):
+    headers = {}
+    for line in header_lines:
+        if ': ' in line:
+            key, value = line.split(': ', 1)
+            headers[key.lower()] = value
+    return headers
+
+
+def legacy_format_head(status, content_length, headers=None, close=False):
+    """server8's format_head before the pooled loop: a fresh dict and Date string per response."""
+    server8.note_status(int(status.split()[0]))
+    if headers is None:
+        headers = {}
+    headers['Content-Length'] = content_length
+    headers['Date'] = datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
+    headers['Connection'] = 'keep-alive'
+    header_lines = '\r\n'.join(f"{key}: {value}" for key, value in headers.items())
+    return f"HTTP/1.1 {status}\r\n{header_lines}\r\n\r\n"
+
+
+def legacy_log_request(request, response):
+    """server8's log_request before the pooled loop: strftime() and a buffered file per line."""
+    timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    with server8.log_lock:
+        with open(server8.LOG_FILE, 'a') as log_file:
+            log_file.write(f"[{timestamp}] Request:\n{request}\nResponse:\n{response}\n\n")
+
+
+def legacy_handle_client(conn, addr):
+    """server8's handle_client loop before the pooled loop, without the HTTP/2 branches."""
+    server8.open_account(server8.CONNECTION_MEMORY_BUDGET)
+    try:
+        while True:
+            data = conn.recv(1024)
+            if not data:
+                break
+            trace = server8.begin_trace()
+            with server8.span('parse'):
+                head, _, body = data.partition(b'\r\n\r\n')
+                request = head.decode('utf-8', errors='replace')
+                lines = request.split('\r\n')
+                request_line = lines[0].split()
+                if len(request_line) < 2:
+                    break
+                method, path = request_line[0], request_line[1]
+                headers = legacy_parse_headers(lines[1:])
+            trace.label = f"{method} {path}"
+            with server8.span('handler'), server8.profile_request():
+                server8.dispatch_request(conn, method, path, headers, body)
+            server8.record_request(conn, server8.end_trace(), method, path, headers)
+    finally:
+        server8.end_trace()
+        server8.close_account()
+        conn.close()
+
+
+class ReplaySocket:
+    """Stands in for a client that sends the same request count times, one at a time.
+
+    Each request arrives in one read, so every read is the loop starting
+    its next iteration: that is where the previous one, logging and tracing
+    included, is measured. Everything runs on one thread, so no client
+    activity shows up in the peak.
+    """
+
+    def __init__(self, request, count):
+        self.request = request
+        self.count = count
+        self.iteration = 0
+        self.peaks = []
+        self.start = 0
+
+    def _next_iteration(self):
+        if self.iteration > WARMUP:
+            self.peaks.append(tracemalloc.get_traced_memory()[1] - self.start)
+        tracemalloc.reset_peak()
+        self.start = tracemalloc.get_traced_memory()[0]
+        self.iteration += 1
+        return self.iteration <= WARMUP + self.count
+
+    def recv(self, size):
+        # A new bytes, as socket.recv() returns
+        return bytes(self.request[:size]) if self._next_iteration() else b''
+
+    def recv_into(self, buffer):
+        if not self._next_iteration():
+            return 0
+        buffer[:len(self.request)] = self.request
+        return len(self.request)
+
+    def sendall(self, data):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def close(self):
+        pass
+
+
+def measure(handler, path):
+    """Return the median tracemalloc peak of one loop iteration, in bytes above where it started."""
+    sock = ReplaySocket(bytearray(REQUEST.format(path=path).encode('latin-1')), REQUESTS)
+    tracemalloc.start()
+    handler(sock, ('127.0.0.1', 0))
+    tracemalloc.stop()
+    return statistics.median(sock.peaks)
+
+
+def main():
+    """Compare the memory one request of the old and the pooled handle_client loop allocates at peak."""
+    server8.LOG_FILE = os.devnull  # Keep benchmark traffic out of server.log
+    current = server8.format_head, server8.log_request
+    rows = []
+    for path in PATHS:
+        # The old loop runs with the response and log helpers it had
+        server8.format_head, server8.log_request = legacy_format_head, legacy_log_request
+        try:
+            legacy = measure(legacy_handle_client, path)
+        finally:
+            server8.format_head, server8.log_request = current
+        rows.append((path, legacy, measure(server8.handle_client, path)))
+    print(f"{'path':<16}{'recv + split':>16}{'pooled':>12}{'ratio':>8}")
+    for path, legacy, pooled in rows:
+        print(f"{path:<16}{legacy:>16.0f}{pooled:>12.0f}{legacy / pooled:>8.1f}")
+    print(f"\nMedian tracemalloc peak per request in bytes over {REQUESTS} keep-alive requests: "
+          f"the most memory one pass of handle_client, through dispatch, send, log and trace, "
+          f"had allocated at once.")
+
+
+if __name__ == "__main__":
+    main()
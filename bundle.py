@@ -0,0 +1,240 @@
+import argparse
+import gzip
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Configuration
+BUNDLE_DIR = './bundles'
+COMPRESS_MIN_SIZE = 256     # Smaller entries are stored plain only
+COMPRESS_MAX_RATIO = 0.9    # A gzip copy is kept only if it saves at least 10%
+WATCH_INTERVAL = 2          # Seconds between checks for a new bundle version
+BUNDLE_VERSION = 1
+
+# File layout: header, entry data, JSON index. The header points at the index.
+MAGIC = b'SBUNDLE\0'
+HEADER = struct.Struct('>8sIQQ')  # magic, version, index offset, index length
+
+
+class BundleError(ValueError):
+    """A file is not a readable bundle."""
+
+
+def build(static_dir, bundle_path, compress=True):
+    """Pack every file under static_dir into one bundle; return the number of entries.
+
+    Entries are keyed by request path ('/css/site.css'). With compress, a
+    gzip copy is stored next to each entry it shrinks enough. The bundle is
+    written aside and renamed into place, so a server watching bundle_path
+    only ever sees a complete version. It is stamped with the time the walk
+    started: a file written after that may have been read before the write.
+    """
+    index = {}
+    started = time.time()
+    os.makedirs(os.path.dirname(bundle_path) or '.', exist_ok=True)
+    temporary = f"{bundle_path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, BUNDLE_VERSION, 0, 0))
+        for root, dirs, files in os.walk(static_dir):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                with open(file_path, 'rb') as file:
+                    data = file.read()
+                key = '/' + os.path.relpath(file_path, static_dir).replace(os.sep, '/')
+                entry = [out.tell(), len(data), None, None]
+                out.write(data)
+                if compress and len(data) >= COMPRESS_MIN_SIZE:
+                    packed = gzip.compress(data, 9, mtime=0)
+                    if len(packed) <= len(data) * COMPRESS_MAX_RATIO:
+                        entry[2:] = out.tell(), len(packed)
+                        out.write(packed)
+                index[key] = entry
+        raw_index = json.dumps({'built': started, 'entries': index}, separators=(',', ':')).encode()
+        index_offset = out.tell()
+        out.write(raw_index)
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, BUNDLE_VERSION, index_offset, len(raw_index)))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temporary, bundle_path)
+    return len(index)
+
+
+class StaticBundle:
+    """One bundle version, mapped into memory once.
+
+    lookup() is a dict access, and the bytes are a slice of the map or a
+    sendfile() from the open file at the entry's offset, so serving an entry
+    needs no open, stat or read. Paths in overrides were written on disk
+    after the bundle was built; lookup() leaves them to the filesystem.
+    """
+
+    def __init__(self, bundle_path, overrides=None):
+        self.path = bundle_path
+        self.overrides = overrides if overrides is not None else {}
+        self.file = open(bundle_path, 'rb')
+        try:
+            info = os.fstat(self.file.fileno())
+            self.identity = (info.st_ino, info.st_mtime_ns, info.st_size)
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, index_offset, index_length = HEADER.unpack_from(self.map)
+            if magic != MAGIC or version != BUNDLE_VERSION:
+                raise BundleError(f"{bundle_path} is not a version {BUNDLE_VERSION} bundle")
+            index = json.loads(self.map[index_offset:index_offset + index_length])
+        except BundleError:
+            self.file.close()
+            raise
+        except (OSError, ValueError, struct.error) as e:
+            self.file.close()
+            raise BundleError(f"{bundle_path}: {e}") from e
+        self.view = memoryview(self.map)
+        self.built = index['built']
+        self.entries = {key: tuple(entry) for key, entry in index['entries'].items()}
+
+    def lookup(self, path):
+        """Return (offset, size, gzip offset, gzip size) for a request path, or None."""
+        key = path.partition('?')[0]
+        if key in self.overrides:
+            return None
+        return self.entries.get(key)
+
+    def stats(self):
+        compressed = sum(1 for entry in self.entries.values() if entry[2] is not None)
+        return {
+            'bundle': self.path,
+            'bundle_built': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.built)),
+            'bundle_bytes': len(self.map),
+            'bundle_entries': len(self.entries),
+            'bundle_gzip_entries': compressed,
+        }
+
+
+class BundleStore:
+    """The bundle version being served, swapped whole when a new one is built.
+
+    Requests take current once and serve from that version, so a swap never
+    mixes two versions in one response. An old version is unmapped when the
+    last request using it lets go of it.
+
+    A path written on disk while the server runs is overridden: every
+    version stops serving it until one built after the write is swapped in.
+    """
+
+    def __init__(self, bundle_path):
+        self.path = bundle_path
+        self.lock = threading.Lock()
+        self.overrides = {}  # request path -> time it was written on disk
+        self.current = StaticBundle(bundle_path, self.overrides)
+        self.swaps = 0
+        self.thread = None
+
+    def reload(self):
+        """Map the bundle at path if it changed; return True if the served version was swapped."""
+        with self.lock:
+            try:
+                info = os.stat(self.path)
+            except OSError:
+                return False
+            if (info.st_ino, info.st_mtime_ns, info.st_size) == self.current.identity:
+                return False
+            current = StaticBundle(self.path, self.overrides)
+            # A version whose build started after a write already holds the new bytes
+            for path, written in list(self.overrides.items()):
+                if written < current.built:
+                    del self.overrides[path]
+            self.current = current
+            self.swaps += 1
+        print(f"Serving bundle {self.path} built {self.current.stats()['bundle_built']}")
+        return True
+
+    def override(self, path):
+        """Serve path from disk from now on: it was written after the bundle was built."""
+        with self.lock:
+            self.overrides[path] = time.time()
+
+    def watch(self, interval=WATCH_INTERVAL):
+        """Pick up new versions from a background thread."""
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._watch, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload()
+            except BundleError as e:
+                # Keep serving the old version until the file is readable
+                print(f"Bundle reload failed: {e}")
+
+    def stats(self):
+        return {**self.current.stats(), 'bundle_swaps': self.swaps, 'bundle_overrides': len(self.overrides)}
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding value allows gzip (q=0 refuses it)."""
+    for coding in accept_encoding.lower().split(','):
+        name, _, params = coding.partition(';')
+        if name.strip() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def compare(static_dir, bundle_path, rounds):
+    """Time reading every file from static_dir against slicing it from the bundle."""
+    bundle = StaticBundle(bundle_path)
+    keys = list(bundle.entries)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for key in keys:
+            with open(os.path.join(static_dir, key.lstrip('/')), 'rb') as file:
+                file.read()
+    files_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for key in keys:
+            offset, size, _, _ = bundle.lookup(key)
+            bytes(bundle.view[offset:offset + size])
+    bundle_seconds = time.perf_counter() - start
+    count = rounds * len(keys)
+    return files_seconds / count * 1e6, bundle_seconds / count * 1e6, len(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack a static tree into a bundle for server8.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack = commands.add_parser('build', help="pack a directory into a bundle")
+    pack.add_argument('--static', default='./static')
+    pack.add_argument('--out', default=os.path.join(BUNDLE_DIR, 'static.bundle'))
+    pack.add_argument('--no-gzip', action='store_true', help="store entries uncompressed only")
+    show = commands.add_parser('list', help="print the entries of a bundle")
+    show.add_argument('bundle')
+    bench = commands.add_parser('bench', help="compare per-file reads with bundle lookups")
+    bench.add_argument('bundle')
+    bench.add_argument('--static', default='./static')
+    bench.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        count = build(args.static, args.out, not args.no_gzip)
+        print(f"Packed {count} files into {args.out} in {(time.perf_counter() - start) * 1000:.1f} ms")
+    elif args.command == 'list':
+        bundle = StaticBundle(args.bundle)
+        for key, (offset, size, _, gzip_size) in sorted(bundle.entries.items()):
+            print(f"{offset:>12}{size:>10}{gzip_size if gzip_size is not None else '-':>10}  {key}")
+        print(''.join(f"{key}: {value}\n" for key, value in bundle.stats().items()), end='')
+    else:
+        files_us, bundle_us, count = compare(args.static, args.bundle, args.rounds)
+        print(f"{count} files, {args.rounds} rounds")
+        print(f"open/read/close {files_us:8.2f} us per file")
+        print(f"bundle slice    {bundle_us:8.2f} us per file")
+
+
+if __name__ == "__main__":
+    main()
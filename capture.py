@@ -0,0 +1,91 @@
+import itertools
+import json
+import os
+import threading
+import time
+
+# Configuration
+CAPTURE_DIR = './captures'
+CAPTURE_VERSION = 1
+
+# Credentials never end up in a capture file
+SKIPPED_HEADERS = {'authorization', 'cookie', 'proxy-authorization'}
+
+
+class TrafficCapture:
+    """Records live requests into a JSON Lines replay file.
+
+    The first line is a header; every following line is one request:
+    t (seconds since capture start), c (connection number, for keep-alive
+    grouping), m, p, h (method, path, headers), b (body size), s (status)
+    and d (server-side duration in seconds).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.file = None
+        self.path = None
+        self.started = None
+        self.count = 0
+        self.connection_ids = {}
+        self.next_id = None
+
+    @property
+    def active(self):
+        return self.file is not None
+
+    def start(self, path):
+        """Start recording to path; return False if a capture is already running."""
+        with self.lock:
+            if self.file is not None:
+                return False
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.file = open(path, 'w')
+            self.path = path
+            self.started = time.perf_counter()
+            self.count = 0
+            self.connection_ids = {}
+            self.next_id = itertools.count(1)
+            header = {'capture': CAPTURE_VERSION, 'started': time.time()}
+            self.file.write(json.dumps(header) + '\n')
+        return True
+
+    def stop(self):
+        """Stop recording; return (path, number of requests recorded)."""
+        with self.lock:
+            if self.file is None:
+                return None, 0
+            self.file.close()
+            self.file = None
+            self.connection_ids = {}
+            return self.path, self.count
+
+    def record(self, connection, started, method, path, headers, body_size, status, duration):
+        """Append one request; connection is any object identifying its connection."""
+        if self.file is None:
+            return
+        with self.lock:
+            if self.file is None:
+                return
+            connection_id = self.connection_ids.setdefault(id(connection), next(self.next_id))
+            entry = {
+                't': round(started - self.started, 6),
+                'c': connection_id,
+                'm': method,
+                'p': path,
+                'h': {key: value for key, value in headers.items() if key not in SKIPPED_HEADERS},
+                'b': body_size,
+                's': status,
+                'd': round(duration, 6),
+            }
+            self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            self.count += 1
+
+    def forget(self, connection):
+        """Drop a closed connection so a recycled id() starts a new group."""
+        if self.file is not None:
+            with self.lock:
+                self.connection_ids.pop(id(connection), None)
+
+
+capture = TrafficCapture()
@@ -0,0 +1,403 @@
+import argparse
+import bisect
+import hashlib
+import multiprocessing
+import os
+import socket
+import threading
+from urllib.parse import urlsplit
+
+from http2 import StreamReset
+
+# Configuration
+VIRTUAL_NODES = 160           # Ring points per node; more points spread keys more evenly
+MAX_PEER_CONNECTIONS = 16     # Connections in use to one peer at a time
+PEER_TIMEOUT = 10             # Seconds to connect to or wait on a peer
+FORWARD_CHUNK_SIZE = 64 * 1024
+MAX_PEER_HEAD_SIZE = 64 * 1024
+
+# Marks a request another node already routed, so it is never forwarded twice.
+# Only trusted on connections from a cluster node's address.
+FORWARDED_HEADER = 'X-Cluster-Forwarded'
+
+# Requests that may be sent again after a peer could have received them
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+# Hop-by-hop headers and the ones rebuilt for the peer request
+SKIPPED_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'te', 'transfer-encoding',
+                   'upgrade', 'http2-settings', 'host', 'content-length', FORWARDED_HEADER.lower()}
+
+
+class PeerError(Exception):
+    """A peer failed before any of its response reached the client."""
+
+
+class ClientGone(ConnectionError):
+    """The client went away while its request or response was relayed; no peer is to blame."""
+
+
+def recv_from_client(conn, size):
+    """Read the next piece of a relayed request body, raising ClientGone if the client is gone."""
+    try:
+        chunk = conn.recv(size)
+    except (OSError, StreamReset) as e:
+        raise ClientGone(f"Client connection failed mid-body: {e}") from e
+    if not chunk:
+        raise ClientGone("Client closed the connection mid-body")
+    return chunk
+
+
+def send_to_client(conn, data):
+    """Send part of a relayed response, raising ClientGone if the client is gone."""
+    try:
+        conn.sendall(data)
+    except (OSError, StreamReset) as e:
+        raise ClientGone(f"Client connection failed mid-response: {e}") from e
+
+
+def _idle_alive(sock):
+    """Whether a pooled connection is still usable: nothing waiting on it, not even EOF."""
+    # A socket with a timeout would wait for it, so peek without blocking
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        sock.recv(1, socket.MSG_PEEK)
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.settimeout(timeout)
+    return False  # EOF, or bytes no request asked for
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent-hash ring of node names, each placed at VIRTUAL_NODES points.
+
+    A key belongs to the first node point at or after its hash. Adding a node
+    only takes over the keys between its points and their predecessors, about
+    1/N of the total.
+    """
+
+    def __init__(self, nodes=(), replicas=VIRTUAL_NODES):
+        self.replicas = replicas
+        self.lock = threading.Lock()
+        self.members = set()
+        self._ring = ((), ())  # (sorted points, owner of each point), swapped whole
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self):
+        with self.lock:
+            return sorted(self.members)
+
+    def add(self, node):
+        """Add a node; return False if it is already a member."""
+        with self.lock:
+            if node in self.members:
+                return False
+            self.members.add(node)
+            self._rebuild()
+        return True
+
+    def remove(self, node):
+        with self.lock:
+            if node not in self.members:
+                return False
+            self.members.discard(node)
+            self._rebuild()
+        return True
+
+    def _rebuild(self):
+        points = sorted((_hash(f"{node}#{index}"), node)
+                        for node in self.members for index in range(self.replicas))
+        self._ring = (tuple(point for point, _ in points), tuple(node for _, node in points))
+
+    def owner(self, key):
+        points, owners = self._ring
+        if not points:
+            return None
+        return owners[bisect.bisect_left(points, _hash(key)) % len(points)]
+
+
+def moved_fraction(before, after, keys):
+    """Share of keys whose owner differs between two rings."""
+    return sum(before.owner(key) != after.owner(key) for key in keys) / len(keys)
+
+
+class PeerPool:
+    """Persistent HTTP/1.1 connections to the other nodes, reused across requests."""
+
+    def __init__(self, max_per_peer=MAX_PEER_CONNECTIONS, timeout=PEER_TIMEOUT):
+        self.max_per_peer = max_per_peer
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}   # node -> [socket]
+        self.slots = {}  # node -> BoundedSemaphore of connections in use
+        self.created = 0
+        self.reused = 0
+        self.stale = 0
+
+    def acquire(self, node):
+        """Return (socket, reused); waits while node has max_per_peer connections out.
+
+        Idle connections the peer has already closed are dropped here, so a
+        request that cannot be retried rarely lands on one.
+        """
+        with self.lock:
+            slots = self.slots.setdefault(node, threading.BoundedSemaphore(self.max_per_peer))
+        if not slots.acquire(timeout=self.timeout):
+            raise PeerError(f"No free connection to {node}")
+        with self.lock:
+            idle = self.idle.get(node)
+            while idle:
+                sock = idle.pop()
+                if _idle_alive(sock):
+                    self.reused += 1
+                    return sock, True
+                sock.close()
+                self.stale += 1
+            self.created += 1
+        try:
+            host, port = node.rsplit(':', 1)
+            sock = socket.create_connection((host, int(port)), timeout=self.timeout)
+        except (OSError, ValueError) as e:
+            slots.release()
+            raise PeerError(f"Cannot connect to {node}: {e}") from e
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock, False
+
+    def release(self, node, sock, reusable):
+        """Return a connection; one in an unknown state is closed instead."""
+        if reusable:
+            with self.lock:
+                self.idle.setdefault(node, []).append(sock)
+        else:
+            sock.close()
+        self.slots[node].release()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'peer_connections_created': self.created,
+                'peer_connections_reused': self.reused,
+                'peer_connections_stale': self.stale,
+                'peer_connections_idle': sum(len(idle) for idle in self.idle.values()),
+            }
+
+
+def _read_head(sock):
+    """Read a response head; return (status, head bytes, body bytes read past it, length, keep-alive)."""
+    data = b''
+    while True:
+        head_end = data.find(b'\r\n\r\n')
+        if head_end >= 0:
+            break
+        if len(data) > MAX_PEER_HEAD_SIZE:
+            raise PeerError("Response head too large")
+        chunk = sock.recv(FORWARD_CHUNK_SIZE)
+        if not chunk:
+            raise PeerError("Peer closed the connection")
+        data += chunk
+    lines = data[:head_end].decode('latin-1').split('\r\n')
+    version, _, status = lines[0].partition(' ')
+    length = None
+    keep_alive = version == 'HTTP/1.1'
+    for line in lines[1:]:
+        key, _, value = line.partition(':')
+        key = key.strip().lower()
+        if key == 'content-length':
+            length = int(value)
+        elif key == 'connection':
+            keep_alive = value.strip().lower() != 'close'
+    return status, data[:head_end + 4], data[head_end + 4:], length, keep_alive
+
+
+class Cluster:
+    """This node's view of the cluster: the ring and the connections to its peers."""
+
+    def __init__(self, node, nodes, replicas=VIRTUAL_NODES):
+        self.node = node
+        self.ring = HashRing(nodes, replicas)
+        self.ring.add(node)
+        self.pool = PeerPool()
+        self.lock = threading.Lock()
+        self.addresses = {}  # node host -> resolved address
+        self.forwarded = 0  # Requests sent on to their owner
+        self.failed = 0     # Forwards that ended in a 502
+
+    def is_peer(self, address):
+        """Whether a client address is the address of a cluster node."""
+        if address is None:
+            return False
+        for node in self.ring.nodes:
+            host = node.rsplit(':', 1)[0]
+            resolved = self.addresses.get(host)
+            if resolved is None:
+                try:
+                    resolved = socket.gethostbyname(host)
+                except OSError:
+                    continue
+                self.addresses[host] = resolved
+            if resolved == address:
+                return True
+        return False
+
+    def owner(self, path, headers, client=None):
+        """Node that should serve path, or None when it is served here.
+
+        client is the address the request came from; FORWARDED_HEADER only
+        stops the request here when that is a cluster node.
+        """
+        if FORWARDED_HEADER.lower() in headers and self.is_peer(client):
+            return None
+        owner = self.ring.owner(urlsplit(path).path)
+        return None if owner in (None, self.node) else owner
+
+    def _request_head(self, node, method, path, headers, content_length):
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {node}", f"{FORWARDED_HEADER}: {self.node}"]
+        lines += [f"{key}: {value}" for key, value in headers.items() if key not in SKIPPED_HEADERS]
+        if content_length or method == 'POST':
+            lines.append(f"Content-Length: {content_length}")
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    def forward(self, conn, node, method, path, headers, body):
+        """Relay one request to node and stream its response back to conn.
+
+        The request body is copied from conn as it arrives and the response
+        is relayed chunk by chunk, so neither is buffered whole. Returns the
+        peer's status, e.g. '201 Created'. A pooled connection that turns
+        out to be stale is replaced by another one, as long as no body bytes
+        have been read from the client yet and the peer cannot have acted on
+        the request: it was never sent, or sending it again is harmless.
+        A client that goes away raises ClientGone, which is neither retried
+        nor counted against the peer.
+        """
+        content_length = int(headers.get('content-length') or 0)
+        request_head = self._request_head(node, method, path, headers, content_length)
+        body = body[:content_length]
+        remaining = content_length - len(body)
+        while True:
+            sock, reused = self.pool.acquire(node)
+            reusable = False
+            sent = False
+            try:
+                try:
+                    sock.sendall(request_head + body)
+                    sent = True
+                    while remaining > 0:
+                        chunk = recv_from_client(conn, min(FORWARD_CHUNK_SIZE, remaining))
+                        remaining -= len(chunk)
+                        sock.sendall(chunk)
+                    status, head, rest, length, keep_alive = _read_head(sock)
+                except ClientGone:
+                    raise
+                except (OSError, PeerError) as e:
+                    if (reused and remaining == content_length - len(body)
+                            and (not sent or method in IDEMPOTENT_METHODS)):
+                        continue
+                    with self.lock:
+                        self.failed += 1
+                    if isinstance(e, PeerError):
+                        raise
+                    raise PeerError(str(e)) from e
+
+                # From here on the client has part of the response: no retry, no 502
+                if method == 'HEAD' or length is None:
+                    length, keep_alive = 0, keep_alive and length is not None
+                send_to_client(conn, head + rest[:length])
+                received = min(len(rest), length)
+                while received < length:
+                    chunk = sock.recv(min(FORWARD_CHUNK_SIZE, length - received))
+                    if not chunk:
+                        raise ConnectionError(f"{node} closed the connection mid-response")
+                    send_to_client(conn, chunk)
+                    received += len(chunk)
+                reusable = keep_alive and len(rest) <= length
+                with self.lock:
+                    self.forwarded += 1
+                return status
+            finally:
+                self.pool.release(node, sock, reusable)
+
+    def stats(self):
+        with self.lock:
+            counters = {'forwarded': self.forwarded, 'forward_failures': self.failed}
+        return {'node': self.node, 'members': ', '.join(self.ring.nodes), **counters,
+                **self.pool.stats()}
+
+
+# Local multi-process cluster for testing
+
+def _run_node(port, nodes, static_dir):
+    import server8
+    server8.PORT = port
+    server8.CLUSTER_NODES = nodes
+    # A reload re-runs the command line, which here would start a whole cluster
+    server8.RELOAD_SIGNAL = None
+    if static_dir:
+        server8.STATIC_DIR = static_dir
+        os.makedirs(static_dir, exist_ok=True)
+    server8.main()
+
+
+def run_local(count, base_port, host, separate_dirs):
+    """Start count server8 nodes on consecutive ports, sharing one ring."""
+    nodes = [f"{host}:{base_port + index}" for index in range(count)]
+    processes = []
+    for index in range(count):
+        static_dir = os.path.join('./static', f"node-{base_port + index}") if separate_dirs else None
+        process = multiprocessing.Process(target=_run_node, args=(base_port + index, nodes, static_dir))
+        process.start()
+        processes.append(process)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Every node gets the same interrupt and shuts down on its own
+        for process in processes:
+            process.join()
+
+
+def report_movement(count, key_count, host='127.0.0.1', base_port=8080):
+    """Print the key share of each node and how many keys move when one is added."""
+    nodes = [f"{host}:{base_port + index}" for index in range(count)]
+    keys = [f"/file-{index}.txt" for index in range(key_count)]
+    before = HashRing(nodes)
+    after = HashRing(nodes + [f"{host}:{base_port + count}"])
+    shares = {node: 0 for node in nodes}
+    for key in keys:
+        shares[before.owner(key)] += 1
+    for node, share in shares.items():
+        print(f"{node:<22}{share / key_count * 100:6.2f}% of keys")
+    print(f"Adding a node to {count} moved {moved_fraction(before, after, keys) * 100:.2f}% "
+          f"of {key_count} keys (ideal {100 / (count + 1):.2f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local server8 cluster or inspect the hash ring.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="start several nodes as local processes")
+    run.add_argument('--nodes', type=int, default=3)
+    run.add_argument('--base-port', type=int, default=8080)
+    run.add_argument('--host', default='127.0.0.1')
+    run.add_argument('--separate-dirs', action='store_true',
+                     help="give each node its own ./static/node-PORT directory")
+    movement = commands.add_parser('movement', help="measure key movement when a node joins")
+    movement.add_argument('--nodes', type=int, default=4)
+    movement.add_argument('--keys', type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run_local(args.nodes, args.base_port, args.host, args.separate_dirs)
+    else:
+        report_movement(args.nodes, args.keys)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import threading
+from collections.abc import Mapping
+
+# Configuration
+RECV_BUFFER_SIZE = 8192     # Largest request head a connection accepts
+MAX_POOLED_BUFFERS = 256    # Idle buffers kept for reuse; extra ones are freed
+
+# Request line methods, matched in place so the common ones need no decoding
+METHOD_TOKENS = tuple((name.encode('ascii') + b' ', name) for name in
+                      ('GET', 'POST', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'PATCH'))
+
+# Header name -> b'\r\nname:', the bytes its line starts with, built on first use
+_header_keys = {}
+
+
+class MalformedRequest(ValueError):
+    """The request head could not be parsed."""
+
+
+class RequestHeadTooLarge(MalformedRequest):
+    """The request head does not fit in a receive buffer."""
+
+
+class BufferPool:
+    """Free list of fixed-size receive buffers shared by all connections.
+
+    Buffers are handed out as memoryviews over a bytearray, so neither the
+    buffer nor its view is allocated again when a connection reuses it.
+    """
+
+    def __init__(self, size=RECV_BUFFER_SIZE, max_free=MAX_POOLED_BUFFERS):
+        self.size = size
+        self.max_free = max_free
+        self.lock = threading.Lock()
+        self.free = []
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self):
+        with self.lock:
+            if self.free:
+                self.reused += 1
+                return self.free.pop()
+            self.created += 1
+        return memoryview(bytearray(self.size))
+
+    def release(self, view):
+        with self.lock:
+            if len(self.free) < self.max_free:
+                self.free.append(view)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'recv_buffer_size': self.size,
+                'recv_buffers_created': self.created,
+                'recv_buffers_reused': self.reused,
+                'recv_buffers_idle': len(self.free),
+            }
+
+
+buffer_pool = BufferPool()
+
+
+class RequestHeaders(Mapping):
+    """Read-only view of a request's header block, decoded on lookup.
+
+    Names are matched case-insensitively and must be passed in lower case,
+    like the keys of the dict parse_headers used to build. As in that dict,
+    the last of several headers with one name wins, for get() and items()
+    alike. The block is a copy, so it stays valid after the receive buffer
+    moves on.
+
+    Names are found with rfind() in a lower-cased copy made once per
+    request: a miss allocates nothing, where a case-insensitive regex search
+    allocated about a kilobyte of matcher state on every lookup.
+    """
+
+    __slots__ = ('raw', 'lowered')
+
+    def __init__(self, raw):
+        self.raw = raw  # b'\r\nName: value\r\n...\r\n'
+        self.lowered = raw.lower()
+
+    @staticmethod
+    def _key(name):
+        key = _header_keys.get(name)
+        if key is None:
+            key = b'\r\n' + name.encode('latin-1') + b':'
+            _header_keys[name] = key
+        return key
+
+    def get(self, name, default=None):
+        key = self._key(name)
+        start = self.lowered.rfind(key)  # The last one wins
+        if start < 0:
+            return default
+        start += len(key)
+        return self.raw[start:self.raw.index(b'\r\n', start)].decode('latin-1').strip(' \t')
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return self._key(name) in self.lowered
+
+    def items(self):
+        """Decode every header; later duplicates win, as in a dict."""
+        headers = {}
+        for line in self.raw.split(b'\r\n'):
+            name, colon, value = line.partition(b':')
+            if colon:
+                headers[name.decode('latin-1').strip().lower()] = value.decode('latin-1').strip()
+        return headers.items()
+
+    def __iter__(self):
+        return iter(dict(self.items()))
+
+    def __len__(self):
+        return len(dict(self.items()))
+
+    def __repr__(self):
+        return f"RequestHeaders({dict(self.items())!r})"
+
+
+class Connection:
+    """One client socket reading into a pooled buffer.
+
+    Bytes between start and end are received but not yet consumed, which
+    keeps pipelined requests and the start of a body for the next reader.
+    """
+
+    __slots__ = ('sock', 'pool', 'view', 'buffer', 'start', 'end')
+
+    def __init__(self, sock, pool=buffer_pool):
+        self.sock = sock
+        self.pool = pool
+        self.view = pool.acquire()
+        self.buffer = self.view.obj
+        self.start = 0
+        self.end = 0
+
+    @property
+    def buffered(self):
+        return self.end - self.start
+
+    def receive(self):
+        """Read more bytes from the socket; return how many arrived (0 at EOF)."""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            if self.start == 0:
+                raise RequestHeadTooLarge(f"Request head exceeds {len(self.buffer)} bytes")
+            # Move the unconsumed tail to the front to make room
+            self.buffer[:self.end - self.start] = self.buffer[self.start:self.end]
+            self.end -= self.start
+            self.start = 0
+        received = self.sock.recv_into(self.view[self.end:] if self.end else self.view)
+        self.end += received
+        return received
+
+    def wait(self):
+        """Block until at least one byte is buffered; return False at EOF."""
+        return self.start < self.end or self.receive() > 0
+
+    def startswith(self, prefix):
+        """Whether the next bytes are prefix, receiving more until it is whole or ruled out.
+
+        A short read that matches so far, such as a lone b'P', is not
+        enough to decide; False at EOF before the prefix is complete.
+        """
+        if self.buffer[self.start] != prefix[0]:
+            return False
+        while True:
+            length = min(self.end - self.start, len(prefix))
+            if self.view[self.start:self.start + length] != prefix[:length]:
+                return False
+            if length == len(prefix):
+                return True
+            if not self.receive():
+                return False
+
+    def read_request(self):
+        """Buffer one request head and parse it; return (method, path, headers).
+
+        Returns None if the peer closes before a whole head arrived.
+        """
+        buffer = self.buffer
+        head_end = buffer.find(b'\r\n\r\n', self.start, self.end)
+        while head_end < 0:
+            # Resume the search just before the new bytes, relative to start
+            scanned = max(self.end - self.start - 3, 0)
+            if not self.receive():
+                return None
+            head_end = buffer.find(b'\r\n\r\n', self.start + scanned, self.end)
+
+        start = self.start
+        line_end = buffer.find(b'\r\n', start, head_end + 2)
+        method_end = buffer.find(b' ', start, line_end)
+        if method_end <= start:
+            raise MalformedRequest("Malformed request line")
+        path_end = buffer.find(b' ', method_end + 1, line_end)
+        if path_end < 0:
+            path_end = line_end
+
+        for token, name in METHOD_TOKENS:
+            if buffer.startswith(token, start, method_end + 1):
+                method = name
+                break
+        else:
+            method = str(self.view[start:method_end], 'latin-1')
+        path = str(self.view[method_end + 1:path_end], 'utf-8', 'replace')
+        headers = RequestHeaders(bytes(self.view[line_end:head_end + 2]))
+        self.start = head_end + 4
+        return method, path, headers
+
+    def take(self, size):
+        """Consume up to size buffered bytes, e.g. the start of a request body."""
+        size = min(size, self.end - self.start)
+        if size <= 0:
+            return b''
+        data = bytes(self.view[self.start:self.start + size])
+        self.start += size
+        return data
+
+    def detach(self):
+        """Give the buffered bytes to another reader and hand the buffer back."""
+        data = bytes(self.view[self.start:self.end])
+        self.release()
+        return data
+
+    def release(self):
+        if self.view is not None:
+            self.pool.release(self.view)
+            self.view = self.buffer = None
+
+
+def read_response(sock, headers=None, body=None):
+    """Read one response; return (status code, body size, whether the connection stays open).
+
+    Works for the HTTP/1.0 variants that close the connection instead of
+    sending Content-Length. The body is discarded unless a bytearray is
+    passed as body to collect it; a dict passed as headers collects the
+    headers, keyed by lowercase name.
+    """
+    data = b''
+    while b'\r\n\r\n' not in data:
+        chunk = sock.recv(65536)
+        if not chunk:
+            if not data:
+                raise ConnectionError("Connection closed before the response")
+            break
+        data += chunk
+    head, _, rest = data.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status_line = lines[0].split()
+    status = int(status_line[1]) if len(status_line) > 1 and status_line[1].isdigit() else 0
+    length = None
+    keep_alive = status_line[0] == 'HTTP/1.1' if status_line else False
+    for line in lines[1:]:
+        key, _, value = line.partition(':')
+        key = key.strip().lower()
+        if headers is not None:
+            headers[key] = value.strip()
+        if key == 'content-length':
+            length = int(value)
+        elif key == 'connection':
+            keep_alive = value.strip().lower() != 'close'
+    if length is not None:
+        rest = rest[:length]
+    received = len(rest)
+    if body is not None:
+        body += rest
+    while length is None or received < length:
+        chunk = sock.recv(65536 if length is None else min(65536, length - received))
+        if not chunk:
+            if length is None:
+                # No length: the body ran until the server closed the connection
+                return status, received, False
+            raise ConnectionError("Connection closed mid-body")
+        received += len(chunk)
+        if body is not None:
+            body += chunk
+    return status, received, keep_alive
@@ -0,0 +1,317 @@
+import json
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+from memory import budget
+
+# Configuration
+FILE_CACHE_SIZE = 64 * 1024 * 1024     # Bytes of file content kept in memory
+MAX_CACHED_FILE_SIZE = 1024 * 1024     # Larger files are read or streamed per request
+SNAPSHOT_ENTRIES = 4096                # Hottest entries written to a snapshot
+SNAPSHOT_VERSION = 1
+MISSING_PATHS_SIZE = 4096              # Request paths remembered as not found
+WATCH_INTERVAL = 2                     # Seconds between scans for created files
+
+
+class CachedFile:
+    """A file's content together with the metadata it was read under."""
+
+    __slots__ = ('path', 'content', 'size', 'mtime_ns', 'hits')
+
+    def __init__(self, path, content, mtime_ns):
+        self.path = path
+        self.content = content
+        self.size = len(content)
+        self.mtime_ns = mtime_ns
+        self.hits = 0
+
+
+class FileCache:
+    """LRU cache of small static files, charged to the memory budget as 'cache'.
+
+    Every lookup stats the file and only trusts an entry whose size and mtime
+    still match, so appends and uploads are picked up without invalidation
+    calls. The keys and metadata can be saved as a snapshot and read back by
+    the next process, which warms the same files before it serves traffic.
+    """
+
+    def __init__(self, max_bytes=FILE_CACHE_SIZE, max_file_size=MAX_CACHED_FILE_SIZE):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # path -> CachedFile, least recently used first
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.warmed = 0
+
+    def get(self, file_path):
+        """Return the CachedFile for a regular file, reading it on a miss.
+
+        Returns None when the file is missing or too large to cache; the
+        caller then falls back to reading or streaming it.
+        """
+        try:
+            info = os.stat(file_path)
+        except (OSError, ValueError):
+            return None
+        if not stat.S_ISREG(info.st_mode):
+            return None
+        with self.lock:
+            entry = self.entries.get(file_path)
+            if entry is not None and entry.size == info.st_size and entry.mtime_ns == info.st_mtime_ns:
+                self.entries.move_to_end(file_path)
+                entry.hits += 1
+                self.hits += 1
+                return entry
+            self.misses += 1
+        if info.st_size > self.max_file_size:
+            return None
+        try:
+            with open(file_path, 'rb') as file:
+                content = file.read()
+        except OSError:
+            return None
+        entry = CachedFile(file_path, content, info.st_mtime_ns)
+        entry.hits = 1
+        self._store(entry)
+        return entry
+
+    def _store(self, entry):
+        with self.lock:
+            self._remove(entry.path)
+            while self.entries and self.total + entry.size > self.max_bytes:
+                self._evict()
+            # The cache gives memory back before a connection is refused
+            while not budget.try_reserve(entry.size, 'cache'):
+                if not self.entries:
+                    return
+                self._evict()
+            self.entries[entry.path] = entry
+            self.total += entry.size
+
+    def _evict(self):
+        _, entry = self.entries.popitem(last=False)
+        self.total -= entry.size
+        self.evictions += 1
+        budget.release(entry.size, 'cache')
+
+    def _remove(self, file_path):
+        entry = self.entries.pop(file_path, None)
+        if entry is not None:
+            self.total -= entry.size
+            budget.release(entry.size, 'cache')
+
+    def invalidate(self, file_path):
+        with self.lock:
+            self._remove(file_path)
+
+    def clear(self):
+        with self.lock:
+            for file_path in list(self.entries):
+                self._remove(file_path)
+
+    def snapshot(self, limit=SNAPSHOT_ENTRIES):
+        """Metadata of the hottest entries, most recently used first."""
+        with self.lock:
+            entries = list(self.entries.values())[-limit:]
+        return [{'path': entry.path, 'size': entry.size, 'mtime_ns': entry.mtime_ns, 'hits': entry.hits}
+                for entry in reversed(entries)]
+
+    def save(self, snapshot_path):
+        """Write the hot set to snapshot_path; return the number of entries."""
+        entries = self.snapshot()
+        os.makedirs(os.path.dirname(snapshot_path) or '.', exist_ok=True)
+        # Written aside and renamed, so a reader never sees half a snapshot
+        temporary = f"{snapshot_path}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as file:
+            json.dump({'snapshot': SNAPSHOT_VERSION, 'entries': entries}, file)
+        os.replace(temporary, snapshot_path)
+        return len(entries)
+
+    def load(self, snapshot_path):
+        """Warm the cache from a snapshot; return the number of files loaded.
+
+        Files that changed since the snapshot are skipped rather than read:
+        they may be cold now, and the next request caches them anyway.
+        """
+        try:
+            with open(snapshot_path) as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            return 0
+        if snapshot.get('snapshot') != SNAPSHOT_VERSION:
+            return 0
+        loaded = 0
+        # Coldest first, so the hottest files end up at the recent end of the LRU
+        for item in reversed(snapshot['entries']):
+            try:
+                info = os.stat(item['path'])
+                if info.st_size != item['size'] or info.st_mtime_ns != item['mtime_ns']:
+                    continue
+                with open(item['path'], 'rb') as file:
+                    content = file.read()
+            except (OSError, KeyError, TypeError):
+                continue
+            entry = CachedFile(item['path'], content, info.st_mtime_ns)
+            entry.hits = item.get('hits', 0)
+            self._store(entry)
+            loaded += 1
+        with self.lock:
+            self.warmed += loaded
+        return loaded
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'cache_entries': len(self.entries),
+                'cache_content_bytes': self.total,
+                'cache_limit': self.max_bytes,
+                'cache_hits': self.hits,
+                'cache_misses': self.misses,
+                'cache_hit_rate': f"{self.hits / lookups:.3f}" if lookups else '-',
+                'cache_evictions': self.evictions,
+                'cache_warmed': self.warmed,
+            }
+
+
+class MissingPaths:
+    """Bounded LRU set of request paths known to have no file behind them.
+
+    A hit answers a 404 without touching the filesystem. Handlers that
+    create a file discard its path; files created any other way are noticed
+    by watch(), which clears the set when a directory under the root
+    changes, so a new file can 404 for at most WATCH_INTERVAL.
+
+    With fold_repeats(), repeated 404s of one path are logged once per
+    window. The folded ones are handed to the report callback when the
+    window closes, and also when the path is evicted, discarded or
+    cleared, so none go unlogged.
+    """
+
+    def __init__(self, max_entries=MISSING_PATHS_SIZE):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # path -> [log window start, repeats not logged yet, last repeat]
+        self.window = 0     # Seconds in which repeats of one path share a log line; 0 logs each
+        self.report = None  # Called with (path, count, seconds) for the repeats folded into a window
+        self.hits = 0
+        self.invalidations = 0
+        self.thread = None
+
+    def __contains__(self, path):
+        with self.lock:
+            if path not in self.entries:
+                return False
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return True
+
+    def add(self, path):
+        folded = []
+        with self.lock:
+            if path not in self.entries:
+                self.entries[path] = [None, 0, None]
+                if len(self.entries) > self.max_entries:
+                    folded.append(self.entries.popitem(last=False))
+        self._report(folded)
+
+    def discard(self, path):
+        with self.lock:
+            entry = self.entries.pop(path, None)
+        if entry is not None:
+            self._report([(path, entry)])
+
+    def clear(self):
+        with self.lock:
+            folded = list(self.entries.items())
+            self.entries.clear()
+            self.invalidations += 1
+        self._report(folded)
+
+    def fold_repeats(self, window, report):
+        """Log repeats of a path once per window; report(path, count, seconds) writes the line."""
+        self.window = window
+        self.report = report
+
+    def note_miss(self, path):
+        """Count one 404 of path; return False while it is folded into the path's window."""
+        if not self.window:
+            return True
+        now = time.monotonic()
+        folded = []
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                return True
+            if entry[0] is not None and now - entry[0] < self.window:
+                entry[1] += 1
+                entry[2] = now
+                return False
+            # Window closed between two watcher ticks: its repeats are reported first
+            folded.append((path, list(entry)))
+            entry[:] = [now, 0, None]
+        self._report(folded)
+        return True
+
+    def flush(self, force=False):
+        """Report the repeats of every closed window, or of all windows with force."""
+        now = time.monotonic()
+        folded = []
+        with self.lock:
+            for path, entry in self.entries.items():
+                if entry[1] and (force or now - entry[0] >= self.window):
+                    folded.append((path, list(entry)))
+                    entry[1], entry[2] = 0, None
+        self._report(folded)
+
+    def _report(self, folded):
+        # Outside the lock: the callback writes the log
+        if self.report is None:
+            return
+        for path, (start, count, last) in folded:
+            if count:
+                self.report(path, count, last - start)
+
+    def watch(self, root, interval=WATCH_INTERVAL):
+        """Clear the set whenever a directory under root changes, from a background thread.
+
+        Every tick also reports the repeats of windows that have closed.
+        """
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._watch, args=(root, interval), daemon=True)
+        self.thread.start()
+
+    def _watch(self, root, interval):
+        # Creating, renaming or removing a file updates its directory's mtime
+        scan = lambda: {path: os.stat(path).st_mtime_ns for path, _, _ in os.walk(root)}
+        seen = scan()
+        while True:
+            time.sleep(interval)
+            try:
+                current = scan()
+            except OSError:
+                current = None  # A directory vanished mid-scan
+            if current != seen:
+                self.clear()
+                seen = current
+            self.flush()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'missing_paths': len(self.entries),
+                'missing_path_limit': self.max_entries,
+                'missing_path_hits': self.hits,
+                'missing_path_invalidations': self.invalidations,
+            }
+
+
+file_cache = FileCache()
+missing_paths = MissingPaths()
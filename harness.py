@@ -0,0 +1,31 @@
+import os
+import threading
+
+import server8
+from sockopts import create_listener, tune_connection
+
+# Configuration
+HOST = '127.0.0.1'
+
+
+def start_server(options=None):
+    """Run server8's handler on an ephemeral port; return the listening socket.
+
+    Connections are tuned with the same socket options as the listener, and
+    server.log is swapped for os.devnull so test and benchmark traffic stays
+    out of it. Close the returned socket to stop accepting.
+    """
+    server8.LOG_FILE = os.devnull
+    server_socket = create_listener(HOST, 0, options)
+
+    def accept_loop():
+        while True:
+            try:
+                conn, addr = server_socket.accept()
+            except OSError:
+                break
+            tune_connection(conn, options)
+            threading.Thread(target=server8.handle_client, args=(conn, addr), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return server_socket
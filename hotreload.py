@@ -0,0 +1,166 @@
+import os
+import select
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+# Configuration
+READY_TIMEOUT = 30   # Seconds the new generation gets to warm up before the reload is abandoned
+
+# Environment a generation passes to the next one
+LISTEN_FD_ENV = 'SERVER_LISTEN_FD'          # Inherited listening socket
+READY_FD_ENV = 'SERVER_READY_FD'            # Pipe the new generation reports readiness on
+RELOAD_STARTED_ENV = 'SERVER_RELOAD_STARTED'  # Wall-clock time the reload was requested
+GENERATION_ENV = 'SERVER_GENERATION'
+
+
+class Startup:
+    """Timeline of this generation, from its start to its first response byte.
+
+    A generation started by a reload counts from the moment the reload was
+    requested, so interpreter start-up and cache warming are included.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = int(os.environ.get(GENERATION_ENV) or 1)
+        reload_started = os.environ.get(RELOAD_STARTED_ENV)
+        self.reloaded = reload_started is not None
+        self.started = float(reload_started) if reload_started else time.time()
+        self.marks = {}   # name -> seconds since started
+        self.first_byte = None
+
+    def mark(self, name):
+        elapsed = time.time() - self.started
+        with self.lock:
+            self.marks[name] = elapsed
+        return elapsed
+
+    def note_first_byte(self):
+        """Record the first response; return True only for that one call."""
+        if self.first_byte is not None:
+            return False
+        elapsed = time.time() - self.started
+        with self.lock:
+            if self.first_byte is not None:
+                return False
+            self.first_byte = elapsed
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                'generation': self.generation,
+                'pid': os.getpid(),
+                'started_by': 'reload' if self.reloaded else 'launch',
+                **{f"{name}_ms": f"{elapsed * 1000:.1f}" for name, elapsed in self.marks.items()},
+                'first_byte_ms': f"{self.first_byte * 1000:.1f}" if self.first_byte is not None else '-',
+            }
+
+
+startup = Startup()
+
+
+def inherited_listener():
+    """Return the listening socket handed over by the previous generation, or None."""
+    fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if fd is None:
+        return None
+    return socket.socket(fileno=int(fd))
+
+
+def notify_ready():
+    """Tell the previous generation this one is accepting; it then starts draining."""
+    fd = os.environ.pop(READY_FD_ENV, None)
+    if fd is None:
+        return
+    try:
+        os.write(int(fd), b'ready')
+    finally:
+        os.close(int(fd))
+
+
+class Reloader:
+    """Starts the next generation on the same listening socket.
+
+    The listening socket is never closed, so connections that arrive during
+    the hand-over wait in its backlog instead of being refused. The old
+    generation keeps accepting until the new one reports it is ready, then
+    ready is set and the old one stops accepting and drains.
+    """
+
+    def __init__(self, server_socket, before_spawn=None, timeout=READY_TIMEOUT):
+        self.server_socket = server_socket
+        self.before_spawn = before_spawn  # e.g. saving the warm cache for the next generation
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.thread = None
+        self.child = None
+        self.failures = 0
+
+    def request(self):
+        """Start a reload unless one is under way; safe to call from a signal handler."""
+        # Never block here: a second signal can arrive while the first handler holds the lock
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            if self.ready.is_set() or (self.thread is not None and self.thread.is_alive()):
+                return False
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        finally:
+            self.lock.release()
+        return True
+
+    def _run(self):
+        requested = time.time()
+        if self.before_spawn is not None:
+            self.before_spawn()
+        read_fd, write_fd = os.pipe()
+        listen_fd = self.server_socket.fileno()
+        env = dict(os.environ)
+        env.update({
+            LISTEN_FD_ENV: str(listen_fd),
+            READY_FD_ENV: str(write_fd),
+            RELOAD_STARTED_ENV: repr(requested),
+            GENERATION_ENV: str(startup.generation + 1),
+        })
+        try:
+            child = subprocess.Popen([sys.executable] + sys.argv, env=env, pass_fds=(listen_fd, write_fd))
+        except OSError as e:
+            os.close(read_fd)
+            os.close(write_fd)
+            self._failed(f"could not start: {e}")
+            return
+        os.close(write_fd)
+        try:
+            # EOF without 'ready' means the new generation died during start-up
+            readable, _, _ = select.select([read_fd], [], [], self.timeout)
+            ready = bool(readable) and os.read(read_fd, 16) == b'ready'
+        finally:
+            os.close(read_fd)
+        if not ready:
+            child.kill()
+            child.wait()
+            self._failed("did not become ready")
+            return
+        self.child = child
+        print(f"Generation {startup.generation + 1} (pid {child.pid}) is serving after "
+              f"{(time.time() - requested) * 1000:.1f} ms; draining generation {startup.generation}")
+        self.ready.set()
+
+    def _failed(self, reason):
+        with self.lock:
+            self.failures += 1
+        print(f"Reload failed, generation {startup.generation + 1} {reason}; still serving")
+
+    def stats(self):
+        with self.lock:
+            return {
+                'reload_in_progress': self.thread is not None and self.thread.is_alive(),
+                'reload_failures': self.failures,
+                'next_generation_pid': self.child.pid if self.child is not None else '-',
+            }
@@ -0,0 +1,668 @@
+import base64
+import socket
+import struct
+import threading
+
+from hpack_codec import Decoder, Encoder, HPACKError
+
+# Client connection preface (RFC 7540, 3.5)
+PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+
+# Frame types
+DATA = 0x0
+HEADERS = 0x1
+PRIORITY = 0x2
+RST_STREAM = 0x3
+SETTINGS = 0x4
+PUSH_PROMISE = 0x5
+PING = 0x6
+GOAWAY = 0x7
+WINDOW_UPDATE = 0x8
+CONTINUATION = 0x9
+
+# Frame flags
+FLAG_END_STREAM = 0x1
+FLAG_ACK = 0x1
+FLAG_END_HEADERS = 0x4
+FLAG_PADDED = 0x8
+FLAG_PRIORITY = 0x20
+
+# Settings identifiers
+SETTINGS_HEADER_TABLE_SIZE = 0x1
+SETTINGS_ENABLE_PUSH = 0x2
+SETTINGS_MAX_CONCURRENT_STREAMS = 0x3
+SETTINGS_INITIAL_WINDOW_SIZE = 0x4
+SETTINGS_MAX_FRAME_SIZE = 0x5
+SETTINGS_MAX_HEADER_LIST_SIZE = 0x6
+
+# Error codes
+NO_ERROR = 0x0
+PROTOCOL_ERROR = 0x1
+INTERNAL_ERROR = 0x2
+FLOW_CONTROL_ERROR = 0x3
+STREAM_CLOSED = 0x5
+FRAME_SIZE_ERROR = 0x6
+REFUSED_STREAM = 0x7
+COMPRESSION_ERROR = 0x9
+
+# Configuration
+MAX_CONCURRENT_STREAMS = 100
+DEFAULT_WINDOW_SIZE = 65535
+DEFAULT_MAX_FRAME_SIZE = 16384
+MAX_WINDOW_SIZE = 2 ** 31 - 1
+MAX_HEADER_BLOCK_SIZE = 64 * 1024
+MAX_UNSIZED_BODY = 1024 * 1024  # Bodies without Content-Length are buffered up to this size
+READ_CHUNK_SIZE = 64 * 1024
+
+# HTTP/1.1 response headers that are meaningless in HTTP/2
+CONNECTION_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'}
+
+
+class H2ConnectionError(Exception):
+    """A connection-level protocol error; the connection is closed with GOAWAY."""
+
+    def __init__(self, error_code, message=''):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+class StreamReset(Exception):
+    """Raised in a stream handler once its stream has been reset or the connection closed."""
+
+
+def frame_header(length, frame_type, flags, stream_id):
+    return struct.pack('>I', length)[1:] + struct.pack('>BBI', frame_type, flags, stream_id & 0x7fffffff)
+
+
+def is_h2c_upgrade(headers):
+    """Return True when an HTTP/1.1 request asks to upgrade to cleartext HTTP/2."""
+    upgrade = headers.get('upgrade')
+    if not upgrade:
+        return False
+    upgrade = [token.strip().lower() for token in upgrade.split(',')]
+    return 'h2c' in upgrade and 'http2-settings' in headers
+
+
+class Stream:
+    """State of one HTTP/2 stream."""
+
+    def __init__(self, stream_id, send_window):
+        self.stream_id = stream_id
+        self.send_window = send_window
+        self.recv_window = DEFAULT_WINDOW_SIZE
+        self.body = bytearray()
+        self.body_done = False
+        self.reset = False
+        self.pending_request = None  # Request waiting for its whole body (no Content-Length)
+        self.thread = None
+
+
+class StreamSocket:
+    """Socket-like view of one stream.
+
+    The HTTP/1.1 handlers write a complete response with sendall() and read
+    the request body with recv(). This adapter turns the response head into
+    a HEADERS frame and the rest into flow-controlled DATA frames, so the same
+    handlers serve HTTP/2 streams unchanged.
+    """
+
+    def __init__(self, connection, stream):
+        self.connection = connection
+        self.stream = stream
+        self.pending = bytearray()
+        self.headers_sent = False
+        self.remaining = None  # Body bytes still expected, from Content-Length
+        self.ended = False
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self, bufsize):
+        return self.connection.read_body(self.stream, bufsize)
+
+    def sendall(self, data):
+        if self.ended:
+            return
+        if self.headers_sent:
+            self._send_body(data)
+            return
+        self.pending += data
+        head_end = self.pending.find(b'\r\n\r\n')
+        if head_end < 0:
+            return
+        head = bytes(self.pending[:head_end]).decode('latin-1')
+        rest = bytes(self.pending[head_end + 4:])
+        self.pending = None
+
+        lines = head.split('\r\n')
+        status = lines[0].split()[1]
+        headers = [(':status', status)]
+        for line in lines[1:]:
+            key, _, value = line.partition(':')
+            key = key.strip().lower()
+            if key in CONNECTION_HEADERS:
+                continue
+            if key == 'content-length':
+                self.remaining = int(value)
+            headers.append((key, value.strip()))
+
+        end_stream = self.remaining == 0
+        self.connection.send_headers(self.stream, headers, end_stream)
+        self.headers_sent = True
+        self.ended = end_stream
+        if rest:
+            self._send_body(rest)
+
+    def _send_body(self, data):
+        end_stream = False
+        if self.remaining is not None:
+            data = data[:self.remaining]
+            self.remaining -= len(data)
+            end_stream = self.remaining == 0
+        self.connection.send_data(self.stream, data, end_stream)
+        self.ended = end_stream
+
+    def finish(self):
+        """Close our side of the stream once the handler has returned."""
+        if not self.headers_sent:
+            self.connection.send_headers(self.stream, [(':status', '500')], True)
+        elif not self.ended:
+            self.connection.send_data(self.stream, b'', True)
+        self.ended = True
+
+    def close(self):
+        pass
+
+
+class H2Connection:
+    """Server side of one cleartext HTTP/2 connection.
+
+    The calling thread reads and processes frames; every request stream runs
+    its handler in its own thread, so slow responses do not block the others.
+    stream_slots, a semaphore shared by all connections, bounds how many of
+    those threads run at once; a stream that finds none free is refused.
+    go_away() lets another thread end the connection gracefully: streams
+    already opened finish, later ones are refused, and serve() returns once
+    the last one is done. A GOAWAY from the client is handled the same way.
+    """
+
+    def __init__(self, sock, dispatch, initial_data=b'', stream_slots=None):
+        self.sock = sock
+        self.dispatch = dispatch
+        self.stream_slots = stream_slots
+        self.buffer = bytearray(initial_data)
+        self.decoder = Decoder()
+        self.encoder = Encoder()
+        self.lock = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.streams = {}
+        self.last_stream_id = 0
+        self.send_window = DEFAULT_WINDOW_SIZE
+        self.peer_initial_window = DEFAULT_WINDOW_SIZE
+        self.peer_max_frame_size = DEFAULT_MAX_FRAME_SIZE
+        self.continuation = None  # (stream_id, flags, header block) while CONTINUATION frames arrive
+        self.closed = False
+        self.settings_sent = False
+        self.going_away = False
+        self.goaway_stream_id = None  # Last stream id announced in our GOAWAY
+        self.peer_going_away = False  # The client sent GOAWAY and opens no more streams
+
+    # Frame I/O
+
+    def _read_exact(self, size):
+        while len(self.buffer) < size:
+            chunk = self.sock.recv(READ_CHUNK_SIZE)
+            if not chunk:
+                raise EOFError
+            self.buffer += chunk
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def _read_frame(self):
+        header = self._read_exact(9)
+        length = int.from_bytes(header[:3], 'big')
+        frame_type, flags, stream_id = struct.unpack('>BBI', header[3:])
+        if length > DEFAULT_MAX_FRAME_SIZE:
+            raise H2ConnectionError(FRAME_SIZE_ERROR, "Frame exceeds SETTINGS_MAX_FRAME_SIZE")
+        return frame_type, flags, stream_id & 0x7fffffff, self._read_exact(length)
+
+    def _write_frame(self, frame_type, flags, stream_id, payload=b''):
+        with self.write_lock:
+            self.sock.sendall(frame_header(len(payload), frame_type, flags, stream_id) + payload)
+
+    def _send_settings(self):
+        payload = struct.pack('>HIHI', SETTINGS_MAX_CONCURRENT_STREAMS, MAX_CONCURRENT_STREAMS,
+                              SETTINGS_INITIAL_WINDOW_SIZE, DEFAULT_WINDOW_SIZE)
+        self._write_frame(SETTINGS, 0, 0, payload)
+
+    def _reset_stream(self, stream_id, error_code):
+        self._write_frame(RST_STREAM, 0, stream_id, struct.pack('>I', error_code))
+
+    # Graceful shutdown
+
+    def go_away(self):
+        """Send GOAWAY with the last stream id and refuse newer streams; safe from any thread."""
+        with self.lock:
+            if self.going_away or self.closed:
+                return
+            self.going_away = True
+            # Before our SETTINGS the frame would break the preface; serve() sends it then
+            ready = self.settings_sent
+        if ready:
+            self._announce_goaway()
+
+    def _announce_goaway(self):
+        with self.lock:
+            self.goaway_stream_id = self.last_stream_id
+            idle = not self.streams
+        try:
+            self._write_frame(GOAWAY, 0, 0, struct.pack('>II', self.goaway_stream_id, NO_ERROR))
+        except OSError:
+            return
+        if idle:
+            self._wake_reader()
+
+    def _wake_reader(self):
+        """Make the frame read in serve() see EOF, so the connection finishes."""
+        try:
+            # On the descriptor itself: SSLSocket.shutdown() would drop TLS before the final GOAWAY
+            socket.socket.shutdown(self.sock, socket.SHUT_RD)
+        except OSError:
+            pass
+
+    # Sending side, used by stream handler threads
+
+    def send_headers(self, stream, headers, end_stream):
+        block = self.encoder.encode(headers)
+        limit = self.peer_max_frame_size
+        flags = FLAG_END_STREAM if end_stream else 0
+        with self.write_lock:
+            if stream.reset or self.closed:
+                raise StreamReset
+            first, block = block[:limit], block[limit:]
+            frames = [frame_header(len(first), HEADERS, flags | (0 if block else FLAG_END_HEADERS),
+                                   stream.stream_id) + first]
+            while block:
+                chunk, block = block[:limit], block[limit:]
+                frames.append(frame_header(len(chunk), CONTINUATION, 0 if block else FLAG_END_HEADERS,
+                                           stream.stream_id) + chunk)
+            # Header blocks must not be interleaved with other frames
+            self.sock.sendall(b''.join(frames))
+
+    def send_data(self, stream, data, end_stream):
+        """Send body bytes, waiting for flow-control credit as needed."""
+        view = memoryview(data)
+        while True:
+            with self.lock:
+                while view and not (stream.reset or self.closed) and (
+                        stream.send_window <= 0 or self.send_window <= 0):
+                    self.lock.wait()
+                if stream.reset or self.closed:
+                    raise StreamReset
+                size = min(len(view), stream.send_window, self.send_window, self.peer_max_frame_size)
+                stream.send_window -= size
+                self.send_window -= size
+            chunk, view = view[:size], view[size:]
+            last = end_stream and not view
+            self._write_frame(DATA, FLAG_END_STREAM if last else 0, stream.stream_id, bytes(chunk))
+            if not view:
+                return
+
+    def read_body(self, stream, size):
+        """Return up to size bytes of the request body, b'' at its end."""
+        with self.lock:
+            while not stream.body and not (stream.body_done or stream.reset or self.closed):
+                self.lock.wait()
+            if stream.reset:
+                raise StreamReset
+            chunk = bytes(stream.body[:size])
+            del stream.body[:size]
+            replenish = chunk and not stream.body_done
+            if replenish:
+                stream.recv_window += len(chunk)
+        # Credit the peer for what the handler has consumed
+        if replenish:
+            self._write_frame(WINDOW_UPDATE, 0, stream.stream_id, struct.pack('>I', len(chunk)))
+        return chunk
+
+    # Receiving side
+
+    def _handle_frame(self, frame_type, flags, stream_id, payload):
+        if self.continuation and frame_type != CONTINUATION:
+            raise H2ConnectionError(PROTOCOL_ERROR, "Expected CONTINUATION frame")
+        handler = {
+            DATA: self._on_data,
+            HEADERS: self._on_headers,
+            PRIORITY: self._on_priority,
+            RST_STREAM: self._on_rst_stream,
+            SETTINGS: self._on_settings,
+            PUSH_PROMISE: self._on_push_promise,
+            PING: self._on_ping,
+            GOAWAY: self._on_goaway,
+            WINDOW_UPDATE: self._on_window_update,
+            CONTINUATION: self._on_continuation,
+        }.get(frame_type)
+        if handler:  # Unknown frame types are ignored
+            handler(flags, stream_id, payload)
+
+    def _strip_padding(self, flags, payload):
+        if not flags & FLAG_PADDED:
+            return payload
+        if not payload or payload[0] >= len(payload):
+            raise H2ConnectionError(PROTOCOL_ERROR, "Invalid padding")
+        return payload[1:len(payload) - payload[0]]
+
+    def _on_data(self, flags, stream_id, payload):
+        if stream_id == 0:
+            raise H2ConnectionError(PROTOCOL_ERROR, "DATA on stream 0")
+        data = self._strip_padding(flags, payload)
+        # Connection-level credit is returned at once; streams are bounded by their own window
+        if payload:
+            self._write_frame(WINDOW_UPDATE, 0, 0, struct.pack('>I', len(payload)))
+
+        start = None
+        with self.lock:
+            stream = self.streams.get(stream_id)
+            if stream is None or stream.body_done:
+                closed = True
+            else:
+                closed = False
+                stream.recv_window -= len(payload)
+                overflow = stream.recv_window < 0 or (
+                    stream.pending_request and len(stream.body) + len(data) > MAX_UNSIZED_BODY)
+                if not overflow:
+                    stream.body += data
+                    if flags & FLAG_END_STREAM:
+                        stream.body_done = True
+                        start = self._take_pending(stream)
+                    self.lock.notify_all()
+        if closed:
+            if stream_id > self.last_stream_id:
+                raise H2ConnectionError(PROTOCOL_ERROR, "DATA on idle stream")
+            self._reset_stream(stream_id, STREAM_CLOSED)
+            return
+        if overflow:
+            self._abort_stream(stream, FLOW_CONTROL_ERROR if stream.recv_window < 0 else REFUSED_STREAM)
+            return
+        padding = len(payload) - len(data)
+        if stream.pending_request and data:
+            padding += len(data)  # Buffered until END_STREAM, so keep the window open
+        if padding and not stream.body_done:
+            stream.recv_window += padding
+            self._write_frame(WINDOW_UPDATE, 0, stream_id, struct.pack('>I', padding))
+        if start:
+            self._start_stream(stream, *start)
+
+    def _on_headers(self, flags, stream_id, payload):
+        if stream_id == 0 or stream_id % 2 == 0:
+            raise H2ConnectionError(PROTOCOL_ERROR, "Invalid stream id for HEADERS")
+        block = self._strip_padding(flags, payload)
+        if flags & FLAG_PRIORITY:
+            block = block[5:]
+        if flags & FLAG_END_HEADERS:
+            self._on_header_block(stream_id, flags, block)
+        else:
+            self.continuation = (stream_id, flags, bytearray(block))
+
+    def _on_continuation(self, flags, stream_id, payload):
+        if not self.continuation or self.continuation[0] != stream_id:
+            raise H2ConnectionError(PROTOCOL_ERROR, "Unexpected CONTINUATION frame")
+        block = self.continuation[2]
+        block += payload
+        if len(block) > MAX_HEADER_BLOCK_SIZE:
+            raise H2ConnectionError(PROTOCOL_ERROR, "Header block too large")
+        if flags & FLAG_END_HEADERS:
+            first_flags = self.continuation[1]
+            self.continuation = None
+            self._on_header_block(stream_id, first_flags, bytes(block))
+
+    def _on_header_block(self, stream_id, flags, block):
+        try:
+            header_list = self.decoder.decode(block)
+        except HPACKError as e:
+            raise H2ConnectionError(COMPRESSION_ERROR, str(e))
+        end_stream = bool(flags & FLAG_END_STREAM)
+
+        with self.lock:
+            stream = self.streams.get(stream_id)
+            if stream is not None:
+                # Trailers: they only mark the end of the body
+                if not end_stream:
+                    raise H2ConnectionError(PROTOCOL_ERROR, "Trailers without END_STREAM")
+                stream.body_done = True
+                start = self._take_pending(stream)
+                self.lock.notify_all()
+        if stream is not None:
+            if start:
+                self._start_stream(stream, *start)
+            return
+        with self.lock:
+            if stream_id <= self.last_stream_id:
+                raise H2ConnectionError(PROTOCOL_ERROR, "Stream id reused")
+            self.last_stream_id = stream_id
+            # After GOAWAY every new stream is past the announced id; the client retries it elsewhere
+            refused = (len(self.streams) >= MAX_CONCURRENT_STREAMS or self.goaway_stream_id is not None
+                       or self.peer_going_away)
+            if not refused:
+                stream = Stream(stream_id, self.peer_initial_window)
+                stream.body_done = end_stream
+                self.streams[stream_id] = stream
+        if refused:
+            self._reset_stream(stream_id, REFUSED_STREAM)
+            return
+
+        pseudo = {}
+        headers = {}
+        for name, value in header_list:
+            if name.startswith(':'):
+                pseudo[name] = value
+            elif name in headers:
+                headers[name] += ('; ' if name == 'cookie' else ', ') + value
+            else:
+                headers[name] = value
+        if ':method' not in pseudo or ':path' not in pseudo:
+            self._abort_stream(stream, PROTOCOL_ERROR)
+            return
+        if ':authority' in pseudo:
+            headers.setdefault('host', pseudo[':authority'])
+
+        request = (pseudo[':method'], pseudo[':path'], headers)
+        if not end_stream and 'content-length' not in headers:
+            # The handlers need a Content-Length, so wait for the whole body
+            stream.pending_request = request
+            return
+        self._start_stream(stream, *request)
+
+    def _take_pending(self, stream):
+        """Return the deferred request of a stream whose body just completed."""
+        request = stream.pending_request
+        if request:
+            stream.pending_request = None
+            request[2]['content-length'] = str(len(stream.body))
+        return request
+
+    def _on_priority(self, flags, stream_id, payload):
+        if len(payload) != 5:
+            raise H2ConnectionError(FRAME_SIZE_ERROR, "Invalid PRIORITY frame")
+
+    def _on_rst_stream(self, flags, stream_id, payload):
+        if stream_id == 0 or len(payload) != 4:
+            raise H2ConnectionError(PROTOCOL_ERROR, "Invalid RST_STREAM frame")
+        with self.lock:
+            stream = self.streams.get(stream_id)
+            if stream is not None:
+                stream.reset = True
+                if stream.thread is None:
+                    del self.streams[stream_id]
+                self.lock.notify_all()
+
+    def _on_settings(self, flags, stream_id, payload):
+        if stream_id != 0:
+            raise H2ConnectionError(PROTOCOL_ERROR, "SETTINGS on a stream")
+        if flags & FLAG_ACK:
+            return
+        self._apply_settings(payload)
+        self._write_frame(SETTINGS, FLAG_ACK, 0)
+
+    def _apply_settings(self, payload):
+        if len(payload) % 6:
+            raise H2ConnectionError(FRAME_SIZE_ERROR, "Invalid SETTINGS length")
+        for offset in range(0, len(payload), 6):
+            identifier, value = struct.unpack('>HI', payload[offset:offset + 6])
+            if identifier == SETTINGS_INITIAL_WINDOW_SIZE:
+                if value > MAX_WINDOW_SIZE:
+                    raise H2ConnectionError(FLOW_CONTROL_ERROR, "Initial window too large")
+                with self.lock:
+                    delta = value - self.peer_initial_window
+                    self.peer_initial_window = value
+                    for stream in self.streams.values():
+                        stream.send_window += delta
+                    self.lock.notify_all()
+            elif identifier == SETTINGS_MAX_FRAME_SIZE:
+                if not DEFAULT_MAX_FRAME_SIZE <= value <= 2 ** 24 - 1:
+                    raise H2ConnectionError(PROTOCOL_ERROR, "Invalid SETTINGS_MAX_FRAME_SIZE")
+                self.peer_max_frame_size = value
+            elif identifier == SETTINGS_ENABLE_PUSH and value > 1:
+                raise H2ConnectionError(PROTOCOL_ERROR, "Invalid SETTINGS_ENABLE_PUSH")
+            # The encoder never uses the dynamic table, so HEADER_TABLE_SIZE needs no action
+
+    def _on_push_promise(self, flags, stream_id, payload):
+        raise H2ConnectionError(PROTOCOL_ERROR, "Clients cannot push")
+
+    def _on_ping(self, flags, stream_id, payload):
+        if stream_id != 0:
+            raise H2ConnectionError(PROTOCOL_ERROR, "PING on a stream")
+        if len(payload) != 8:
+            raise H2ConnectionError(FRAME_SIZE_ERROR, "Invalid PING length")
+        if not flags & FLAG_ACK:
+            self._write_frame(PING, FLAG_ACK, 0, payload)
+
+    def _on_goaway(self, flags, stream_id, payload):
+        if stream_id != 0 or len(payload) < 8:
+            raise H2ConnectionError(PROTOCOL_ERROR, "Invalid GOAWAY frame")
+        # Frames keep being read, since the active streams may still need WINDOW_UPDATEs;
+        # the connection closes once the last of them is done
+        with self.lock:
+            self.peer_going_away = True
+            idle = not self.streams
+        if idle:
+            raise EOFError
+
+    def _on_window_update(self, flags, stream_id, payload):
+        if len(payload) != 4:
+            raise H2ConnectionError(FRAME_SIZE_ERROR, "Invalid WINDOW_UPDATE length")
+        increment = struct.unpack('>I', payload)[0] & 0x7fffffff
+        with self.lock:
+            if stream_id == 0:
+                if increment == 0:
+                    raise H2ConnectionError(PROTOCOL_ERROR, "Zero WINDOW_UPDATE increment")
+                self.send_window += increment
+                if self.send_window > MAX_WINDOW_SIZE:
+                    raise H2ConnectionError(FLOW_CONTROL_ERROR, "Connection window overflow")
+                self.lock.notify_all()
+                return
+            stream = self.streams.get(stream_id)
+            if stream is None:
+                return
+            if increment == 0 or stream.send_window + increment > MAX_WINDOW_SIZE:
+                overflow = True
+            else:
+                overflow = False
+                stream.send_window += increment
+                self.lock.notify_all()
+        if overflow:
+            self._abort_stream(stream, FLOW_CONTROL_ERROR)
+
+    # Streams
+
+    def _abort_stream(self, stream, error_code):
+        with self.lock:
+            stream.reset = True
+            if stream.thread is None:
+                self.streams.pop(stream.stream_id, None)
+            self.lock.notify_all()
+        self._reset_stream(stream.stream_id, error_code)
+
+    def _start_stream(self, stream, method, path, headers):
+        if self.stream_slots is not None and not self.stream_slots.acquire(blocking=False):
+            # Every handler thread is taken; the client may send the request again
+            self._abort_stream(stream, REFUSED_STREAM)
+            return
+        stream.thread = threading.Thread(target=self._run_stream, args=(stream, method, path, headers),
+                                         daemon=True)
+        stream.thread.start()
+
+    def _run_stream(self, stream, method, path, headers):
+        stream_socket = StreamSocket(self, stream)
+        try:
+            self.dispatch(stream_socket, method, path, headers, b'')
+            stream_socket.finish()
+        except (StreamReset, OSError):
+            pass
+        except Exception:
+            if not stream.reset and not self.closed:
+                self._reset_stream(stream.stream_id, INTERNAL_ERROR)
+        finally:
+            if self.stream_slots is not None:
+                self.stream_slots.release()
+            with self.lock:
+                self.streams.pop(stream.stream_id, None)
+                self.lock.notify_all()
+                drained = (self.goaway_stream_id is not None or self.peer_going_away) and not self.streams
+            if drained:
+                self._wake_reader()
+
+    def _start_upgraded_stream(self, method, path, headers):
+        """Serve the HTTP/1.1 request that carried the upgrade as stream 1."""
+        encoded = headers['http2-settings'].strip()
+        self._apply_settings(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+        stream = Stream(1, self.peer_initial_window)
+        stream.body_done = True
+        self.last_stream_id = 1
+        self.streams[1] = stream
+        self._start_stream(stream, method, path, headers)
+
+    def serve(self, upgrade_request=None):
+        """Run the connection until the peer goes away or a protocol error occurs."""
+        error_code = NO_ERROR
+        try:
+            self._send_settings()
+            if upgrade_request:
+                self._start_upgraded_stream(*upgrade_request)
+            with self.lock:
+                self.settings_sent = True
+                going_away = self.going_away
+            if going_away:
+                self._announce_goaway()
+            if self._read_exact(len(PREFACE)) != PREFACE:
+                raise H2ConnectionError(PROTOCOL_ERROR, "Invalid connection preface")
+            while True:
+                try:
+                    frame = self._read_frame()
+                except socket.timeout:
+                    with self.lock:
+                        if self.streams:
+                            continue  # Still busy; only idle connections time out
+                    break
+                self._handle_frame(*frame)
+        except H2ConnectionError as e:
+            error_code = e.error_code
+        except (EOFError, OSError):
+            pass
+        self._close(error_code)
+
+    def _close(self, error_code):
+        # Wake every stream still waiting on input or flow-control credit
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+            threads = [stream.thread for stream in self.streams.values() if stream.thread]
+        for thread in threads:
+            thread.join()
+        # A second GOAWAY must not announce more streams than the first
+        last_stream_id = self.last_stream_id if self.goaway_stream_id is None else self.goaway_stream_id
+        try:
+            self._write_frame(GOAWAY, 0, 0, struct.pack('>II', last_stream_id, error_code))
+        except OSError:
+            pass
@@ -0,0 +1,211 @@
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Configuration
+SNAPSHOT_FRAMES = 10   # Traceback depth recorded by tracemalloc
+SNAPSHOT_TOP = 25      # Call sites shown in a snapshot diff
+
+# What the buffered bytes are used for
+CATEGORIES = ('request', 'response', 'cache')
+
+
+class MemoryBudget:
+    """Global count of buffered bytes with a hard limit.
+
+    The limit comes from the server's configuration: it is None until
+    set_limit() is called.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.lock = threading.Lock()
+        self.used = dict.fromkeys(CATEGORIES, 0)
+        self.total = 0
+        self.peak = 0
+        self.rejected = 0   # Reservations refused
+        self.streamed = 0   # Responses streamed because they did not fit
+        self.connections = 0
+
+    def set_limit(self, limit):
+        with self.lock:
+            self.limit = limit
+
+    def try_reserve(self, size, category):
+        """Reserve size bytes if they fit in the budget."""
+        with self.lock:
+            if self.total + size > self.limit:
+                self.rejected += 1
+                return False
+            self._add(size, category)
+        return True
+
+    def charge(self, size, category):
+        """Count size bytes whether or not they fit, for buffers that must exist."""
+        with self.lock:
+            self._add(size, category)
+
+    def release(self, size, category):
+        with self.lock:
+            self.used[category] -= size
+            self.total -= size
+
+    def _add(self, size, category):
+        self.used[category] += size
+        self.total += size
+        if self.total > self.peak:
+            self.peak = self.total
+
+    def stats(self):
+        with self.lock:
+            return {
+                'limit': self.limit,
+                'total': self.total,
+                'peak': self.peak,
+                'rejected': self.rejected,
+                'streamed': self.streamed,
+                'connections': self.connections,
+                **{f"{category}_bytes": used for category, used in self.used.items()},
+            }
+
+
+class ConnectionAccount:
+    """Per-connection share of the global budget."""
+
+    def __init__(self, budget, limit):
+        self.budget = budget
+        self.limit = limit
+        self.used = dict.fromkeys(CATEGORIES, 0)
+        self.total = 0
+
+    def try_reserve(self, size, category):
+        if self.total + size > self.limit:
+            with self.budget.lock:
+                self.budget.rejected += 1
+            return False
+        if not self.budget.try_reserve(size, category):
+            return False
+        self.used[category] += size
+        self.total += size
+        return True
+
+    def charge(self, size, category):
+        self.budget.charge(size, category)
+        self.used[category] += size
+        self.total += size
+
+    def release(self, size, category):
+        self.budget.release(size, category)
+        self.used[category] -= size
+        self.total -= size
+
+    def close(self):
+        """Return whatever the connection still holds to the global budget."""
+        for category, size in self.used.items():
+            if size:
+                self.release(size, category)
+
+
+budget = MemoryBudget()
+_local = threading.local()
+
+
+def open_account(limit):
+    """Start accounting the current thread's connection against its own limit."""
+    account = ConnectionAccount(budget, limit)
+    _local.account = account
+    with budget.lock:
+        budget.connections += 1
+    return account
+
+
+def close_account():
+    account = getattr(_local, 'account', None)
+    if account is None:
+        return
+    _local.account = None
+    account.close()
+    with budget.lock:
+        budget.connections -= 1
+
+
+def _current():
+    # Work done outside a connection is charged to the global budget only
+    return getattr(_local, 'account', None) or budget
+
+
+def try_reserve(size, category):
+    return _current().try_reserve(size, category)
+
+
+def release(size, category):
+    _current().release(size, category)
+
+
+@contextmanager
+def hold(size, category):
+    """Count a buffer of size bytes for as long as the enclosed block runs."""
+    account = _current()
+    account.charge(size, category)
+    try:
+        yield
+    finally:
+        account.release(size, category)
+
+
+def note_streamed():
+    with budget.lock:
+        budget.streamed += 1
+
+
+def format_stats(extra=None):
+    """Render the live counters as plain text."""
+    stats = budget.stats()
+    if extra:
+        stats.update(extra)
+    return ''.join(f"{key}: {value}\n" for key, value in stats.items())
+
+
+# tracemalloc snapshots
+
+_snapshot_lock = threading.Lock()
+_snapshot = None
+
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def snapshot_diff(key_type='lineno', top=SNAPSHOT_TOP):
+    """Compare a new tracemalloc snapshot with the previous one.
+
+    The first call starts tracemalloc and records the baseline, since tracing
+    slows every allocation down and is off until somebody asks for it.
+    """
+    global _snapshot
+    with _snapshot_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(SNAPSHOT_FRAMES)
+            _snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+            return "tracemalloc started and a baseline snapshot taken; request again for a diff.\n"
+        snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        previous, _snapshot = _snapshot, snapshot
+
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"Traced memory: current={current} peak={peak}",
+             f"Top {top} allocation changes since the previous snapshot (by {key_type}):"]
+    for stat in snapshot.compare_to(previous, key_type)[:top]:
+        lines.append(f"  {stat}")
+        if key_type == 'traceback':
+            lines.extend(f"    {line}" for line in stat.traceback.format())
+    return '\n'.join(lines) + '\n'
+
+
+def stop_tracing():
+    global _snapshot
+    with _snapshot_lock:
+        tracemalloc.stop()
+        _snapshot = None
@@ -0,0 +1,224 @@
+import os
+import tempfile
+
+# Configuration
+MAX_PART_HEADER_SIZE = 8 * 1024        # Largest header block of a single part
+
+# Parser states
+PREAMBLE, AFTER_DELIMITER, PART_HEADERS, PART_BODY, DONE = range(5)
+
+
+class MultipartError(Exception):
+    """Raised when a multipart body is malformed."""
+
+
+class MultipartTooLarge(MultipartError):
+    """Raised when a part or the whole body exceeds its size limit."""
+
+
+def get_boundary(content_type):
+    """Return the boundary of a multipart/form-data Content-Type, or None."""
+    media_type, _, params = content_type.partition(';')
+    if media_type.strip().lower() != 'multipart/form-data':
+        return None
+    for param in params.split(';'):
+        key, _, value = param.strip().partition('=')
+        if key.lower() == 'boundary' and value:
+            return value.strip('"')
+    return None
+
+
+def parse_part_headers(raw):
+    """Parse the header block of a part into a dictionary with lowercase keys."""
+    headers = {}
+    for line in raw.decode('utf-8', errors='replace').split('\r\n'):
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    return headers
+
+
+def parse_disposition(value):
+    """Return (name, filename) from a Content-Disposition header value."""
+    name = filename = None
+    for param in value.split(';')[1:]:
+        key, _, val = param.strip().partition('=')
+        val = val.strip().strip('"')
+        if key.lower() == 'name':
+            name = val
+        elif key.lower() == 'filename':
+            filename = val
+    return name, filename
+
+
+class MultipartParser:
+    """Incremental multipart/form-data parser.
+
+    Data is pushed in with feed() in chunks of any size. The parser only keeps
+    as much data buffered as it needs to recognise a boundary that is split
+    across two chunks, so memory use does not depend on the size of the upload.
+    Part events are reported through the on_part_begin, on_part_data and
+    on_part_end callbacks. The size limits come from the server configuration.
+    """
+
+    def __init__(self, boundary, on_part_begin, on_part_data, on_part_end,
+                 max_part_size, max_total_size):
+        self.delimiter = b'--' + boundary.encode('latin-1')
+        self.body_delimiter = b'\r\n' + self.delimiter
+        self.on_part_begin = on_part_begin
+        self.on_part_data = on_part_data
+        self.on_part_end = on_part_end
+        self.max_part_size = max_part_size
+        self.max_total_size = max_total_size
+        self.buffer = bytearray()
+        self.state = PREAMBLE
+        self.part_size = 0
+        self.total_size = 0
+
+    @property
+    def done(self):
+        return self.state == DONE
+
+    def feed(self, data):
+        """Consume the next chunk of the body."""
+        self.total_size += len(data)
+        if self.total_size > self.max_total_size:
+            raise MultipartTooLarge("Upload exceeds the total size limit")
+        if self.state == DONE:
+            return  # Epilogue is ignored
+        self.buffer += data
+        while self._step():
+            pass
+
+    def close(self):
+        """Signal the end of the body; fails if the closing boundary was not seen."""
+        if self.state != DONE:
+            raise MultipartError("Multipart body ended before the closing boundary")
+
+    def _step(self):
+        """Advance the state machine once; return False when more data is needed."""
+        buf = self.buffer
+        if self.state == PREAMBLE:
+            index = buf.find(self.delimiter)
+            if index < 0:
+                # Keep only the tail that may hold the start of the delimiter
+                del buf[:max(0, len(buf) - len(self.delimiter) + 1)]
+                return False
+            del buf[:index + len(self.delimiter)]
+            self.state = AFTER_DELIMITER
+            return True
+
+        if self.state == AFTER_DELIMITER:
+            if len(buf) < 2:
+                return False
+            if buf[:2] == b'--':
+                self.state = DONE
+                buf.clear()
+                return False
+            if buf[:2] != b'\r\n':
+                raise MultipartError("Malformed multipart boundary")
+            del buf[:2]
+            self.state = PART_HEADERS
+            return True
+
+        if self.state == PART_HEADERS:
+            index = buf.find(b'\r\n\r\n')
+            if index < 0:
+                if len(buf) > MAX_PART_HEADER_SIZE:
+                    raise MultipartTooLarge("Part headers are too large")
+                return False
+            headers = parse_part_headers(bytes(buf[:index]))
+            del buf[:index + 4]
+            self.part_size = 0
+            self.on_part_begin(headers)
+            self.state = PART_BODY
+            return True
+
+        if self.state == PART_BODY:
+            index = buf.find(self.body_delimiter)
+            if index < 0:
+                # Everything except a possible partial delimiter can be flushed
+                safe = len(buf) - len(self.body_delimiter) + 1
+                if safe > 0:
+                    self._emit(buf[:safe])
+                    del buf[:safe]
+                return False
+            self._emit(buf[:index])
+            del buf[:index + len(self.body_delimiter)]
+            self.on_part_end()
+            self.state = AFTER_DELIMITER
+            return True
+
+        return False
+
+    def _emit(self, data):
+        if not data:
+            return
+        self.part_size += len(data)
+        if self.part_size > self.max_part_size:
+            raise MultipartTooLarge("Part exceeds the per-part size limit")
+        self.on_part_data(bytes(data))
+
+
+class UploadWriter:
+    """Multipart callbacks that stream file parts straight to disk.
+
+    Each file part is written to a temporary file next to its destination and
+    renamed into place once the part is complete, so an aborted upload never
+    leaves a truncated file behind. The temporary name is unique, so two
+    uploads of the same filename never write into the same file; the last
+    one to finish wins whole. Plain form fields are kept in memory up to
+    max_field_size bytes.
+    """
+
+    def __init__(self, upload_dir, max_field_size):
+        self.upload_dir = upload_dir
+        self.max_field_size = max_field_size
+        self.saved_files = []
+        self.fields = {}
+        self._file = None
+        self._tmp_path = None
+        self._dest_path = None
+        self._field_name = None
+        self._field_value = None
+
+    def on_part_begin(self, headers):
+        name, filename = parse_disposition(headers.get('content-disposition', ''))
+        if filename:
+            # Never trust client supplied paths
+            safe_name = os.path.basename(filename.replace('\\', '/'))
+            if not safe_name or safe_name in ('.', '..'):
+                raise MultipartError("Invalid upload filename")
+            self._dest_path = os.path.join(self.upload_dir, safe_name)
+            fd, self._tmp_path = tempfile.mkstemp(prefix=f".{safe_name}.", suffix='.part', dir=self.upload_dir)
+            # mkstemp creates the file private; published files are readable like any other
+            os.fchmod(fd, 0o644)
+            self._file = os.fdopen(fd, 'wb')
+        else:
+            self._field_name = name or ''
+            self._field_value = bytearray()
+
+    def on_part_data(self, data):
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._field_value += data
+            if len(self._field_value) > self.max_field_size:
+                raise MultipartTooLarge("Form field is too large")
+
+    def on_part_end(self):
+        if self._file is not None:
+            self._file.close()
+            os.replace(self._tmp_path, self._dest_path)
+            self.saved_files.append(self._dest_path)
+            self._file = self._tmp_path = self._dest_path = None
+        else:
+            self.fields[self._field_name] = self._field_value.decode('utf-8', errors='replace')
+            self._field_name = self._field_value = None
+
+    def abort(self):
+        """Remove the partially written file of an interrupted upload."""
+        if self._file is not None:
+            self._file.close()
+            os.remove(self._tmp_path)
+            self._file = self._tmp_path = self._dest_path = None
@@ -0,0 +1,175 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Configuration
+PROFILE_DIR = './profiles'
+DEFAULT_PROFILE_SECONDS = 10
+MAX_PROFILE_SECONDS = 300
+SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+TOP_ENTRIES = 30
+PROFILE_MODES = ('cprofile', 'sample')
+
+_lock = threading.Condition()
+_mode = None            # Active mode, or None when idle
+_started = None
+_seconds = 0
+_profilers = {}         # thread id -> cProfile.Profile, reused across requests
+_in_flight = 0          # Requests currently running with a profiler enabled
+_samples = Counter()    # Collapsed stack -> sample count
+_last_report = "No profile has been recorded yet.\n"
+_local = threading.local()
+
+
+def profiling_status():
+    with _lock:
+        if _mode is None:
+            return None
+        return _mode, _seconds - (time.monotonic() - _started)
+
+
+def start_profile(mode='sample', seconds=DEFAULT_PROFILE_SECONDS):
+    """Profile for a fixed window; return False if a profile is already running."""
+    global _mode, _started, _seconds
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode: {mode}")
+    seconds = max(1, min(float(seconds), MAX_PROFILE_SECONDS))
+    with _lock:
+        if _mode is not None:
+            return False
+        _mode = mode
+        _started = time.monotonic()
+        _seconds = seconds
+        _profilers.clear()
+        _samples.clear()
+    if mode == 'sample':
+        threading.Thread(target=_sample_loop, args=(seconds,), daemon=True).start()
+    else:
+        timer = threading.Timer(seconds, stop_profile)
+        timer.daemon = True
+        timer.start()
+    return True
+
+
+@contextmanager
+def profile_request():
+    """Run the enclosed request under cProfile while a cProfile window is open.
+
+    cProfile only sees the thread that enabled it, so each worker thread gets
+    its own profiler; they are merged when the window closes.
+    """
+    global _in_flight
+    if _mode != 'cprofile' or getattr(_local, 'active', False):
+        yield
+        return
+    with _lock:
+        if _mode != 'cprofile':
+            profiler = None
+        else:
+            profiler = _profilers.setdefault(threading.get_ident(), cProfile.Profile())
+            _in_flight += 1
+    if profiler is None:
+        yield
+        return
+    _local.active = True
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _local.active = False
+        with _lock:
+            _in_flight -= 1
+            _lock.notify_all()
+
+
+def _sample_loop(seconds):
+    """Sample the stacks of every other thread until the window closes."""
+    own_id = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline and _mode == 'sample':
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            _samples[';'.join(reversed(stack))] += 1
+        time.sleep(SAMPLE_INTERVAL)
+    stop_profile()
+
+
+def stop_profile():
+    """Close the profiling window, dump the stats and return the text report.
+
+    Called from inside a profiled request (an admin ?stop=1), the caller's
+    own profiler is read as it is: its thread cannot disable it before this
+    returns, so waiting on it would never end.
+    """
+    global _mode, _last_report
+    own = 1 if getattr(_local, 'active', False) else 0
+    with _lock:
+        mode = _mode
+        if mode is None:
+            return _last_report
+        _mode = None
+        # Profilers may only be read once their threads have disabled them
+        while _in_flight > own:
+            _lock.wait()
+        profilers = list(_profilers.values())
+        _profilers.clear()
+        samples = Counter(_samples)
+        _samples.clear()
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    if mode == 'cprofile':
+        report = _cprofile_report(profilers, os.path.join(PROFILE_DIR, f"profile-{stamp}.pstats"))
+    else:
+        report = _sample_report(samples, os.path.join(PROFILE_DIR, f"profile-{stamp}.folded"))
+    with _lock:
+        _last_report = report
+    return report
+
+
+def _cprofile_report(profilers, dump_path):
+    if not profilers:
+        return "cProfile window closed without any profiled requests.\n"
+    stats = pstats.Stats(profilers[0])
+    for profiler in profilers[1:]:
+        stats.add(profiler)
+    stats.dump_stats(dump_path)
+    output = io.StringIO()
+    stats.stream = output
+    stats.sort_stats('cumulative').print_stats(TOP_ENTRIES)
+    return f"cProfile stats written to {dump_path}\n{output.getvalue()}"
+
+
+def _sample_report(samples, dump_path):
+    total = sum(samples.values())
+    if not total:
+        return "Sampling window closed without any samples.\n"
+    # Collapsed stacks, ready for flamegraph tools
+    with open(dump_path, 'w') as dump_file:
+        for stack, count in samples.most_common():
+            dump_file.write(f"{stack} {count}\n")
+
+    leaves = Counter()
+    for stack, count in samples.items():
+        leaves[stack.rsplit(';', 1)[-1]] += count
+    lines = [f"Sampled stacks written to {dump_path}", f"{total} samples", "",
+             "Top functions (self samples):"]
+    for function, count in leaves.most_common(TOP_ENTRIES):
+        lines.append(f"  {count / total * 100:6.2f}%  {function}")
+    lines += ["", "Top stacks:"]
+    for stack, count in samples.most_common(10):
+        lines.append(f"  {count / total * 100:6.2f}%  {stack}")
+    return '\n'.join(lines) + '\n'
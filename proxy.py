@@ -0,0 +1,473 @@
+import argparse
+import itertools
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from cluster import IDEMPOTENT_METHODS, ClientGone, PeerError, PeerPool, recv_from_client, send_to_client
+from http2 import StreamSocket
+
+# Configuration
+BALANCERS = ('round_robin', 'least_connections')
+MAX_UPSTREAM_CONNECTIONS = 32  # Connections in use to one upstream at a time
+UPSTREAM_TIMEOUT = 30          # Seconds to connect to or wait on an upstream
+HEALTH_INTERVAL = 5            # Seconds between active health checks
+HEALTH_TIMEOUT = 2
+MAX_FAILURES = 2               # Consecutive failures that take an upstream out of rotation
+RELAY_CHUNK_SIZE = 64 * 1024
+MAX_UPSTREAM_HEAD_SIZE = 64 * 1024
+
+# Hop-by-hop headers, and the ones rebuilt for the upstream request
+HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'te', 'trailer', 'transfer-encoding',
+               'upgrade', 'http2-settings', 'expect'}
+REBUILT_HEADERS = HOP_HEADERS | {'host', 'content-length', 'x-forwarded-for'}
+
+# Responses that never have a body, whatever their headers say
+BODYLESS_STATUSES = {204, 304}
+
+
+class _Reader:
+    """Buffered reads from an upstream connection."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b''
+
+    def _fill(self):
+        chunk = self.sock.recv(RELAY_CHUNK_SIZE)
+        self.buffer += chunk
+        return len(chunk)
+
+    def read_head(self):
+        """Return the lines of the next response head."""
+        while True:
+            head_end = self.buffer.find(b'\r\n\r\n')
+            if head_end >= 0:
+                break
+            if len(self.buffer) > MAX_UPSTREAM_HEAD_SIZE:
+                raise PeerError("Response head too large")
+            if not self._fill():
+                # On a pooled connection this is the usual sign it went stale
+                raise ConnectionError("Upstream closed the connection")
+        head, self.buffer = self.buffer[:head_end], self.buffer[head_end + 4:]
+        return head.decode('latin-1').split('\r\n')
+
+    def readline(self):
+        while True:
+            line_end = self.buffer.find(b'\r\n')
+            if line_end >= 0:
+                line, self.buffer = self.buffer[:line_end], self.buffer[line_end + 2:]
+                return line
+            if len(self.buffer) > MAX_UPSTREAM_HEAD_SIZE or not self._fill():
+                raise ConnectionError("Malformed chunked body from upstream")
+
+    def read(self, size):
+        """Return up to size bytes of body, b'' at EOF."""
+        if self.buffer:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+            return data
+        return self.sock.recv(min(size, RELAY_CHUNK_SIZE))
+
+    def chunks(self):
+        """Yield the data of a chunked body, consuming its trailers."""
+        while True:
+            try:
+                size = int(self.readline().split(b';', 1)[0], 16)
+            except ValueError:
+                raise ConnectionError("Malformed chunk size from upstream") from None
+            if size == 0:
+                while self.readline():
+                    pass
+                return
+            while size:
+                data = self.read(size)
+                if not data:
+                    raise ConnectionError("Upstream closed the connection mid-chunk")
+                size -= len(data)
+                yield data
+            self.readline()
+
+
+class Upstream:
+    """One backend address with its load and health."""
+
+    def __init__(self, address):
+        self.address = address
+        self.healthy = True
+        self.failures = 0   # Consecutive failed requests or checks
+        self.active = 0     # Requests in flight
+        self.requests = 0
+        self.errors = 0
+
+
+class UpstreamGroup:
+    """The backends behind one path prefix, sharing a balancer and a connection pool.
+
+    Connections to each backend are kept alive in a PeerPool, which also caps
+    how many can be in use at once. Failed requests and health checks take a
+    backend out of rotation after MAX_FAILURES in a row; a passing health
+    check puts it back.
+    """
+
+    def __init__(self, prefix, addresses, balance='round_robin',
+                 max_connections=MAX_UPSTREAM_CONNECTIONS, health_path='/'):
+        if balance not in BALANCERS:
+            raise ValueError(f"Unknown balancer {balance!r}, expected one of {', '.join(BALANCERS)}")
+        if not addresses:
+            raise ValueError(f"No upstreams for {prefix}")
+        self.prefix = prefix
+        self.upstreams = [Upstream(address) for address in addresses]
+        self.balance = balance
+        self.health_path = health_path
+        self.pool = PeerPool(max_connections, UPSTREAM_TIMEOUT)
+        self.lock = threading.Lock()
+        self.turn = itertools.count()
+
+    def choose(self, exclude=()):
+        """Pick the next upstream and count it as busy; None when all were tried.
+
+        Only healthy upstreams are picked while there are any, so a request
+        still gets a chance when every upstream is marked down.
+        """
+        with self.lock:
+            candidates = [upstream for upstream in self.upstreams if upstream not in exclude]
+            candidates = [upstream for upstream in candidates if upstream.healthy] or candidates
+            if not candidates:
+                return None
+            # Rotating the start spreads ties under least_connections as well
+            start = next(self.turn) % len(candidates)
+            candidates = candidates[start:] + candidates[:start]
+            if self.balance == 'least_connections':
+                upstream = min(candidates, key=lambda candidate: candidate.active)
+            else:
+                upstream = candidates[0]
+            upstream.active += 1
+            return upstream
+
+    def finish(self, upstream, succeeded):
+        """Count a request as done; succeeded is None when the upstream was not at fault."""
+        with self.lock:
+            upstream.active -= 1
+            upstream.requests += 1
+            if succeeded is False:
+                upstream.errors += 1
+                self._failed(upstream)
+            elif succeeded:
+                upstream.failures = 0
+
+    def _failed(self, upstream):
+        upstream.failures += 1
+        # Without health checks nothing would bring an upstream back
+        if self.health_path is not None and upstream.failures >= MAX_FAILURES and upstream.healthy:
+            upstream.healthy = False
+            print(f"Upstream {upstream.address} for {self.prefix} is down")
+
+    def _request_head(self, upstream, method, path, headers, content_length, client):
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {headers.get('host') or upstream.address}"]
+        lines += [f"{key}: {value}" for key, value in headers.items()
+                  if key not in REBUILT_HEADERS and not key.startswith(':')]
+        if client:
+            forwarded_for = headers.get('x-forwarded-for')
+            lines.append(f"X-Forwarded-For: {forwarded_for + ', ' if forwarded_for else ''}{client}")
+        if content_length or method in ('POST', 'PUT', 'PATCH'):
+            lines.append(f"Content-Length: {content_length}")
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    def forward(self, conn, method, path, headers, body, client=None):
+        """Relay one request upstream and stream the response back to conn.
+
+        The request body is copied from conn as it arrives and the response
+        is relayed piece by piece, so neither is buffered whole. Returns
+        (status, upstream address). An upstream that fails before the body
+        starts streaming is retried on the next one; PeerError means none
+        answered and nothing reached the client.
+        """
+        content_length = int(headers.get('content-length') or 0)
+        body = body[:content_length]
+        remaining = content_length - len(body)
+        tried = []
+        while True:
+            upstream = self.choose(tried)
+            if upstream is None:
+                raise PeerError(f"No upstream available for {self.prefix}")
+            sock = None
+            reusable = False
+            succeeded = None  # None: the upstream was not at fault, e.g. a stale connection
+            sent = False
+            try:
+                sock, reused = self.pool.acquire(upstream.address)
+                try:
+                    sock.sendall(self._request_head(upstream, method, path, headers, content_length, client)
+                                 + body)
+                    sent = True
+                    while remaining > 0:
+                        chunk = recv_from_client(conn, min(RELAY_CHUNK_SIZE, remaining))
+                        remaining -= len(chunk)
+                        sock.sendall(chunk)
+                    reader = _Reader(sock)
+                    lines = reader.read_head()
+                    # Interim responses such as 103 Early Hints are not relayed
+                    while lines[0][9:10] == '1' and lines[0][9:12] != '101':
+                        lines = reader.read_head()
+                except ClientGone:
+                    raise
+                except OSError as e:
+                    if (reused and remaining == content_length - len(body)
+                            and (not sent or method in IDEMPOTENT_METHODS)):
+                        # A stale pooled connection; try again on a fresh one
+                        continue
+                    raise PeerError(f"{upstream.address}: {e}") from e
+
+                # From here on the client has part of the response: no retry, no 502
+                succeeded = False
+                try:
+                    reusable = self._relay_response(conn, reader, method, lines)
+                except ClientGone:
+                    # Only errors on the upstream socket count against it
+                    succeeded = None
+                    raise
+                succeeded = True
+                return lines[0][9:], upstream.address
+            except PeerError:
+                if succeeded is not None:
+                    raise
+                succeeded = False
+                # Another upstream only gets the request if this one cannot have acted on it
+                if remaining == content_length - len(body) and (not sent or method in IDEMPOTENT_METHODS):
+                    tried.append(upstream)
+                    continue
+                raise
+            finally:
+                if sock is not None:
+                    self.pool.release(upstream.address, sock, reusable)
+                self.finish(upstream, succeeded)
+
+    def _relay_response(self, conn, reader, method, lines):
+        """Send the response head and body to conn; return whether the upstream connection is reusable."""
+        version, _, status = lines[0].partition(' ')
+        code = int(status[:3])
+        length = None
+        chunked = False
+        keep_alive = version == 'HTTP/1.1'
+        head = [f"HTTP/1.1 {status}"]
+        for line in lines[1:]:
+            key, _, value = line.partition(':')
+            key = key.strip().lower()
+            if key == 'content-length':
+                length = int(value)
+            elif key == 'transfer-encoding':
+                chunked = 'chunked' in value.lower()
+            elif key == 'connection':
+                keep_alive = 'close' not in value.lower()
+            if key not in HOP_HEADERS and key != 'content-length':
+                head.append(line)
+
+        if method == 'HEAD' or code in BODYLESS_STATUSES:
+            # HEAD keeps the length the body would have had
+            if length is not None:
+                head.append(f"Content-Length: {length}")
+            send_to_client(conn, ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+            return keep_alive
+        if length is not None and not chunked:
+            head.append(f"Content-Length: {length}")
+            send_to_client(conn, ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+            while length > 0:
+                data = reader.read(length)
+                if not data:
+                    raise ConnectionError("Upstream closed the connection mid-response")
+                length -= len(data)
+                send_to_client(conn, data)
+            return keep_alive and not reader.buffer
+
+        # Unknown length: re-chunk for HTTP/1.1 clients; HTTP/2 streams frame it themselves
+        framed = not isinstance(conn, StreamSocket)
+        if framed:
+            head.append("Transfer-Encoding: chunked")
+        send_to_client(conn, ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        pieces = reader.chunks() if chunked else iter(lambda: reader.read(RELAY_CHUNK_SIZE), b'')
+        for data in pieces:
+            send_to_client(conn, b'%x\r\n%s\r\n' % (len(data), data) if framed else data)
+        if framed:
+            send_to_client(conn, b'0\r\n\r\n')
+        # A body that ends with the connection leaves nothing to reuse
+        return chunked and keep_alive and not reader.buffer
+
+    def check(self, upstream):
+        """Poll one upstream's health path on a fresh connection."""
+        host, port = upstream.address.rsplit(':', 1)
+        request = (f"GET {self.health_path} HTTP/1.1\r\nHost: {upstream.address}\r\n"
+                   f"Connection: close\r\n\r\n").encode('latin-1')
+        try:
+            with socket.create_connection((host, int(port)), timeout=HEALTH_TIMEOUT) as sock:
+                sock.sendall(request)
+                status = _Reader(sock).read_head()[0][9:12]
+            passed = status.isdigit() and int(status) < 500
+        except (OSError, PeerError, ValueError):
+            passed = False
+        with self.lock:
+            if passed:
+                upstream.failures = 0
+                if not upstream.healthy:
+                    upstream.healthy = True
+                    print(f"Upstream {upstream.address} for {self.prefix} is back")
+            else:
+                self._failed(upstream)
+        return passed
+
+    def stats(self):
+        with self.lock:
+            stats = {'balance': self.balance}
+            for upstream in self.upstreams:
+                stats[upstream.address] = (f"{'up' if upstream.healthy else 'down'}, {upstream.active} active, "
+                                           f"{upstream.requests} requests, {upstream.errors} errors")
+        stats.update(self.pool.stats())
+        return stats
+
+
+class ReverseProxy:
+    """Upstream groups by path prefix, with one thread running their health checks."""
+
+    def __init__(self, routes, balance='round_robin', max_connections=MAX_UPSTREAM_CONNECTIONS,
+                 health_path='/', interval=HEALTH_INTERVAL):
+        self.groups = [UpstreamGroup(prefix, addresses, balance, max_connections, health_path)
+                       for prefix, addresses in routes.items()]
+        self.interval = interval
+        self.health_path = health_path
+        self.thread = None
+
+    def start_health_checks(self):
+        if self.health_path is None or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._check_loop, daemon=True)
+        self.thread.start()
+
+    def _check_loop(self):
+        while True:
+            for group in self.groups:
+                for upstream in group.upstreams:
+                    group.check(upstream)
+            time.sleep(self.interval)
+
+    def stats(self):
+        return {group.prefix: group.stats() for group in self.groups}
+
+
+# Stand-in backends for local testing
+
+class _BackendHandler(BaseHTTPRequestHandler):
+    """Answers like a small application backend.
+
+    GET /health            200 'ok'
+    GET .../stream?chunks=N&size=S
+                           chunked response of N chunks of S bytes
+    GET .../close?size=S   body delimited by closing the connection
+    GET .../slow?seconds=T answers after T seconds
+    POST, PUT              echoes the body back
+    anything else          names the backend and the path
+    Every response carries X-Backend: port.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, length=True):
+        self.send_response(status)
+        self.send_header('X-Backend', str(self.server.server_address[1]))
+        if length:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == '/health':
+            self._send(200, b'ok')
+        elif url.path.endswith('/stream'):
+            self.send_response(200)
+            self.send_header('X-Backend', str(self.server.server_address[1]))
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            chunk = b'x' * int(query.get('size', 1024))
+            for _ in range(int(query.get('chunks', 4))):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        elif url.path.endswith('/close'):
+            self.close_connection = True
+            self.send_response(200)
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(b'y' * int(query.get('size', 1024)))
+        elif url.path.endswith('/slow'):
+            time.sleep(float(query.get('seconds', 1)))
+            self._send(200, f"backend {self.server.server_address[1]} {url.path}\n".encode())
+        else:
+            self._send(200, f"backend {self.server.server_address[1]} {url.path}\n".encode())
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.send_response(200)
+        self.send_header('X-Backend', str(self.server.server_address[1]))
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        # Streamed back as it arrives, so large bodies are never held whole
+        while length > 0:
+            data = self.rfile.read(min(RELAY_CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            self.wfile.write(data)
+
+    do_PUT = do_POST
+
+
+class StandInBackend:
+    """A backend on a local port, run on a background thread; port 0 picks a free one."""
+
+    def __init__(self, port=0, host='127.0.0.1'):
+        self.server = ThreadingHTTPServer((host, port), _BackendHandler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in backends for server8's reverse proxy.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    backends = commands.add_parser('backends', help="run stand-in backends on consecutive ports")
+    backends.add_argument('--count', type=int, default=2)
+    backends.add_argument('--base-port', type=int, default=9001)
+    args = parser.parse_args()
+
+    running = [StandInBackend(args.base_port + index).start() for index in range(args.count)]
+    print(f"Backends on {', '.join(backend.address for backend in running)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for backend in running:
+            backend.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import argparse
+import json
+import re
+import socket
+import threading
+import time
+from datetime import datetime
+from queue import Queue
+
+from connection import read_response
+
+# Configuration
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DEFAULT_CONCURRENCY = 8
+CONNECT_TIMEOUT = 10
+MAX_IMPORT_GAP = 1.0  # Longest pause kept between imported log entries, in seconds
+
+# Request lines in server.log: "GET index.html", "POST Data: ..." (server.py, server1.py)
+# and "GET /index.html", "POST /fe.txt Body: ..." after "[timestamp] Request:" (server6+)
+LOG_TIMESTAMP = re.compile(r'^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\] Request:$')
+LOG_REQUEST = re.compile(r'^(GET|POST|PUT|DELETE|HEAD) ?(\S*)(?: Body: (.*))?$')
+LOG_OLD_POST = re.compile(r'^POST Data: (.*)$')
+
+
+def load_capture(path):
+    """Read a replay file; return its request records in time order."""
+    records = []
+    with open(path) as capture_file:
+        for line in capture_file:
+            entry = json.loads(line)
+            if 'capture' not in entry:
+                records.append(entry)
+    records.sort(key=lambda entry: entry['t'])
+    return records
+
+
+def import_log(path):
+    """Turn the request lines of a server.log into replay records.
+
+    The log has one-second timestamps (or none) and no connection
+    information, so every request becomes its own connection. Pauses
+    between entries are capped at MAX_IMPORT_GAP, since the log spans
+    separate server runs.
+    """
+    records = []
+    timestamp = None
+    previous = None
+    offset = 0.0
+    with open(path, encoding='utf-8', errors='replace') as log_file:
+        for line in log_file:
+            line = line.rstrip('\r\n')
+            match = LOG_TIMESTAMP.match(line)
+            if match:
+                timestamp = datetime.strptime(match.group(1), '%Y-%m-%d %H:%M:%S').timestamp()
+                continue
+            old_post = LOG_OLD_POST.match(line)
+            if old_post:
+                method, target, body = 'POST', '/data.txt', old_post.group(1)
+            else:
+                match = LOG_REQUEST.match(line)
+                if not match:
+                    continue
+                method, target, body = match.group(1), match.group(2), match.group(3) or ''
+                target = '/' + target.lstrip('/')
+            if timestamp is not None:
+                if previous is not None:
+                    offset += min(max(timestamp - previous, 0.0), MAX_IMPORT_GAP)
+                previous = timestamp
+            records.append({'t': offset, 'c': len(records) + 1, 'm': method, 'p': target,
+                            'h': {}, 'b': len(body.encode('utf-8'))})
+    return records
+
+
+def group_connections(records):
+    """Group records by connection, preserving the keep-alive request order."""
+    sessions = {}
+    for entry in records:
+        sessions.setdefault(entry['c'], []).append(entry)
+    return sorted(sessions.values(), key=lambda session: session[0]['t'])
+
+
+def build_request(entry, host):
+    """Rebuild an HTTP/1.1 request; bodies are replaced by filler of the same size."""
+    body = b'x' * entry.get('b', 0)
+    headers = dict(entry.get('h', {}))
+    headers['host'] = headers.get('host', host)
+    headers.pop('connection', None)
+    headers.pop('upgrade', None)
+    headers.pop('http2-settings', None)
+    if body or entry['m'] == 'POST':
+        headers['content-length'] = str(len(body))
+    head = ''.join(f"{key}: {value}\r\n" for key, value in headers.items())
+    return f"{entry['m']} {entry['p']} HTTP/1.1\r\n{head}\r\n".encode('latin-1') + body
+
+
+class Replayer:
+    """Drives a server with recorded sessions at a chosen speed."""
+
+    def __init__(self, host, port, speed, concurrency):
+        self.host = host
+        self.port = port
+        self.speed = speed  # None replays as fast as possible
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.statuses = {}
+        self.mismatches = 0
+        self.errors = 0
+        self.started = None
+        self.origin = 0.0  # Capture offset of the first request
+
+    def _wait_until(self, offset):
+        if self.speed is None:
+            return
+        delay = self.started + (offset - self.origin) / self.speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _run_session(self, session):
+        sock = None
+        try:
+            for entry in session:
+                self._wait_until(entry['t'])
+                if sock is None:
+                    sock = self._connect()
+                start = time.perf_counter()
+                try:
+                    sock.sendall(build_request(entry, self.host))
+                    status, _, keep_alive = read_response(sock)
+                except OSError:
+                    with self.lock:
+                        self.errors += 1
+                    sock.close()
+                    sock = None
+                    continue
+                latency = time.perf_counter() - start
+                with self.lock:
+                    self.latencies.append(latency)
+                    self.statuses[status] = self.statuses.get(status, 0) + 1
+                    if entry.get('s') and entry['s'] != status:
+                        self.mismatches += 1
+                if not keep_alive:
+                    sock.close()
+                    sock = None
+        except OSError:
+            with self.lock:
+                self.errors += 1
+        finally:
+            if sock is not None:
+                sock.close()
+
+    def _worker(self, sessions):
+        while True:
+            session = sessions.get()
+            if session is None:
+                break
+            self._run_session(session)
+
+    def run(self, records):
+        """Replay the records; return the wall time in seconds."""
+        sessions = Queue()
+        for session in group_connections(records):
+            sessions.put(session)
+        for _ in range(self.concurrency):
+            sessions.put(None)
+        workers = [threading.Thread(target=self._worker, args=(sessions,))
+                   for _ in range(self.concurrency)]
+        self.origin = records[0]['t']
+        self.started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - self.started
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def format_comparison(records, replayer, elapsed):
+    """Compare the replay with what the capture recorded."""
+    recorded_span = records[-1]['t'] - records[0]['t'] if len(records) > 1 else 0.0
+    recorded_latency = [entry['d'] for entry in records if 'd' in entry]
+    completed = len(replayer.latencies)
+    rows = [
+        ('requests', len(records), completed),
+        ('connections', len(group_connections(records)), ''),
+        ('span s', f"{recorded_span:.3f}", f"{elapsed:.3f}"),
+        ('req/s', f"{len(records) / recorded_span:.1f}" if recorded_span else '-',
+         f"{completed / elapsed:.1f}" if elapsed else '-'),
+    ]
+    for label, fraction in (('p50 ms', 0.5), ('p90 ms', 0.9), ('p99 ms', 0.99)):
+        recorded = f"{percentile(recorded_latency, fraction) * 1000:.3f}" if recorded_latency else '-'
+        rows.append((label, recorded, f"{percentile(replayer.latencies, fraction) * 1000:.3f}"))
+    lines = [f"{'':<14}{'recorded':>12}{'replayed':>12}"]
+    lines += [f"{label:<14}{recorded:>12}{replayed:>12}" for label, recorded, replayed in rows]
+    lines.append("")
+    lines.append("statuses: " + ', '.join(f"{status}={count}" for status, count in sorted(replayer.statuses.items())))
+    lines.append(f"status mismatches: {replayer.mismatches}")
+    lines.append(f"errors: {replayer.errors}")
+    lines.append("(recorded latency is server-side, replayed latency is client round trip)")
+    return '\n'.join(lines)
+
+
+def parse_speed(value):
+    """'max' replays without delays; '1x', '10' or '0.5x' scale the recorded timing."""
+    if value == 'max':
+        return None
+    speed = float(value.rstrip('x'))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive")
+    return speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured traffic against a server variant.")
+    parser.add_argument('capture', help="replay file, or a server.log with --from-log")
+    parser.add_argument('--from-log', action='store_true', help="read requests from a server.log")
+    parser.add_argument('--convert', metavar='OUT', help="write the records as a replay file and exit")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--speed', type=parse_speed, default=1.0, help="1x, Nx or max (default 1x)")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--skip-post', action='store_true', help="do not replay requests that write")
+    args = parser.parse_args()
+
+    records = import_log(args.capture) if args.from_log else load_capture(args.capture)
+    if args.skip_post:
+        records = [entry for entry in records if entry['m'] == 'GET']
+    if args.convert:
+        with open(args.convert, 'w') as out:
+            out.write(json.dumps({'capture': 1, 'started': time.time()}) + '\n')
+            for entry in records:
+                out.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        print(f"Wrote {len(records)} requests to {args.convert}")
+        return
+    if not records:
+        print("No requests to replay.")
+        return
+
+    replayer = Replayer(args.host, args.port, args.speed, args.concurrency)
+    elapsed = replayer.run(records)
+    print(format_comparison(records, replayer, elapsed))
+
+
+if __name__ == "__main__":
+    main()
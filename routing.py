@@ -0,0 +1,208 @@
+import threading
+
+# Methods the router answers itself when a route does not register them
+AUTOMATIC_METHODS = ('HEAD', 'OPTIONS')
+
+
+class RouteError(ValueError):
+    """A route pattern is malformed or clashes with an existing route."""
+
+
+class Request:
+    """A parsed request as handlers see it.
+
+    path is the request target as received, query string included; params
+    holds the values captured by the route pattern.
+    """
+
+    __slots__ = ('method', 'path', 'headers', 'body', 'params')
+
+    def __init__(self, method, path, headers, body=b'', params=None):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+        self.params = params if params is not None else {}
+
+
+class _Node:
+    """One path segment of the routing trie."""
+
+    __slots__ = ('children', 'param', 'param_name', 'rest_name', 'rest_handlers', 'handlers')
+
+    def __init__(self):
+        self.children = {}        # literal segment -> _Node
+        self.param = None         # _Node for a {name} segment
+        self.param_name = None
+        self.rest_name = None     # name of a {name:path} tail
+        self.rest_handlers = {}   # method -> handler for that tail
+        self.handlers = {}        # method -> handler for a path ending here
+
+
+def _segments(path):
+    """Split the path part of a request target into its segments."""
+    path = path.split('?', 1)[0].split('#', 1)[0]
+    if not path.startswith('/'):
+        return None
+    return path[1:].split('/') if path != '/' else []
+
+
+def _parse_segment(segment):
+    """Return (kind, value) for one pattern segment: literal, param or rest."""
+    if not (segment.startswith('{') and segment.endswith('}')):
+        if '{' in segment or '}' in segment:
+            raise RouteError(f"Parameters must span a whole segment: {segment}")
+        return 'literal', segment
+    name, _, kind = segment[1:-1].partition(':')
+    if not name.isidentifier():
+        raise RouteError(f"Invalid parameter name: {segment}")
+    if kind not in ('', 'path'):
+        raise RouteError(f"Unknown parameter type: {segment}")
+    return ('rest' if kind else 'param'), name
+
+
+class Router:
+    """Method and path-pattern routes compiled into a prefix trie.
+
+    Patterns are made of literal segments, {name} (one segment) and a final
+    {name:path} (the rest of the path, possibly empty). Literal segments win
+    over parameters and parameters over a path tail, so a lookup walks the
+    trie once per segment and only backtracks past dead ends.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.root = _Node()
+        self.table = []  # (method, pattern, handler) in registration order
+
+    def add(self, method, pattern, handler):
+        """Register handler(conn, request) for method on pattern."""
+        segments = _segments(pattern)
+        if segments is None:
+            raise RouteError(f"Patterns must start with '/': {pattern}")
+        method = method.upper()
+        with self.lock:
+            node = self.root
+            for index, segment in enumerate(segments):
+                kind, value = _parse_segment(segment)
+                if kind == 'literal':
+                    node = node.children.setdefault(value, _Node())
+                elif kind == 'param':
+                    if node.param is None:
+                        node.param, node.param_name = _Node(), value
+                    elif node.param_name != value:
+                        raise RouteError(f"{pattern}: parameter {{{value}}} clashes with "
+                                         f"{{{node.param_name}}}")
+                    node = node.param
+                else:
+                    if index != len(segments) - 1:
+                        raise RouteError(f"{{{value}:path}} must be the last segment: {pattern}")
+                    if node.rest_name not in (None, value):
+                        raise RouteError(f"{pattern}: path tail {{{value}:path}} clashes with "
+                                         f"{{{node.rest_name}:path}}")
+                    node.rest_name = value
+                    self._register(node.rest_handlers, method, pattern, handler)
+                    return
+            self._register(node.handlers, method, pattern, handler)
+
+    def _register(self, handlers, method, pattern, handler):
+        if method in handlers:
+            raise RouteError(f"{method} {pattern} is already routed")
+        handlers[method] = handler
+        self.table.append((method, pattern, handler))
+
+    def route(self, pattern, methods=('GET',)):
+        """Decorator form of add()."""
+        def decorator(handler):
+            for method in methods:
+                self.add(method, pattern, handler)
+            return handler
+        return decorator
+
+    def mount(self, prefix, handler, methods=('GET',)):
+        """Route everything under prefix to one handler; the tail is params['path']."""
+        for method in methods:
+            self.add(method, prefix.rstrip('/') + '/{path:path}', handler)
+
+    def resolve(self, method, path):
+        """Find the route for a request.
+
+        Returns (handler, params, allowed): handler is None when the path has
+        routes but none for method (allowed then lists the methods that
+        would work), and allowed is None when no route matches the path.
+        """
+        segments = _segments(path)
+        if segments is None:
+            return None, {}, None
+        found = self._lookup(self.root, segments, 0, {})
+        if found is None:
+            return None, {}, None
+        handlers, params = found
+        handler = handlers.get(method)
+        if handler is None and method == 'HEAD':
+            handler = handlers.get('GET')
+        return handler, params, self._allowed(handlers)
+
+    def _lookup(self, node, segments, index, params):
+        if index == len(segments):
+            if node.handlers:
+                return node.handlers, params
+            if node.rest_handlers:
+                return node.rest_handlers, {**params, node.rest_name: ''}
+            return None
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            found = self._lookup(child, segments, index + 1, params)
+            if found is not None:
+                return found
+        if node.param is not None and segment:
+            found = self._lookup(node.param, segments, index + 1, {**params, node.param_name: segment})
+            if found is not None:
+                return found
+        if node.rest_handlers:
+            return node.rest_handlers, {**params, node.rest_name: '/'.join(segments[index:])}
+        return None
+
+    @staticmethod
+    def _allowed(handlers):
+        allowed = set(handlers)
+        if 'GET' in allowed:
+            allowed.add('HEAD')
+        allowed.add('OPTIONS')
+        return sorted(allowed)
+
+    def methods(self):
+        """Every method some route accepts, for OPTIONS *."""
+        with self.lock:
+            return self._allowed({method: None for method, _, _ in self.table})
+
+    def routes(self):
+        with self.lock:
+            return list(self.table)
+
+
+class HeadSocket:
+    """Wraps a connection so a GET handler can answer HEAD.
+
+    The response head goes out unchanged, Content-Length included, and every
+    body byte after it is dropped.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.head_sent = False
+        self.pending = b''
+
+    def sendall(self, data):
+        if self.head_sent:
+            return
+        self.pending += data
+        head_end = self.pending.find(b'\r\n\r\n')
+        if head_end >= 0:
+            self.head_sent = True
+            self.conn.sendall(self.pending[:head_end + 4])
+            self.pending = b''
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
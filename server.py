@@ -1,12 +1,15 @@
-import socket
 import threading
 import os
+from sockopts import create_listener, tune_connection
+from tls import handshake, tls_context, wrap
 
 # تنظیمات سرور
 HOST = '127.0.0.1'
 PORT = 8080
 MAX_POST_CONNECTIONS = 5
 LOG_FILE = 'server.log'
+TLS_CERT_FILE = None  # PEM certificate, e.g. './certs/cert.pem'; serves HTTPS with TLS_KEY_FILE
+TLS_KEY_FILE = None
 
 # تابع برای نوشتن در فایل log
 def log_request(request):
@@ -37,6 +40,9 @@ def handle_post(connection, data):
 
 # تابع برای پردازش درخواست‌های کلاینت
 def handle_client(connection):
+    if not handshake(connection):
+        connection.close()
+        return
     request = connection.recv(1024).decode()
     if request:
         request_line = request.splitlines()[0]
@@ -53,13 +59,14 @@ def handle_client(connection):
 
 # تابع اصلی برای راه‌اندازی سرور
 def run_server():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen(5)
-    print(f'Server running on http://{HOST}:{PORT}')
+    server_socket = create_listener(HOST, PORT)
+    context = tls_context(TLS_CERT_FILE, TLS_KEY_FILE)
+    print(f'Server running on {"https" if context else "http"}://{HOST}:{PORT}')
 
     while True:
         client_connection, client_address = server_socket.accept()
+        tune_connection(client_connection)
+        client_connection = wrap(context, client_connection)
         print(f'Connected by {client_address}')
         client_thread = threading.Thread(target=handle_client, args=(client_connection,))
         client_thread.start()
@@ -1,17 +1,24 @@
-import socket
 import os
 import multiprocessing
+from sockopts import create_listener, tune_connection
+from tls import handshake, tls_context, wrap
 
 # تنظیمات سرور
 HOST = '127.0.0.1'
 PORT = 8080
 NUM_WORKERS = 4
+TLS_CERT_FILE = None  # PEM certificate, e.g. './certs/cert.pem'; serves HTTPS with TLS_KEY_FILE
+TLS_KEY_FILE = None
 
 # تابع پردازش درخواست توسط پردازه‌های کارگر
 def worker(worker_id, pipe):
     while True:
         connection = pipe.recv()  # دریافت کانکشن از پردازه اصلی
+        # TLS state cannot cross processes, so the worker wraps the plain socket
+        connection = wrap(tls_context(TLS_CERT_FILE, TLS_KEY_FILE), connection)
         try:
+            if not handshake(connection):
+                continue
             request = connection.recv(1024).decode()
             if request:
                 request_line = request.splitlines()[0]
@@ -32,11 +39,10 @@ def worker(worker_id, pipe):
 
 # تابع اصلی سرور
 def run_server():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen(5)
-    print(f'Server running on http://{HOST}:{PORT}')
+    server_socket = create_listener(HOST, PORT)
+    # Created before forking so every worker shares the session ticket keys
+    context = tls_context(TLS_CERT_FILE, TLS_KEY_FILE)
+    print(f'Server running on {"https" if context else "http"}://{HOST}:{PORT}')
 
     # ایجاد پردازه‌های کارگر و کانال ارتباطی (Pipe)
     worker_processes = []
@@ -54,6 +60,7 @@ def run_server():
     try:
         while True:
             client_connection, client_address = server_socket.accept()
+            tune_connection(client_connection)
             print(f'Connected by {client_address}')
 
             # ارسال کانکشن به پردازه کارگر
@@ -1,11 +1,14 @@
 import os
-import socket
 import multiprocessing
 import queue
+from sockopts import create_listener, tune_connection
+from tls import handshake, tls_context, wrap
 
 # Configuration
 HOST = '127.0.0.1'  # Localhost
 PORT = 8080  # Port to listen on
+TLS_CERT_FILE = None  # PEM certificate, e.g. './certs/cert.pem'; serves HTTPS with TLS_KEY_FILE
+TLS_KEY_FILE = None
 STATIC_DIR = './static'  # Directory for static files
 LOG_FILE = './server.log'
 WORKER_COUNT = 4  # Number of worker processes
@@ -20,6 +23,8 @@ def log_request(request, response):
 
 def handle_client(conn, addr):
     try:
+        if not handshake(conn):
+            return
         request = conn.recv(1024).decode('utf-8')
         headers = request.split('\r\n')
         if len(headers) < 1:
@@ -65,13 +70,14 @@ def worker_task(task_queue):
         conn, addr = task_queue.get()
         if conn is None:
             break
-        handle_client(conn, addr)
+        # TLS state cannot cross processes, so the worker wraps the plain socket
+        handle_client(wrap(tls_context(TLS_CERT_FILE, TLS_KEY_FILE), conn), addr)
 
 def main():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen(5)
-    print(f"Server running on http://{HOST}:{PORT}")
+    server_socket = create_listener(HOST, PORT)
+    # Created before forking so every worker shares the session ticket keys
+    context = tls_context(TLS_CERT_FILE, TLS_KEY_FILE)
+    print(f"Server running on {'https' if context else 'http'}://{HOST}:{PORT}")
 
     # Create a task queue for Round Robin scheduling
     task_queue = multiprocessing.Queue()
@@ -86,6 +92,7 @@ def main():
     try:
         while True:
             conn, addr = server_socket.accept()
+            tune_connection(conn)
             task_queue.put((conn, addr))
     finally:
         for _ in range(WORKER_COUNT):
@@ -4,10 +4,14 @@ import threading
 from queue import Queue
 from threading import Semaphore
 from datetime import datetime
+from sockopts import create_listener, tune_connection
+from tls import handshake, tls_context, wrap
 
 # Configuration
 HOST = '127.0.0.1'
 PORT = 8080
+TLS_CERT_FILE = None  # PEM certificate, e.g. './certs/cert.pem'; serves HTTPS with TLS_KEY_FILE
+TLS_KEY_FILE = None
 STATIC_DIR = './static'
 LOG_FILE = './server.log'
 WORKER_COUNT = 4
@@ -62,6 +66,8 @@ def handle_client(conn, addr):
     """Handle incoming client connections."""
     conn.settimeout(REQUEST_TIMEOUT)
     try:
+        if not handshake(conn):
+            return
         while True:
             request = conn.recv(1024).decode('utf-8')
             if not request:
@@ -126,14 +132,15 @@ def serve_post(conn, path, headers, request):
 
 def main():
     """Main function to start the server."""
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen(5)
-    print(f"Server running on http://{HOST}:{PORT}")
+    server_socket = create_listener(HOST, PORT)
+    context = tls_context(TLS_CERT_FILE, TLS_KEY_FILE)
+    print(f"Server running on {'https' if context else 'http'}://{HOST}:{PORT}")
 
     try:
         while True:
             conn, addr = server_socket.accept()
+            tune_connection(conn)
+            conn = wrap(context, conn)
             threading.Thread(target=handle_client, args=(conn, addr)).start()
     except KeyboardInterrupt:
         print("Shutting down the server...")
@@ -1,9 +1,32 @@
 import os
+import signal
 import socket
 import threading
-from queue import Queue
+import time
+from queue import Full, Queue
 from threading import Semaphore
-from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+from batch import FORMATS as BATCH_FORMATS, MAX_BYTES as BATCH_MAX_BYTES, MAX_PARTS as BATCH_MAX_PARTS
+from batch import BatchEncoder, BatchPart
+from bundle import BundleError, BundleStore, accepts_gzip
+from capture import CAPTURE_DIR, capture
+from cluster import FORWARD_CHUNK_SIZE, Cluster, PeerError
+from connection import Connection, MalformedRequest, RequestHeadTooLarge, buffer_pool
+from filecache import file_cache, missing_paths
+from hotreload import Reloader, inherited_listener, notify_ready, startup
+from multipart import MultipartError, MultipartParser, MultipartTooLarge, UploadWriter, get_boundary
+from http2 import PREFACE, H2Connection, StreamSocket, is_h2c_upgrade
+from memory import (budget, close_account, format_stats, hold, note_streamed, open_account,
+                    release, snapshot_diff, stop_tracing, try_reserve)
+from proxy import RELAY_CHUNK_SIZE, ReverseProxy
+from routing import HeadSocket, Request, Router
+from profiling import (DEFAULT_PROFILE_SECONDS, PROFILE_MODES, profile_request,
+                       profiling_status, start_profile, stop_profile)
+from sockopts import create_listener, tune_connection
+from tls import handshake, stats as tls_stats, tls_context, wrap
+from tracing import (add_span, begin_trace, end_trace, format_report, note_status, reset_traces,
+                     span)
 
 # Configuration
 HOST = '127.0.0.1'
@@ -12,132 +35,908 @@ STATIC_DIR = './static'
 LOG_FILE = './server.log'
 WORKER_COUNT = 4  # Number of worker threads for round-robin scheduling
 MAX_POST_REQUESTS = 5
+MAX_H2_STREAMS = 64  # HTTP/2 stream handlers running at once across all connections; more are refused
 REQUEST_TIMEOUT = 10  # Timeout in seconds for idle connections
+MAX_PART_SIZE = 10 * 1024 * 1024  # Largest single file in a multipart upload
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # Largest multipart upload body
+MAX_FIELD_SIZE = 64 * 1024  # Largest non-file form field of an upload kept in memory
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Bytes of an upload read from the socket / written to disk at a time
+MAX_DISCARD_SIZE = 64 * 1024  # Unread body bytes dropped after a rejection to keep the connection; more closes it
+SOCKET_OPTIONS = {}  # Overrides for sockopts.DEFAULT_SOCKET_OPTIONS, e.g. {'backlog': 4096}
+ADMIN_ENABLED = True  # Serve the /_admin/ diagnostics paths
+ADMIN_PREFIX = '/_admin/'
+MEMORY_BUDGET = 256 * 1024 * 1024  # Bytes buffered across all connections
+CONNECTION_MEMORY_BUDGET = 16 * 1024 * 1024  # Bytes buffered by one connection
+FILE_CHUNK_SIZE = 64 * 1024  # Read size when a file is streamed instead of buffered
+MAX_QUEUED_CONNECTIONS = 1024  # Accepted connections waiting for a worker
+CAPTURE_FILE = None  # Record traffic for replay.py from startup, e.g. './captures/startup.jsonl'
+CLUSTER_NODES = []  # 'host:port' of every cluster node; paths are sharded across them when set
+CLUSTER_GET_MODE = 'proxy'  # 'proxy' forwards GETs to the owning node, 'local' serves them here
+TLS_CERT_FILE = None  # PEM certificate, e.g. './certs/cert.pem'; serves HTTPS with TLS_KEY_FILE
+TLS_KEY_FILE = None
+TLS_ALPN = ('h2', 'http/1.1')  # Protocols offered in the TLS handshake, preferred first
+RELOAD_SIGNAL = 'SIGHUP'  # Starts a new generation on the same socket; None disables reloads
+CACHE_SNAPSHOT_FILE = './cache/hot-files.json'  # Hot file set handed to the next generation; None disables
+DRAIN_TIMEOUT = 30  # Seconds a stopping generation waits for in-flight requests
+DRAIN_IDLE_GRACE = 1.0  # Seconds keep-alive clients get to receive 'Connection: close' before idle ones are cut
+ACCEPT_POLL_INTERVAL = 1.0  # How often the accept loop checks whether a reload took over
+PROXY_ROUTES = {}  # Path prefix -> 'host:port' upstreams it is proxied to, e.g. {'/api/': ['127.0.0.1:9001']}
+PROXY_BALANCE = 'round_robin'  # 'round_robin' or 'least_connections'
+PROXY_MAX_CONNECTIONS = 32  # Connections in use to one upstream at a time
+PROXY_HEALTH_PATH = '/'  # Polled on every upstream; None disables health checks
+PROXY_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+STATIC_BUNDLE = None  # Bundle from 'python bundle.py build', e.g. './bundles/static.bundle'; served ahead of STATIC_DIR
+SENDFILE_MIN_SIZE = 16 * 1024  # Bundle entries at least this large go out with sendfile() on plain sockets
+BATCH_PATH = '/_batch'  # GET ?path=/a&path=/b[&format=frames] returns several files at once; None disables
+NOT_FOUND_LOG_WINDOW = 10  # Seconds in which repeated 404s of one path share a log line; 0 logs each
+
+# Busy response sent straight from the accept loop when the queue is full
+BUSY_RESPONSE = b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 11\r\nConnection: close\r\n\r\nServer busy"
 
 # Create static directory if it doesn't exist
 os.makedirs(STATIC_DIR, exist_ok=True)
 
+budget.set_limit(MEMORY_BUDGET)
+
 # Semaphore for limiting POST requests
 post_semaphore = Semaphore(MAX_POST_REQUESTS)
 
+# HTTP/2 streams run in threads of their own, outside the worker pool; this bounds them
+h2_stream_slots = Semaphore(MAX_H2_STREAMS)
+
+# Connections waiting for a worker; bounded so a burst cannot grow it without limit
+task_queue = None
+
+# This node's share of the cluster, set up by main() when CLUSTER_NODES is set
+cluster = None
+
+# TLS context shared by all connections, set up by main() when TLS_CERT_FILE is set
+server_context = None
+
+# Hands the listening socket to the next generation, set up by main()
+reloader = None
+
+# Upstream groups behind PROXY_ROUTES, set up by main()
+reverse_proxy = None
+
+# The mapped STATIC_BUNDLE, set up by main()
+static_bundle = None
+
+# Connections blocked waiting for their next request, so a drain can close them.
+# While draining, responses close their connection; once idle_closed is set, so
+# does going back to waiting.
+idle_lock = threading.Lock()
+idle_connections = set()
+draining = False
+idle_closed = False
+# Open HTTP/2 connections, sent GOAWAY when the drain starts
+h2_connections = set()
+
 # Thread-safe log file writing
 log_lock = threading.Lock()
 
+# (second, formatted log timestamp); like the Date header, formatted once a second
+_log_timestamp = (None, '')
+
+def log_timestamp():
+    """Return the current log line timestamp; strftime() allocates a 4 KB buffer per call."""
+    global _log_timestamp
+    now = int(time.time())
+    second, value = _log_timestamp
+    if second != now:
+        value = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now))
+        _log_timestamp = (now, value)
+    return value
+
 def log_request(request, response):
     """Log the request and response to a file."""
-    timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    line = f"[{log_timestamp()}] Request:\n{request}\nResponse:\n{response}\n\n".encode('utf-8')
+    waiting = time.perf_counter()
     with log_lock:
-        with open(LOG_FILE, 'a') as log_file:
-            log_file.write(f"[{timestamp}] Request:\n{request}\nResponse:\n{response}\n\n")
-
-def parse_headers(header_lines):
-    """Parse HTTP headers into a dictionary."""
-    headers = {}
-    for line in header_lines:
-        if ': ' in line:
-            key, value = line.split(': ', 1)
-            headers[key.lower()] = value
-    return headers
-
-def send_response(conn, status, body, headers=None):
-    """Send an HTTP response to the client and log it."""
-    if headers is None:
-        headers = {}
-    headers['Content-Length'] = len(body)
-    headers['Date'] = datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
-    headers['Connection'] = 'keep-alive'
+        locked = time.perf_counter()
+        # Unbuffered: the line is one write either way, and no buffer is allocated per request
+        with open(LOG_FILE, 'ab', buffering=0) as log_file:
+            log_file.write(line)
+    add_span('log_lock', waiting, locked)
+    add_span('log', locked)
 
-    header_lines = '\r\n'.join(f"{key}: {value}" for key, value in headers.items())
-    response = f"HTTP/1.1 {status}\r\n{header_lines}\r\n\r\n{body}"
-    conn.sendall(response.encode('utf-8'))
+# (second, formatted Date header); the header only changes once a second
+_date_header = (None, '')
+
+def http_date():
+    """Return the current Date header value, formatted at most once a second."""
+    global _date_header
+    now = int(time.time())
+    second, value = _date_header
+    if second != now:
+        value = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(now))
+        _date_header = (now, value)
+    return value
+
+def format_head(status, content_length, headers=None, close=False):
+    """Build the status line and headers of a response."""
+    note_status(int(status[:3]))
+    if startup.first_byte is None:
+        note_first_byte()
+    extra = ''.join(f"{key}: {value}\r\n" for key, value in headers.items()) if headers else ''
+    return (f"HTTP/1.1 {status}\r\n{extra}Content-Length: {content_length}\r\n"
+            f"Date: {http_date()}\r\nConnection: {'close' if draining or close else 'keep-alive'}\r\n\r\n")
+
+def note_first_byte():
+    """Report how long this generation took from start-up to its first response."""
+    if startup.note_first_byte() and reloader is not None:
+        print(f"Generation {startup.generation} sent its first response "
+              f"{startup.first_byte * 1000:.1f} ms after {'the reload' if startup.reloaded else 'launch'}")
+
+def send_response(conn, status, body, headers=None, close=False):
+    """Send an HTTP response to the client and log it."""
+    response = f"{format_head(status, len(body), headers, close)}{body}".encode('utf-8')
+    with hold(len(response), 'response'), span('send'):
+        conn.sendall(response)
 
     # Log the response after sending it
     log_request(f"Response Status: {status}", body)
 
-def handle_client(conn, addr):
+# (second, encoded 404 response); rebuilt only when the Date header changes
+_not_found = (None, b'')
+
+def send_not_found(conn):
+    """Send the static 404 response, encoded at most once a second."""
+    global _not_found
+    now = int(time.time())
+    second, response = _not_found
+    if second != now or draining:
+        response = f"{format_head('404 Not Found', 14)}File Not Found".encode('latin-1')
+        if not draining:
+            _not_found = (now, response)
+    else:
+        note_status(404)
+    with span('send'):
+        conn.sendall(response)
+
+def log_not_found(method, path):
+    """Log a 404; repeats of a known-missing path are folded into one line per window."""
+    if missing_paths.note_miss(path):
+        log_request(f"{method} {path}", "404 Not Found")
+
+def log_folded_not_found(path, count, seconds):
+    """Log the 404s of path folded into its window, with the time they actually spanned."""
+    log_request(f"GET {path}", f"404 Not Found (x{count} more in {seconds:.1f}s)")
+
+def discard_body(conn, unread):
+    """Read and drop the rest of a short request body; return False if it is too long or cut off."""
+    if unread > MAX_DISCARD_SIZE:
+        return False
+    while unread > 0:
+        with span('recv'):
+            chunk = conn.recv(min(unread, FILE_CHUNK_SIZE))
+        if not chunk:
+            return False
+        unread -= len(chunk)
+    return True
+
+def reject_request(conn, request, status, message, unread):
+    """Refuse a request whose body was not read to the end, and log it.
+
+    Whatever is left of the body would be parsed as the next request, so a
+    short rest is read and dropped; a longer one ends the connection after
+    the response. HTTP/2 streams keep their bodies apart and stay open.
+    """
+    log_request(request, status)
+    if unread <= 0 or isinstance(conn, StreamSocket) or discard_body(conn, unread):
+        send_response(conn, status, message)
+        return
+    send_response(conn, status, message, close=True)
+    # Only the write side, so the client gets the response and a FIN rather than a reset
+    conn.shutdown(socket.SHUT_WR)
+    raise ConnectionAbortedError("Request body left unread")
+
+def send_content(conn, status, content, headers=None):
+    """Send a response whose body is already bytes, such as a cached file."""
+    response = format_head(status, len(content), headers).encode('latin-1') + content
+    with hold(len(response), 'response'), span('send'):
+        conn.sendall(response)
+    log_request(f"Response Status: {status}", f"<{len(content)} bytes>")
+
+def send_file(conn, file_path, size):
+    """Stream a file in FILE_CHUNK_SIZE pieces so only one chunk is buffered."""
+    with hold(FILE_CHUNK_SIZE, 'response'):
+        with span('send'):
+            conn.sendall(format_head("200 OK", size).encode('utf-8'))
+        with open(file_path, 'rb') as file:
+            while True:
+                with span('file'):
+                    chunk = file.read(FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                with span('send'):
+                    conn.sendall(chunk)
+    note_streamed()
+    log_request("Response Status: 200 OK", f"<streamed {size} bytes>")
+
+# Handlers are registered as routes at the end of the module
+router = Router()
+
+def dispatch_request(conn, method, path, headers, body):
+    """Route a parsed request to its handler; shared by HTTP/1.1 and HTTP/2."""
+    if method == 'OPTIONS' and path == '*':
+        send_response(conn, "200 OK", "", {'Allow': ', '.join(router.methods())})
+        log_request(f"{method} {path}", "200 OK")
+        return
+    handler, params, allowed = router.resolve(method, path)
+    if handler is not None:
+        # HEAD falls back to the GET handler with the body dropped
+        handler(HeadSocket(conn) if method == 'HEAD' else conn,
+                Request(method, path, headers, body, params))
+    elif allowed is None:
+        send_response(conn, "404 Not Found", "File Not Found")
+        log_request(f"{method} {path}", "404 Not Found")
+    elif method == 'OPTIONS':
+        send_response(conn, "200 OK", "", {'Allow': ', '.join(allowed)})
+        log_request(f"{method} {path}", "200 OK")
+    else:
+        send_response(conn, "405 Method Not Allowed", "Method Not Allowed", {'Allow': ', '.join(allowed)})
+        log_request(f"{method} {path}", "405 Method Not Allowed")
+
+def record_request(connection, trace, method, path, headers):
+    """Add a finished request to the traffic capture, if one is running."""
+    if capture.active and trace is not None and not path.startswith(ADMIN_PREFIX):
+        body_size = int(headers.get('content-length', 0) or 0)
+        capture.record(connection, trace.started, method, path, headers, body_size,
+                       trace.status, trace.duration)
+
+def dispatch_stream(conn, method, path, headers, body):
+    """Dispatch one HTTP/2 stream inside its own trace."""
+    begin_trace(f"{method} {path} (h2)")
+    # Streams run on their own threads, so each is accounted separately
+    open_account(CONNECTION_MEMORY_BUDGET)
+    try:
+        with span('handler'), profile_request():
+            dispatch_request(conn, method, path, headers, body)
+    finally:
+        close_account()
+        record_request(conn.connection, end_trace(), method, path, headers)
+
+def handle_client(conn, addr, accepted_at=None, enqueued_at=None):
     """Handle incoming client connections."""
     conn.settimeout(REQUEST_TIMEOUT)
+    dequeued_at = time.perf_counter()
+    if not handshake(conn):
+        conn.close()
+        return
+    handshaken_at = time.perf_counter()
+    # Reads go into a pooled buffer, so a request costs no receive allocations
+    connection = Connection(conn, buffer_pool)
+    open_account(CONNECTION_MEMORY_BUDGET)
     try:
         while True:
-            request = conn.recv(1024).decode('utf-8')
-            if not request:
+            with idle_lock:
+                # Past the drain grace period a connection closes instead of waiting
+                if idle_closed:
+                    break
+                idle_connections.add(conn)
+            try:
+                waiting = connection.wait()
+            finally:
+                with idle_lock:
+                    idle_connections.discard(conn)
+            if not waiting:
                 break
 
-            # Parse request
-            lines = request.split('\r\n')
-            request_line = lines[0].split()
-            if len(request_line) < 2:
+            # The trace starts once a request arrives, so idle keep-alive time is not counted
+            trace = begin_trace()
+            if accepted_at is not None:
+                # Accept and queueing costs belong to the first request on the connection
+                trace.started = accepted_at
+                add_span('accept', accepted_at, enqueued_at)
+                add_span('queue', enqueued_at, dequeued_at)
+                if server_context is not None:
+                    add_span('handshake', dequeued_at, handshaken_at)
+                accepted_at = None
+
+            # HTTP/2 with prior knowledge starts with the connection preface
+            if connection.startswith(PREFACE):
+                end_trace()
+                serve_http2(conn, connection.detach())
                 break
 
-            method, path = request_line[0], request_line[1]
-            headers = parse_headers(lines[1:])
+            try:
+                with span('parse'):
+                    request = connection.read_request()
+                    if request is None:
+                        break
+                    method, path, headers = request
+                    # Only the buffered start of the body is taken; handlers read the rest
+                    body = connection.take(int(headers.get('content-length') or 0))
+            except RequestHeadTooLarge:
+                conn.sendall(b"HTTP/1.1 431 Request Header Fields Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                break
+            except (MalformedRequest, ValueError):
+                # A garbled request line or Content-Length closes the connection
+                break
+            trace.label = f"{method} {path}"
+
+            # Upgrade to h2c; requests with a body stay on HTTP/1.1
+            if is_h2c_upgrade(headers) and not body and int(headers.get('content-length', 0)) == 0:
+                conn.sendall(b"HTTP/1.1 101 Switching Protocols\r\nConnection: Upgrade\r\nUpgrade: h2c\r\n\r\n")
+                log_request(f"{method} {path}", "101 Switching Protocols")
+                end_trace()
+                serve_http2(conn, upgrade_request=(method, path, headers))
+                break
 
             # Handle requests
-            if method == 'GET':
-                serve_get(conn, path, headers)
-            elif method == 'POST':
-                serve_post(conn, path, headers, request)
-            else:
-                send_response(conn, "405 Method Not Allowed", "Method Not Allowed")
-                log_request(f"{method} {path}", "405 Method Not Allowed")
+            with span('handler'), profile_request():
+                dispatch_request(conn, method, path, headers, body)
+            record_request(conn, end_trace(), method, path, headers)
     except socket.timeout:
         print(f"Connection with {addr} timed out.")
+    except ConnectionError:
+        # The client or a cluster peer went away mid-response
+        pass
     finally:
+        end_trace()
+        close_account()
+        capture.forget(conn)
+        connection.release()
         conn.close()
 
+def serve_http2(conn, initial_data=b'', upgrade_request=None):
+    """Serve an HTTP/2 connection, registered so a drain can send it GOAWAY."""
+    h2 = H2Connection(conn, dispatch_stream, initial_data, h2_stream_slots)
+    with idle_lock:
+        h2_connections.add(h2)
+        going_away = draining
+    if going_away:
+        h2.go_away()
+    try:
+        h2.serve(upgrade_request)
+    finally:
+        with idle_lock:
+            h2_connections.discard(h2)
+
+def drain_connections():
+    """Stop keep-alive: responses from now on say 'Connection: close' and end their connection.
+
+    HTTP/2 connections get GOAWAY instead: their open streams finish, and the
+    connection closes after the last one.
+    """
+    global draining
+    with idle_lock:
+        draining = True
+        connections = list(h2_connections)
+    for h2 in connections:
+        h2.go_away()
+
+def close_idle_connections():
+    """Close the connections still waiting for a request once the drain grace is over.
+
+    A client that sends just as its connection closes sees a reset, which is
+    why active clients get DRAIN_IDLE_GRACE to learn of the close first.
+    """
+    global idle_closed
+    with idle_lock:
+        idle_closed = True
+        for conn in idle_connections:
+            # Only the read side: the blocked recv() sees EOF and the worker moves on
+            try:
+                conn.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+
+def save_cache_snapshot():
+    if CACHE_SNAPSHOT_FILE:
+        count = file_cache.save(CACHE_SNAPSHOT_FILE)
+        print(f"Saved {count} hot files to {CACHE_SNAPSHOT_FILE}")
+
+def serve_static(conn, request):
+    """Serve files from STATIC_DIR and append POST bodies to them."""
+    if cluster is not None and (request.method == 'POST' or CLUSTER_GET_MODE == 'proxy'):
+        try:
+            client = conn.getpeername()[0]
+        except (AttributeError, OSError):
+            client = None  # HTTP/2 streams are not sockets; peers forward over HTTP/1.1
+        owner = cluster.owner(request.path, request.headers, client)
+        if owner is not None:
+            forward_request(conn, request, owner)
+            return
+    if request.method == 'POST':
+        serve_post(conn, request.path, request.headers, request.body)
+    else:
+        serve_get(conn, request.path, request.headers)
+
+def forward_request(conn, request, node):
+    """Stream a request to the cluster node that owns its path, and the answer back."""
+    try:
+        with hold(FORWARD_CHUNK_SIZE, 'request'), span('forward'):
+            status = cluster.forward(conn, node, request.method, request.path,
+                                     request.headers, request.body)
+    except PeerError as e:
+        send_response(conn, "502 Bad Gateway", f"Cluster node {node} is unavailable")
+        log_request(f"{request.method} {request.path}", f"502 Bad Gateway ({e})")
+        return
+    note_status(int(status[:3]))
+    log_request(f"{request.method} {request.path}", f"{status} (from {node})")
+
+def proxy_route(group):
+    """Return the route handler that relays requests to one upstream group."""
+    def serve_proxy(conn, request):
+        try:
+            client = conn.getpeername()[0]
+        except (AttributeError, OSError):
+            client = None  # HTTP/2 streams are not sockets
+        try:
+            with hold(RELAY_CHUNK_SIZE, 'request'), span('forward'):
+                status, upstream = group.forward(conn, request.method, request.path, request.headers,
+                                                 request.body, client)
+        except PeerError as e:
+            send_response(conn, "502 Bad Gateway", "Upstream unavailable")
+            log_request(f"{request.method} {request.path}", f"502 Bad Gateway ({e})")
+            return
+        note_status(int(status[:3]))
+        log_request(f"{request.method} {request.path}", f"{status} (from {upstream})")
+    return serve_proxy
+
+def send_bundled(conn, bundle, entry, headers):
+    """Send a bundle entry straight from the map, gzipped if the client takes it."""
+    offset, size, gzip_offset, gzip_size = entry
+    extra = {'Vary': 'Accept-Encoding'} if gzip_offset is not None else None
+    if gzip_offset is not None and accepts_gzip(headers.get('accept-encoding', '')):
+        offset, size = gzip_offset, gzip_size
+        extra['Content-Encoding'] = 'gzip'
+    head = format_head("200 OK", size, extra).encode('latin-1')
+    with span('send'):
+        if size >= SENDFILE_MIN_SIZE and type(conn) is socket.socket:
+            # Plain sockets only: TLS, HTTP/2 streams and HEAD need the bytes in hand
+            conn.sendall(head)
+            conn.sendfile(bundle.file, offset, size)
+        else:
+            conn.sendall(head + bundle.view[offset:offset + size])
+
+def batch_part(path):
+    """Find where one batch path's bytes come from, the same way serve_get would."""
+    if static_bundle is not None:
+        bundle = static_bundle.current
+        entry = bundle.lookup(path)
+        if entry is not None:
+            offset, size = entry[:2]
+            return BatchPart(path, 200, size, bundle.view[offset:offset + size], bundle.file, offset)
+    if path in missing_paths:
+        return BatchPart(path, 404)
+    file_path = os.path.join(STATIC_DIR, path.lstrip('/'))
+    # parse_qs has decoded the path, so %2F.. arrives as /..: nothing outside STATIC_DIR is served
+    root = os.path.realpath(STATIC_DIR)
+    if os.path.commonpath([root, os.path.realpath(file_path)]) != root:
+        return BatchPart(path, 404)
+    cached = file_cache.get(file_path)
+    if cached is not None:
+        return BatchPart(path, 200, cached.size, cached.content)
+    try:
+        file = open(file_path, 'rb')
+    except OSError:
+        missing_paths.add(path)
+        return BatchPart(path, 404)
+    # Sized from the open file, so the declared length is what gets sent
+    return BatchPart(path, 200, os.fstat(file.fileno()).st_size, file=file, owned=True)
+
+def send_part(conn, part):
+    """Send one batch part's body from memory, with sendfile() or in chunks."""
+    plain = type(conn) is socket.socket
+    if part.content is not None and not (plain and part.file is not None and part.size >= SENDFILE_MIN_SIZE):
+        conn.sendall(part.content)
+    elif plain:
+        if conn.sendfile(part.file, part.offset, part.size) < part.size:
+            raise ConnectionError(f"{part.path} shrank while it was sent")
+    else:
+        sent = 0
+        while sent < part.size:
+            with span('file'):
+                chunk = os.pread(part.file.fileno(), min(FILE_CHUNK_SIZE, part.size - sent), part.offset + sent)
+            if not chunk:
+                raise ConnectionError(f"{part.path} shrank while it was sent")
+            conn.sendall(chunk)
+            sent += len(chunk)
+
+def serve_batch(conn, request):
+    """Send several static files in one response, with a status per file.
+
+    The body is multipart/mixed or length-prefixed frames (see batch.py).
+    Every part is located and sized before the head goes out, so the
+    response has a Content-Length and the parts stream straight after it.
+    """
+    query = parse_qs(urlsplit(request.path).query)
+    paths = query.get('path', [])
+    format = query.get('format', ['multipart'])[-1]
+    if format not in BATCH_FORMATS or not paths:
+        send_response(conn, "400 Bad Request", f"Expected path=... and a format of {', '.join(BATCH_FORMATS)}")
+        log_request(f"GET {BATCH_PATH}", "400 Bad Request")
+        return
+    if len(paths) > BATCH_MAX_PARTS:
+        send_response(conn, "413 Payload Too Large", f"At most {BATCH_MAX_PARTS} paths per batch")
+        log_request(f"GET {BATCH_PATH}", "413 Payload Too Large")
+        return
+
+    parts = []
+    try:
+        total = 0
+        with span('file'):
+            for path in paths:
+                part = batch_part(path)
+                if total + part.size > BATCH_MAX_BYTES:
+                    # Over the cap: report the part instead of sending it
+                    part.close()
+                    part = BatchPart(path, 413)
+                total += part.size
+                parts.append(part)
+        encoder = BatchEncoder(format)
+        heads = [encoder.part_head(index, part) for index, part in enumerate(parts)]
+        tail = encoder.part_tail()
+        closing = encoder.closing()
+        length = sum(len(head) + part.size + len(tail) for head, part in zip(heads, parts)) + len(closing)
+
+        with hold(FILE_CHUNK_SIZE, 'response'), span('send'):
+            pending = bytearray(format_head("200 OK", length, {'Content-Type': encoder.content_type})
+                                .encode('latin-1'))
+            for head, part in zip(heads, parts):
+                pending += head
+                if part.content is not None and part.size < FILE_CHUNK_SIZE:
+                    # Small bodies share packets with the part heads around them
+                    pending += part.content
+                elif part.size:
+                    conn.sendall(pending)
+                    pending.clear()
+                    send_part(conn, part)
+                pending += tail
+                if len(pending) >= FILE_CHUNK_SIZE:
+                    conn.sendall(pending)
+                    pending.clear()
+            pending += closing
+            conn.sendall(pending)
+    finally:
+        for part in parts:
+            part.close()
+    # One log line for the whole batch
+    statuses = [part.status for part in parts]
+    log_request(f"GET {BATCH_PATH} ({len(parts)} paths: {', '.join(paths)})",
+                f"200 OK ({statuses.count(200)} found, {statuses.count(404)} missing, "
+                f"{statuses.count(413)} over the size cap)")
+
 def serve_get(conn, path, headers):
     """Handle GET requests."""
+    if static_bundle is not None:
+        # One version for the whole response, even if a swap happens meanwhile
+        bundle = static_bundle.current
+        entry = bundle.lookup(path)
+        if entry is not None:
+            send_bundled(conn, bundle, entry, headers)
+            log_request(f"GET {path}", "200 OK")
+            return
+    # A path that was missing before is answered without touching the filesystem
+    if path in missing_paths:
+        send_not_found(conn)
+        log_not_found("GET", path)
+        return
     file_path = os.path.join(STATIC_DIR, path.lstrip('/'))
-    if os.path.isfile(file_path):
-        with open(file_path, 'r') as file:
-            content = file.read()
-        send_response(conn, "200 OK", content)
+    with span('file'):
+        cached = file_cache.get(file_path)
+    if cached is not None:
+        send_content(conn, "200 OK", cached.content)
+        log_request(f"GET {path}", "200 OK")
+    elif os.path.isfile(file_path):
+        # Too large for the cache
+        size = os.path.getsize(file_path)
+        if try_reserve(size, 'response'):
+            try:
+                with span('file'), open(file_path, 'r') as file:
+                    content = file.read()
+                send_response(conn, "200 OK", content)
+            finally:
+                release(size, 'response')
+        else:
+            # Over the memory budget: stream the file instead of loading it whole
+            send_file(conn, file_path, size)
         log_request(f"GET {path}", "200 OK")
     else:
-        send_response(conn, "404 Not Found", "File Not Found")
-        log_request(f"GET {path}", "404 Not Found")
+        missing_paths.add(path)
+        send_not_found(conn)
+        log_not_found("GET", path)
 
-def serve_post(conn, path, headers, request):
+def serve_post(conn, path, headers, body):
     """Handle POST requests."""
+    content_length = int(headers.get('content-length', 0))
     if not post_semaphore.acquire(blocking=False):
-        send_response(conn, "503 Service Unavailable", "Too many POST requests")
-        log_request(f"POST {path}", "503 Service Unavailable")
+        reject_request(conn, f"POST {path}", "503 Service Unavailable", "Too many POST requests",
+                       content_length - len(body))
         return
 
     try:
+        boundary = get_boundary(headers.get('content-type', ''))
+        if boundary:
+            serve_upload(conn, path, headers, body, boundary)
+            return
+
         # Extract body using Content-Length
-        content_length = int(headers.get('content-length', 0))
-        body = request.split('\r\n\r\n', 1)[1]
-        if len(body) < content_length:
-            body += conn.recv(content_length - len(body)).decode('utf-8')
+        if not try_reserve(content_length, 'request'):
+            if content_length > CONNECTION_MEMORY_BUDGET:
+                reject_request(conn, f"POST {path}", "413 Payload Too Large", "Request body too large",
+                               content_length - len(body))
+            else:
+                reject_request(conn, f"POST {path}", "503 Service Unavailable", "Memory budget exhausted",
+                               content_length - len(body))
+            return
+        try:
+            while len(body) < content_length:
+                with span('recv'):
+                    chunk = conn.recv(content_length - len(body))
+                if not chunk:
+                    break
+                body += chunk
+            body = body.decode('utf-8', errors='replace')
 
-        file_path = os.path.join(STATIC_DIR, path.lstrip('/'))
-        with open(file_path, 'a') as file:
-            file.write(body + '\n')
+            file_path = os.path.join(STATIC_DIR, path.lstrip('/'))
+            with span('file'), open(file_path, 'a') as file:
+                file.write(body + '\n')
+            # The append may have created the file, and the bundle holds the old bytes
+            missing_paths.discard(path)
+            if static_bundle is not None:
+                static_bundle.override(path)
+        finally:
+            release(content_length, 'request')
 
         send_response(conn, "201 Created", "Resource Created")
         log_request(f"POST {path} Body: {body}", "201 Created")
     finally:
         post_semaphore.release()
 
+def serve_upload(conn, path, headers, body, boundary):
+    """Stream a multipart/form-data upload to disk in fixed-size chunks."""
+    content_length = int(headers.get('content-length', 0))
+    if content_length > MAX_UPLOAD_SIZE:
+        reject_request(conn, f"POST {path}", "413 Payload Too Large", "Upload too large",
+                       content_length - len(body))
+        return
+
+    # Files are stored in the target directory, or next to the target file
+    upload_dir = os.path.join(STATIC_DIR, path.lstrip('/'))
+    if not os.path.isdir(upload_dir):
+        upload_dir = os.path.dirname(upload_dir)
+
+    writer = UploadWriter(upload_dir, MAX_FIELD_SIZE)
+    parser = MultipartParser(boundary, writer.on_part_begin, writer.on_part_data,
+                             writer.on_part_end, MAX_PART_SIZE, MAX_UPLOAD_SIZE)
+    remaining = content_length - len(body)
+    try:
+        # The parser never buffers much more than one chunk
+        with hold(UPLOAD_CHUNK_SIZE, 'request'):
+            feed_upload(conn, parser, body[:content_length], remaining)
+        parser.close()
+    except MultipartTooLarge as e:
+        writer.abort()
+        reject_request(conn, f"POST {path}", "413 Payload Too Large", str(e), content_length - parser.total_size)
+        return
+    except MultipartError as e:
+        writer.abort()
+        reject_request(conn, f"POST {path}", "400 Bad Request", str(e), content_length - parser.total_size)
+        return
+    except OSError:
+        writer.abort()
+        reject_request(conn, f"POST {path}", "500 Internal Server Error", "Could not store upload",
+                       content_length - parser.total_size)
+        return
+
+    # Uploads can create files under any name, so forget every missing path
+    missing_paths.clear()
+    if static_bundle is not None:
+        for name in writer.saved_files:
+            static_bundle.override('/' + os.path.relpath(name, STATIC_DIR).replace(os.sep, '/'))
+    saved = ', '.join(os.path.basename(name) for name in writer.saved_files)
+    send_response(conn, "201 Created", "Resource Created")
+    log_request(f"POST {path} Files: {saved} Fields: {', '.join(writer.fields)}", "201 Created")
+
+def feed_upload(conn, parser, body, remaining):
+    """Feed the buffered start of an upload, then the rest straight from the socket."""
+    parser.feed(body)
+    while remaining > 0:
+        with span('recv'):
+            chunk = conn.recv(min(UPLOAD_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        parser.feed(chunk)
+
+def serve_admin(conn, request):
+    """Serve the diagnostics paths under ADMIN_PREFIX."""
+    url = urlsplit(request.path)
+    query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+    if url.path == ADMIN_PREFIX + 'traces':
+        # Slowest requests with their per-phase timings; ?reset=1 clears them
+        if query.get('reset'):
+            reset_traces()
+        send_response(conn, "200 OK", format_report(), {'Content-Type': 'text/plain'})
+    elif url.path == ADMIN_PREFIX + 'profile':
+        # ?mode=cprofile|sample&seconds=N opens a window, ?stop=1 ends it early
+        if 'mode' in query:
+            try:
+                seconds = float(query.get('seconds', DEFAULT_PROFILE_SECONDS))
+            except ValueError:
+                seconds = None
+            if query['mode'] not in PROFILE_MODES:
+                send_response(conn, "400 Bad Request", "Unknown profile mode")
+            elif seconds is None or not 0 < seconds < float('inf'):
+                send_response(conn, "400 Bad Request", "seconds must be a positive number")
+            elif start_profile(query['mode'], seconds):
+                send_response(conn, "202 Accepted", f"Profiling started ({query['mode']})")
+            else:
+                send_response(conn, "409 Conflict", "A profile is already running")
+        elif query.get('stop'):
+            send_response(conn, "200 OK", stop_profile(), {'Content-Type': 'text/plain'})
+        else:
+            status = profiling_status()
+            if status:
+                send_response(conn, "200 OK", f"Profiling ({status[0]}), {status[1]:.1f}s left")
+            else:
+                send_response(conn, "200 OK", stop_profile(), {'Content-Type': 'text/plain'})
+    elif url.path == ADMIN_PREFIX + 'memory':
+        # Live buffer counters; ?snapshot=lineno|filename|traceback diffs tracemalloc snapshots
+        if query.get('stop'):
+            stop_tracing()
+            body = "tracemalloc stopped"
+        elif 'snapshot' in query:
+            key_type = query['snapshot'] if query['snapshot'] in ('filename', 'traceback') else 'lineno'
+            body = snapshot_diff(key_type)
+        else:
+            body = format_stats({'queued_connections': task_queue.qsize() if task_queue else 0,
+                                 **buffer_pool.stats(), **file_cache.stats(), **missing_paths.stats()})
+        send_response(conn, "200 OK", body, {'Content-Type': 'text/plain'})
+    elif url.path == ADMIN_PREFIX + 'capture':
+        # ?start=name records into CAPTURE_DIR/name.jsonl, ?stop=1 closes the file
+        if 'start' in query:
+            name = os.path.basename(query['start']) or 'capture'
+            capture_path = os.path.join(CAPTURE_DIR, name if name.endswith('.jsonl') else name + '.jsonl')
+            if capture.start(capture_path):
+                send_response(conn, "202 Accepted", f"Capturing to {capture_path}")
+            else:
+                send_response(conn, "409 Conflict", "A capture is already running")
+        elif query.get('stop'):
+            capture_path, count = capture.stop()
+            send_response(conn, "200 OK", f"Captured {count} requests to {capture_path}")
+        elif capture.active:
+            send_response(conn, "200 OK", f"Capturing to {capture.path}, {capture.count} requests so far")
+        else:
+            send_response(conn, "200 OK", "No capture running")
+    elif url.path == ADMIN_PREFIX + 'cluster':
+        # Ring membership and peer counters; ?add=host:port / ?remove=host:port change this
+        # node's ring only, ?key=/path shows the owner of a path
+        if cluster is None:
+            send_response(conn, "404 Not Found", "Cluster mode is off")
+        else:
+            if 'add' in query:
+                cluster.ring.add(query['add'])
+            if 'remove' in query:
+                cluster.ring.remove(query['remove'])
+            stats = cluster.stats()
+            if 'key' in query:
+                stats['owner'] = cluster.ring.owner(urlsplit(query['key']).path)
+            body = ''.join(f"{key}: {value}\n" for key, value in stats.items())
+            send_response(conn, "200 OK", body, {'Content-Type': 'text/plain'})
+    elif url.path == ADMIN_PREFIX + 'tls':
+        # Handshake cost, resumption rate and the server-side session cache
+        if server_context is None:
+            send_response(conn, "404 Not Found", "TLS is off")
+        else:
+            body = ''.join(f"{key}: {value}\n" for key, value in tls_stats.stats(server_context).items())
+            send_response(conn, "200 OK", body, {'Content-Type': 'text/plain'})
+    elif url.path == ADMIN_PREFIX + 'reload':
+        # Start-up timeline and cache warmth of this generation; ?start=1 reloads like RELOAD_SIGNAL
+        if query.get('start') and reloader is not None:
+            if reloader.request():
+                send_response(conn, "202 Accepted", f"Starting generation {startup.generation + 1}")
+            else:
+                send_response(conn, "409 Conflict", "A reload is already running")
+        else:
+            stats = {**startup.stats(), **(reloader.stats() if reloader else {}), **file_cache.stats()}
+            body = ''.join(f"{key}: {value}\n" for key, value in stats.items())
+            send_response(conn, "200 OK", body, {'Content-Type': 'text/plain'})
+    elif url.path == ADMIN_PREFIX + 'proxy':
+        # Health, load and pooled connections of every upstream
+        if reverse_proxy is None:
+            send_response(conn, "404 Not Found", "Reverse proxy is off")
+        else:
+            body = ''.join(f"[{prefix}]\n" + ''.join(f"{key}: {value}\n" for key, value in stats.items())
+                           for prefix, stats in reverse_proxy.stats().items())
+            send_response(conn, "200 OK", body, {'Content-Type': 'text/plain'})
+    elif url.path == ADMIN_PREFIX + 'bundle':
+        # The bundle being served; ?reload=1 swaps in a new version without waiting for the watcher
+        if static_bundle is None:
+            send_response(conn, "404 Not Found", "No bundle is served")
+        else:
+            try:
+                if query.get('reload'):
+                    static_bundle.reload()
+                body = ''.join(f"{key}: {value}\n" for key, value in static_bundle.stats().items())
+                send_response(conn, "200 OK", body, {'Content-Type': 'text/plain'})
+            except BundleError as e:
+                send_response(conn, "500 Internal Server Error", str(e))
+    elif url.path == ADMIN_PREFIX + 'routes':
+        body = ''.join(f"{method:<8}{pattern}  -> {handler.__name__}\n"
+                       for method, pattern, handler in router.routes())
+        send_response(conn, "200 OK", body, {'Content-Type': 'text/plain'})
+    else:
+        send_response(conn, "404 Not Found", "File Not Found")
+    log_request(f"{request.method} {request.path}", "admin")
+
+# Routes. Dynamic handlers take (conn, request) and are added the same way,
+# e.g. router.add('GET', '/health', serve_health); literal paths win over
+# the static mount at the root.
+if ADMIN_ENABLED:
+    router.mount(ADMIN_PREFIX, serve_admin)
+if BATCH_PATH:
+    router.add('GET', BATCH_PATH, serve_batch)
+router.mount('/', serve_static, methods=('GET', 'POST'))
+
 def worker_task(task_queue):
     """Worker thread task to process client connections."""
     while True:
-        conn, addr = task_queue.get()
+        conn, addr, accepted_at, enqueued_at = task_queue.get()
         if conn is None:
             break
-        handle_client(conn, addr)
-        task_queue.task_done()
+        try:
+            handle_client(conn, addr, accepted_at, enqueued_at)
+        except Exception as e:
+            # A handler bug ends its connection, not the worker: the pool never shrinks
+            print(f"Error handling {addr}: {e!r}")
+        finally:
+            task_queue.task_done()
 
 def main():
     """Main function to start the server with Round Robin scheduling."""
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen(5)
-    print(f"Server running on http://{HOST}:{PORT}")
+    global task_queue, cluster, server_context, reloader, reverse_proxy, static_bundle
+    # A reloaded generation takes over the listening socket instead of binding a new one
+    server_socket = inherited_listener() or create_listener(HOST, PORT, SOCKET_OPTIONS)
+    # accept() wakes up now and then to notice that the next generation took over
+    server_socket.settimeout(ACCEPT_POLL_INTERVAL)
+    startup.mark('listening')
+    server_context = tls_context(TLS_CERT_FILE, TLS_KEY_FILE, TLS_ALPN)
+    print(f"Server running on {'https' if server_context else 'http'}://{HOST}:{PORT} "
+          f"(generation {startup.generation}, pid {os.getpid()})")
+
+    # Read the previous generation's hot files before taking traffic, so a deploy starts warm
+    if CACHE_SNAPSHOT_FILE:
+        warmed = file_cache.load(CACHE_SNAPSHOT_FILE)
+        print(f"Warmed {warmed} files from {CACHE_SNAPSHOT_FILE} in {startup.mark('warmed') * 1000:.1f} ms")
+
+    if CLUSTER_NODES:
+        cluster = Cluster(f"{HOST}:{PORT}", CLUSTER_NODES)
+        print(f"Cluster node {cluster.node} of {', '.join(cluster.ring.nodes)}")
+
+    # Files created behind the server's back end a cached 404
+    missing_paths.fold_repeats(NOT_FOUND_LOG_WINDOW, log_folded_not_found)
+    missing_paths.watch(STATIC_DIR)
+
+    if STATIC_BUNDLE:
+        static_bundle = BundleStore(STATIC_BUNDLE)
+        static_bundle.watch()
+        stats = static_bundle.stats()
+        print(f"Serving {stats['bundle_entries']} files from {STATIC_BUNDLE} built {stats['bundle_built']}")
+
+    if PROXY_ROUTES:
+        reverse_proxy = ReverseProxy(PROXY_ROUTES, PROXY_BALANCE, PROXY_MAX_CONNECTIONS, PROXY_HEALTH_PATH)
+        # Literal prefixes win over the static mount at the root
+        for group in reverse_proxy.groups:
+            router.mount(group.prefix, proxy_route(group), PROXY_METHODS)
+            print(f"Proxying {group.prefix} to {', '.join(upstream.address for upstream in group.upstreams)} "
+                  f"({group.balance})")
+        reverse_proxy.start_health_checks()
+
+    if CAPTURE_FILE:
+        capture.start(CAPTURE_FILE)
+
+    # SIGUSR1 opens a sampling profile window without a restart. Signal handlers
+    # can only be installed from the main thread; main() run from another has none.
+    if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, lambda signum, frame: start_profile('sample'))
 
     # Queue to hold client tasks (connections)
-    task_queue = Queue()
+    task_queue = Queue(maxsize=MAX_QUEUED_CONNECTIONS)
 
     # Create worker threads (Round Robin pool)
     workers = []
@@ -146,19 +945,60 @@ def main():
         worker.start()
         workers.append(worker)
 
+    reloader = Reloader(server_socket, save_cache_snapshot)
+    if (RELOAD_SIGNAL and hasattr(signal, RELOAD_SIGNAL)
+            and threading.current_thread() is threading.main_thread()):
+        signal.signal(getattr(signal, RELOAD_SIGNAL), lambda signum, frame: reloader.request())
+
+    # The previous generation, if any, stops accepting once this one is ready
+    notify_ready()
+    startup.mark('ready')
+
     try:
-        while True:
-            conn, addr = server_socket.accept()
-            task_queue.put((conn, addr))  # Distribute tasks in Round Robin fashion
+        while not reloader.ready.is_set():
+            try:
+                conn, addr = server_socket.accept()
+            except socket.timeout:
+                continue
+            accepted_at = time.perf_counter()
+            tune_connection(conn, SOCKET_OPTIONS)
+            # The handshake itself runs on the worker, so accept() never waits on a client
+            conn = wrap(server_context, conn)
+            try:
+                task_queue.put_nowait((conn, addr, accepted_at, time.perf_counter()))  # Distribute tasks in Round Robin fashion
+            except Full:
+                # Shed load rather than queue without bound; a TLS client would need a handshake first
+                if server_context is None:
+                    conn.sendall(BUSY_RESPONSE)
+                conn.close()
+                log_request(f"Connection from {addr}", "503 Service Unavailable (queue full)")
     except KeyboardInterrupt:
         print("Shutting down the server...")
     finally:
-        # Stop workers and close server
+        # Queued connections are still served; keep-alive ones close after their current request
+        drain_started = time.perf_counter()
+        drain_connections()
         for _ in range(WORKER_COUNT):
-            task_queue.put((None, None))  # Signal workers to exit
+            task_queue.put((None, None, None, None))  # Signal workers to exit
+        for worker in workers:
+            worker.join(max(drain_started + DRAIN_IDLE_GRACE - time.perf_counter(), 0))
+        close_idle_connections()
         for worker in workers:
-            worker.join()
+            worker.join(max(drain_started + DRAIN_TIMEOUT - time.perf_counter(), 0))
+        busy = sum(worker.is_alive() for worker in workers)
+        print(f"Generation {startup.generation} drained in "
+              f"{(time.perf_counter() - drain_started) * 1000:.1f} ms"
+              + (f", {busy} workers still busy" if busy else ""))
+        # 404s still folded into an open window would otherwise never be logged
+        missing_paths.flush(force=True)
+        if not reloader.ready.is_set():
+            # Stopping for good: the snapshot lets the next launch start warm
+            save_cache_snapshot()
+        capture.stop()
+        # The next generation holds its own reference, so this leaves the socket listening
         server_socket.close()
+        if busy:
+            os._exit(0)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,79 @@
+import socket
+
+# Default socket tuning. Options the platform does not support are skipped.
+DEFAULT_SOCKET_OPTIONS = {
+    'reuse_addr': True,       # SO_REUSEADDR: rebind right after a restart
+    'backlog': 1024,          # listen() backlog; 5 drops SYNs under any burst
+    'nodelay': True,          # TCP_NODELAY: no Nagle delay on small keep-alive responses
+    'defer_accept': 5,        # TCP_DEFER_ACCEPT: wake accept() only once data arrives (seconds)
+    'fastopen': 256,          # TCP_FASTOPEN: queue length for data-in-SYN connections
+    'sndbuf': None,           # SO_SNDBUF in bytes, None keeps the kernel default
+    'rcvbuf': None,           # SO_RCVBUF in bytes, None keeps the kernel default
+}
+# TCP_QUICKACK is left out on purpose: Linux clears it again after the next
+# ACK, so setting it once per connection does not change anything measurable.
+
+# Options applied to the listening socket and to each accepted connection
+LISTENER_OPTIONS = ('reuse_addr', 'defer_accept', 'fastopen', 'sndbuf', 'rcvbuf')
+CONNECTION_OPTIONS = ('nodelay', 'sndbuf', 'rcvbuf')
+
+
+def _socket_option(name):
+    """Return (level, optname) for an option, or None when unsupported."""
+    if name == 'reuse_addr':
+        return socket.SOL_SOCKET, socket.SO_REUSEADDR
+    if name == 'sndbuf':
+        return socket.SOL_SOCKET, socket.SO_SNDBUF
+    if name == 'rcvbuf':
+        return socket.SOL_SOCKET, socket.SO_RCVBUF
+    constant = {
+        'nodelay': 'TCP_NODELAY',
+        'defer_accept': 'TCP_DEFER_ACCEPT',
+        'fastopen': 'TCP_FASTOPEN',
+    }[name]
+    optname = getattr(socket, constant, None)
+    if optname is None:
+        return None
+    return socket.IPPROTO_TCP, optname
+
+
+def resolve_options(options=None):
+    """Merge user supplied options over the defaults."""
+    merged = dict(DEFAULT_SOCKET_OPTIONS)
+    if options:
+        merged.update(options)
+    return merged
+
+
+def apply_options(sock, options, names):
+    """Set the given options on a socket; return the names actually applied."""
+    applied = []
+    for name in names:
+        value = options.get(name)
+        if value is None or value is False:
+            continue
+        option = _socket_option(name)
+        if option is None:
+            continue
+        try:
+            sock.setsockopt(option[0], option[1], int(value))
+        except OSError:
+            continue  # Not supported by this kernel / socket family
+        applied.append(name)
+    return applied
+
+
+def create_listener(host, port, options=None):
+    """Create, tune, bind and listen on a TCP socket."""
+    options = resolve_options(options)
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    apply_options(server_socket, options, LISTENER_OPTIONS)
+    server_socket.bind((host, port))
+    server_socket.listen(options['backlog'])
+    return server_socket
+
+
+def tune_connection(conn, options=None):
+    """Apply per-connection options to an accepted socket."""
+    return apply_options(conn, resolve_options(options), CONNECTION_OPTIONS)
+
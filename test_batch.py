@@ -0,0 +1,68 @@
+import os
+from http.client import HTTPConnection
+
+import pytest
+
+import server8
+from batch import FORMATS, read_frames, read_multipart
+from harness import HOST, start_server
+
+# Configuration
+OUTSIDE = 'server8.py'  # A file next to STATIC_DIR that a batch must never return
+
+# Query values as sent, percent-encoding included: parse_qs decodes them before batch_part sees them
+ESCAPES = ['/../' + OUTSIDE, '../' + OUTSIDE, '%2F..%2F' + OUTSIDE, '/..%2F' + OUTSIDE,
+           '%2E%2E%2F' + OUTSIDE, '/%2E%2E/%2E%2E/etc/passwd']
+
+
+@pytest.fixture(scope='module')
+def port():
+    server_socket = start_server()
+    yield server_socket.getsockname()[1]
+    server_socket.close()
+
+
+@pytest.fixture(scope='module')
+def present():
+    """The path of a file in STATIC_DIR, and its contents."""
+    for name in sorted(os.listdir(server8.STATIC_DIR)):
+        file_path = os.path.join(server8.STATIC_DIR, name)
+        if os.path.isfile(file_path):
+            with open(file_path, 'rb') as file:
+                return '/' + name, file.read()
+    pytest.skip(f"{server8.STATIC_DIR} has no file to fetch")
+
+
+def fetch(port, query):
+    """Make one batch request with query sent verbatim; return (status, [(status, path, body)])."""
+    connection = HTTPConnection(HOST, port, timeout=10)
+    try:
+        connection.request('GET', f"{server8.BATCH_PATH}?{query}")
+        response = connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            return response.status, []
+        content_type = response.getheader('Content-Type', '')
+        if content_type.startswith('multipart/'):
+            return response.status, read_multipart(body, content_type.partition('boundary=')[2])
+        return response.status, read_frames(body)
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_found_and_missing(port, present, format):
+    path, expected = present
+    status, parts = fetch(port, f"path={path}&path=/no-such-file&format={format}")
+    assert status == 200
+    assert [part[0] for part in parts] == [200, 404]
+    assert parts[0][2] == expected
+
+
+@pytest.mark.parametrize('escape', ESCAPES)
+@pytest.mark.parametrize('format', FORMATS)
+def test_escape_is_not_found(port, format, escape):
+    status, parts = fetch(port, f"path={escape}&format={format}")
+    assert status == 200
+    assert [part[0] for part in parts] == [404]
+    assert not parts[0][2]
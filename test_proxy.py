@@ -0,0 +1,101 @@
+import os
+from http.client import HTTPConnection
+
+import pytest
+
+import server8
+from harness import HOST, start_server
+from proxy import ReverseProxy, StandInBackend
+
+# Configuration
+PREFIX = '/api/'
+BACKENDS = 2
+ECHO_SIZE = 1024 * 1024  # POST body streamed through the proxy and back
+
+
+@pytest.fixture(scope='module')
+def backends():
+    """Stand-in backends for the proxy, stopped when the module is done."""
+    backends = [StandInBackend().start() for _ in range(BACKENDS)]
+    yield backends
+    for backend in backends:
+        backend.stop()
+
+
+@pytest.fixture(scope='module')
+def group(backends):
+    """The upstream group server8 proxies PREFIX to."""
+    proxy = ReverseProxy({PREFIX: [backend.address for backend in backends]}, 'round_robin',
+                         health_path='/health')
+    for group in proxy.groups:
+        server8.router.mount(group.prefix, server8.proxy_route(group), server8.PROXY_METHODS)
+    return proxy.groups[0]
+
+
+@pytest.fixture(scope='module')
+def port(group):
+    server_socket = start_server()
+    yield server_socket.getsockname()[1]
+    server_socket.close()
+
+
+def fetch(port, method, path, body=None):
+    """Make one request; return (status, X-Backend, body)."""
+    connection = HTTPConnection(HOST, port, timeout=10)
+    try:
+        connection.request(method, path, body)
+        response = connection.getresponse()
+        return response.status, response.getheader('X-Backend'), response.read()
+    finally:
+        connection.close()
+
+
+def backend_ports(backends):
+    return {str(backend.server.server_address[1]) for backend in backends}
+
+
+def test_content_length(port):
+    status, backend, body = fetch(port, 'GET', f"{PREFIX}hello")
+    assert status == 200
+    assert body == f"backend {backend} {PREFIX}hello\n".encode()
+
+
+def test_round_robin(port, backends):
+    seen = {fetch(port, 'GET', f"{PREFIX}hello")[1] for _ in range(BACKENDS * 2)}
+    assert seen == backend_ports(backends)
+
+
+def test_chunked(port):
+    status, _, body = fetch(port, 'GET', f"{PREFIX}stream?chunks=5&size=1000")
+    assert status == 200
+    assert body == b'x' * 5000
+
+
+def test_close_delimited(port):
+    status, _, body = fetch(port, 'GET', f"{PREFIX}close?size=3000")
+    assert status == 200
+    assert body == b'y' * 3000
+
+
+def test_post_echo(port):
+    payload = os.urandom(ECHO_SIZE)
+    status, _, body = fetch(port, 'POST', f"{PREFIX}echo", payload)
+    assert status == 200
+    assert body == payload
+
+
+def test_failover_and_recovery(port, backends, group):
+    # Failover: GETs go to the remaining backend once one is gone
+    stopped = backends[0]
+    stopped_port = stopped.server.server_address[1]
+    stopped.stop()
+    answers = [fetch(port, 'GET', f"{PREFIX}hello")[:2] for _ in range(BACKENDS * 2)]
+    assert answers == [(200, str(backends[1].server.server_address[1]))] * len(answers)
+    assert [upstream.address for upstream in group.upstreams if not upstream.healthy] == [stopped.address]
+
+    # Recovery: a passing health check puts the backend back in rotation
+    backends[0] = StandInBackend(stopped_port).start()
+    for upstream in group.upstreams:
+        group.check(upstream)
+    seen = {fetch(port, 'GET', f"{PREFIX}hello")[1] for _ in range(BACKENDS * 2)}
+    assert seen == backend_ports(backends)
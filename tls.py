@@ -0,0 +1,176 @@
+import argparse
+import os
+import socket
+import ssl
+import subprocess
+import threading
+import time
+
+from connection import read_response
+
+# Configuration
+SESSION_TICKETS = 2           # TLS 1.3 tickets sent after each full handshake
+CERT_DIR = './certs'
+DEFAULT_ALPN = ('http/1.1',)
+
+_contexts = {}  # (cert, key, alpn) -> SSLContext, one per process
+_contexts_lock = threading.Lock()
+
+
+class TLSStats:
+    """Handshake counters for the current process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.full = 0
+        self.resumed = 0
+        self.failed = 0
+        self.full_seconds = 0.0
+        self.resumed_seconds = 0.0
+        self.protocols = {}  # ALPN protocol -> connections
+
+    def record(self, seconds, resumed, protocol):
+        with self.lock:
+            if resumed:
+                self.resumed += 1
+                self.resumed_seconds += seconds
+            else:
+                self.full += 1
+                self.full_seconds += seconds
+            self.protocols[protocol] = self.protocols.get(protocol, 0) + 1
+
+    def stats(self, context=None):
+        with self.lock:
+            handshakes = self.full + self.resumed
+            stats = {
+                'handshakes': handshakes,
+                'full_handshakes': self.full,
+                'resumed_handshakes': self.resumed,
+                'failed_handshakes': self.failed,
+                'resumption_rate': f"{self.resumed / handshakes:.3f}" if handshakes else '-',
+                'full_handshake_ms': f"{self.full_seconds / self.full * 1000:.3f}" if self.full else '-',
+                'resumed_handshake_ms': (f"{self.resumed_seconds / self.resumed * 1000:.3f}"
+                                         if self.resumed else '-'),
+                **{f"alpn_{protocol}": count for protocol, count in self.protocols.items()},
+            }
+        if context is not None:
+            # OpenSSL's server-side session cache, shared by every connection of the context
+            stats.update({f"sessions_{key}": value for key, value in context.session_stats().items()})
+        return stats
+
+
+stats = TLSStats()
+
+
+def tls_context(cert_file, key_file, alpn=DEFAULT_ALPN):
+    """Return this process's server context for a certificate, or None without one.
+
+    The context is created once and shared by every connection, so they all
+    use one session cache and one set of ticket keys. Call it in main()
+    before starting worker processes: forked workers inherit the context
+    and can resume each other's tickets.
+    """
+    if not cert_file:
+        return None
+    key = (cert_file, key_file, tuple(alpn))
+    with _contexts_lock:
+        context = _contexts.get(key)
+        if context is None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.minimum_version = ssl.TLSVersion.TLSv1_2
+            context.load_cert_chain(cert_file, key_file)
+            context.set_alpn_protocols(list(alpn))
+            context.num_tickets = SESSION_TICKETS
+            # A read side shut down locally (an HTTP/2 drain) reads as a clean EOF, not a fatal alert
+            context.options |= getattr(ssl, 'OP_IGNORE_UNEXPECTED_EOF', 0)
+            _contexts[key] = context
+    return context
+
+
+def wrap(context, conn):
+    """Wrap an accepted socket; the handshake is left to handshake() in the handler.
+
+    Leaving it out of the accept loop means a slow client never blocks accept().
+    """
+    if context is None:
+        return conn
+    return context.wrap_socket(conn, server_side=True, do_handshake_on_connect=False)
+
+
+def handshake(conn):
+    """Complete the TLS handshake of a wrapped socket and record its cost.
+
+    Plain sockets pass straight through. Returns False if the handshake
+    failed, in which case the connection should be closed.
+    """
+    if not isinstance(conn, ssl.SSLSocket):
+        return True
+    start = time.perf_counter()
+    try:
+        conn.do_handshake()
+    except (ssl.SSLError, OSError):
+        with stats.lock:
+            stats.failed += 1
+        return False
+    stats.record(time.perf_counter() - start, conn.session_reused,
+                 conn.selected_alpn_protocol() or 'none')
+    return True
+
+
+def generate_self_signed(cert_file, key_file, hosts=('localhost', '127.0.0.1'), days=30):
+    """Write a self-signed certificate and key for local testing, using the openssl CLI."""
+    os.makedirs(os.path.dirname(cert_file) or '.', exist_ok=True)
+    names = ','.join(f"IP:{host}" if host.replace('.', '').isdigit() or ':' in host else f"DNS:{host}"
+                     for host in hosts)
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-sha256',
+                    '-days', str(days), '-subj', f"/CN={hosts[0]}", '-addext', f"subjectAltName={names}",
+                    '-keyout', key_file, '-out', cert_file],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def measure_resumption(host, port, count, cafile, path='/index.html'):
+    """Connect count times, resuming the previous session; return (full ms, resumed ms, reused)."""
+    context = ssl.create_default_context(cafile=cafile)
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode()
+    session = None
+    full, resumed = [], []
+    for _ in range(count):
+        with socket.create_connection((host, port)) as raw:
+            start = time.perf_counter()
+            with context.wrap_socket(raw, server_hostname=host, session=session) as conn:
+                elapsed = time.perf_counter() - start
+                (resumed if conn.session_reused else full).append(elapsed)
+                conn.sendall(request)
+                # TLS 1.3 tickets arrive after the handshake, ahead of the response
+                read_response(conn)
+                session = conn.session
+    average = lambda values: sum(values) / len(values) * 1000 if values else 0.0
+    return average(full), average(resumed), len(resumed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TLS helpers for the server variants.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    cert = commands.add_parser('selfsigned', help="write a self-signed certificate for local testing")
+    cert.add_argument('--cert', default=os.path.join(CERT_DIR, 'cert.pem'))
+    cert.add_argument('--key', default=os.path.join(CERT_DIR, 'key.pem'))
+    cert.add_argument('--host', action='append', help="name or IP to certify (default localhost, 127.0.0.1)")
+    bench = commands.add_parser('resume', help="compare full and resumed handshakes against a server")
+    bench.add_argument('--host', default='localhost')
+    bench.add_argument('--port', type=int, default=8080)
+    bench.add_argument('--count', type=int, default=50)
+    bench.add_argument('--cafile', default=os.path.join(CERT_DIR, 'cert.pem'))
+    args = parser.parse_args()
+
+    if args.command == 'selfsigned':
+        generate_self_signed(args.cert, args.key, tuple(args.host or ('localhost', '127.0.0.1')))
+        print(f"Wrote {args.cert} and {args.key}")
+    else:
+        full_ms, resumed_ms, reused = measure_resumption(args.host, args.port, args.count, args.cafile)
+        print(f"{args.count} connections, {reused} resumed ({reused / args.count * 100:.1f}%)")
+        print(f"full handshake    {full_ms:8.3f} ms")
+        print(f"resumed handshake {resumed_ms:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
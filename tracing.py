@@ -0,0 +1,139 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+# Configuration
+SLOW_TRACE_COUNT = 50  # Slowest traces kept for the admin view
+
+# Phases in display order
+PHASES = ('accept', 'queue', 'handshake', 'recv', 'parse', 'handler', 'file', 'forward', 'log_lock', 'log', 'send')
+
+_local = threading.local()
+_lock = threading.Lock()
+_slowest = []  # Min-heap of (duration, seq, trace), bounded to SLOW_TRACE_COUNT
+_sequence = itertools.count()
+_phase_totals = {}  # phase -> [total seconds, span count]
+_trace_count = 0
+
+
+class Trace:
+    """Timing spans of one request, in perf_counter seconds."""
+
+    def __init__(self, label='', started=None):
+        self.label = label
+        self.started = time.perf_counter() if started is None else started
+        self.finished = None
+        self.wall_time = time.time()
+        self.status = None
+        self.spans = []  # (phase, start, end)
+
+    @property
+    def duration(self):
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return end - self.started
+
+    def phase_times(self):
+        """Return the total time per phase; nested phases are counted separately."""
+        totals = {}
+        for phase, start, end in self.spans:
+            totals[phase] = totals.get(phase, 0.0) + (end - start)
+        return totals
+
+
+def begin_trace(label='', started=None):
+    """Start a trace for the request handled by the current thread."""
+    trace = Trace(label, started)
+    _local.trace = trace
+    return trace
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+def note_status(status):
+    """Remember the response status code of the current request."""
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.status = status
+
+
+def add_span(phase, start, end=None):
+    """Record a span with explicit timestamps on the current trace."""
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.spans.append((phase, start, time.perf_counter() if end is None else end))
+
+
+@contextmanager
+def span(phase):
+    """Time the enclosed block as one span of the current trace."""
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append((phase, start, time.perf_counter()))
+
+
+def end_trace():
+    """Finish the current trace and keep it if it is among the slowest."""
+    global _trace_count
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return None
+    _local.trace = None
+    trace.finished = time.perf_counter()
+    duration = trace.duration
+    phases = trace.phase_times()
+    with _lock:
+        _trace_count += 1
+        for phase, seconds in phases.items():
+            totals = _phase_totals.setdefault(phase, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+        entry = (duration, next(_sequence), trace)
+        if len(_slowest) < SLOW_TRACE_COUNT:
+            heapq.heappush(_slowest, entry)
+        elif duration > _slowest[0][0]:
+            heapq.heapreplace(_slowest, entry)
+    return trace
+
+
+def slowest_traces():
+    """Return the kept traces, slowest first."""
+    with _lock:
+        return [trace for _, _, trace in sorted(_slowest, reverse=True)]
+
+
+def reset_traces():
+    global _trace_count
+    with _lock:
+        _slowest.clear()
+        _phase_totals.clear()
+        _trace_count = 0
+
+
+def format_report():
+    """Render per-phase averages and the slowest traces as plain text."""
+    with _lock:
+        count = _trace_count
+        totals = {phase: tuple(values) for phase, values in _phase_totals.items()}
+    lines = [f"Traced requests: {count}", "", "Average per phase (ms):"]
+    for phase in PHASES:
+        if phase in totals:
+            seconds, spans = totals[phase]
+            lines.append(f"  {phase:<9}{seconds / spans * 1000:>10.3f}  ({spans} requests)")
+
+    lines += ["", f"Slowest {SLOW_TRACE_COUNT} requests (ms):"]
+    for trace in slowest_traces():
+        phases = trace.phase_times()
+        detail = ' '.join(f"{phase}={phases[phase] * 1000:.3f}" for phase in PHASES if phase in phases)
+        stamp = time.strftime('%H:%M:%S', time.gmtime(trace.wall_time))
+        lines.append(f"  {trace.duration * 1000:>9.3f}  [{stamp}] {trace.label} -> {trace.status}  {detail}")
+    return '\n'.join(lines) + '\n'